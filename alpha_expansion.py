@@ -0,0 +1,192 @@
+# 惰性模板展开
+# 功能：把各个槽位取值的笛卡尔积按需逐条生成，不在内存中构造表达式列表；
+#      总数由各槽位大小相乘得到，从任意偏移量开始时直接按混合进制解码出起始组合，不遍历被跳过的部分；
+#      生成的 (表达式, settings) 按固定大小的块追加写入CSV，每写完一块记录一次进度，中断后可从断点继续
+import csv
+import json
+import os
+from itertools import islice
+from math import prod
+
+
+def count_combinations(slot_values):
+    """
+    组合总数（各槽位取值数量的乘积）
+
+    Args:
+        slot_values: 每个槽位的取值序列组成的列表
+    """
+    return prod(len(values) for values in slot_values)
+
+
+def iter_combinations(slot_values, offset=0):
+    """
+    从第offset个组合开始逐个生成槽位取值组合（与 itertools.product 的顺序一致）
+
+    Args:
+        slot_values: 每个槽位的取值序列组成的列表（需支持len和下标访问）
+        offset: 起始偏移量
+
+    Yields:
+        tuple: 每个槽位各取一个值
+    """
+    slot_values = [values if hasattr(values, '__getitem__') else list(values) for values in slot_values]
+    sizes = [len(values) for values in slot_values]
+    if offset >= prod(sizes):
+        return
+    # 混合进制解码：最后一个槽位变化最快
+    indices = []
+    remainder = offset
+    for size in reversed(sizes):
+        remainder, index = divmod(remainder, size)
+        indices.append(index)
+    indices.reverse()
+
+    while True:
+        yield tuple(values[i] for values, i in zip(slot_values, indices))
+        # 里程表式进位
+        pos = len(indices) - 1
+        while pos >= 0:
+            indices[pos] += 1
+            if indices[pos] < sizes[pos]:
+                break
+            indices[pos] = 0
+            pos -= 1
+        if pos < 0:
+            return
+
+
+def load_progress(progress_path, total):
+    """
+    读取上次写到的偏移量
+
+    Args:
+        progress_path: 进度文件路径
+        total: 本次的组合总数；与进度文件中的总数不一致时说明模板或数据字段已变化，从头开始
+
+    Returns:
+        dict: {'offset', 'csv_size'}，没有可用进度时返回None
+    """
+    try:
+        with open(progress_path, encoding='utf-8') as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if progress.get('total') != total:
+        print(f"进度文件中的组合总数 {progress.get('total')} 与当前 {total} 不一致，从头开始")
+        return None
+    return progress
+
+
+def save_progress(progress_path, total, offset, csv_size):
+    tmp_path = progress_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'total': total, 'offset': offset, 'csv_size': csv_size}, f)
+    os.replace(tmp_path, progress_path)
+
+
+# 生成的CSV至少包含的列
+REQUIRED_COLUMNS = ['type', 'settings', 'regular']
+
+
+def read_csv_header(csv_path):
+    """已有CSV的表头（列名列表），文件不存在或为空时返回None"""
+    if not os.path.isfile(csv_path) or os.path.getsize(csv_path) == 0:
+        return None
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f), None)
+
+
+def add_csv_column(csv_path, column):
+    """
+    给已有CSV追加一列（已有行的值为空），先写临时文件再替换，中途中断不会损坏原文件
+
+    Returns:
+        list: 新的表头
+    """
+    tmp_path = csv_path + '.tmp'
+    with open(csv_path, newline='', encoding='utf-8') as src, \
+            open(tmp_path, 'w', newline='', encoding='utf-8') as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst)
+        header = next(reader) + [column]
+        writer.writerow(header)
+        for row in reader:
+            writer.writerow(row + [''] * (len(header) - len(row)))
+    os.replace(tmp_path, csv_path)
+    return header
+
+
+def stream_to_csv(records, csv_path, total, offset=0, chunk_size=10000, progress_path=None,
+                  with_bindings=False):
+    """
+    把 (表达式, settings) 记录按块追加写入CSV（列：type,settings,regular）
+
+    每写完一块就flush并记录偏移量和CSV文件大小；续写时先把CSV截断到记录的大小，
+    丢弃上次中断时写了一半的块，保证不重复也不遗漏。
+    追加到已有CSV时按它的表头写入（如仿真脚本加上的 status、alpha_id 等列留空）；
+    需要写 bindings 而已有CSV没有这一列时，先给整个文件加上这一列。
+
+    Args:
+        records: (expression, settings) 可迭代对象，从offset处开始
+        csv_path: 输出CSV路径
+        total: 组合总数（仅用于进度显示和进度文件）
+        offset: records中第一条记录的偏移量
+        chunk_size: 每块记录数
+        progress_path: 进度文件路径，None表示不记录进度
+        with_bindings: records 是 (expression, settings, bindings)，额外写一列 bindings（JSON）
+
+    Returns:
+        int: 本次写入的记录数
+    """
+    file_exists = os.path.isfile(csv_path)
+    if file_exists and progress_path is not None:
+        progress = load_progress(progress_path, total)
+        if progress is not None and progress['offset'] == offset \
+                and os.path.getsize(csv_path) > progress['csv_size']:
+            with open(csv_path, 'r+b') as f:
+                f.truncate(progress['csv_size'])
+
+    header = read_csv_header(csv_path)
+    if header is not None:
+        missing = [column for column in REQUIRED_COLUMNS if column not in header]
+        if missing:
+            raise ValueError(f"CSV文件 {csv_path} 缺少必要的列: {', '.join(missing)}")
+        if with_bindings and 'bindings' not in header:
+            print(f"CSV文件 {csv_path} 没有 bindings 列，添加该列（已有的行留空）")
+            header = add_csv_column(csv_path, 'bindings')
+            # 文件大小变了，进度中记录的大小随之更新，否则下次续写会按旧大小截断
+            if progress_path is not None:
+                save_progress(progress_path, total, offset, os.path.getsize(csv_path))
+
+    written = 0
+    records = iter(records)
+    with open(csv_path, 'a', newline='', encoding='utf-8') as output_file:
+        if header is None:
+            header = REQUIRED_COLUMNS + (['bindings'] if with_bindings else [])
+            csv.writer(output_file).writerow(header)
+        # 按已有表头的列名写入，表头中多出的列留空
+        writer = csv.DictWriter(output_file, fieldnames=header, restval='')
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            # 注意：settings 是嵌套字典，需要转换为 JSON 字符串才能写入 CSV
+            if with_bindings:
+                writer.writerows(
+                    {'type': 'REGULAR', 'settings': json.dumps(settings), 'regular': expression,
+                     'bindings': json.dumps(bindings)}
+                    for expression, settings, bindings in chunk
+                )
+            else:
+                writer.writerows(
+                    {'type': 'REGULAR', 'settings': json.dumps(settings), 'regular': expression}
+                    for expression, settings in chunk
+                )
+            output_file.flush()
+            written += len(chunk)
+            if progress_path is not None:
+                save_progress(progress_path, total, offset + written,
+                              os.fstat(output_file.fileno()).st_size)
+            print(f"已写入 {offset + written}/{total} 个alpha")
+    return written
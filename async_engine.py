@@ -0,0 +1,550 @@
+# Alpha批量仿真和回测脚本（从CSV读取）- asyncio版本
+# 功能：用协程完成提交、轮询、检查、打标签，一个进程即可同时保持成百上千个仿真在途，
+#      而不需要为每个仿真占用一个线程；处理结果与 simulate_from_csv.py 相同，状态同样写入状态数据库，
+#      每一步的进度URL和阶段也立即写入，中断后重新运行时从记录的阶段继续
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime
+
+import aiohttp
+from multidict import CIMultiDict
+
+from simulate_and_check_for1 import (
+    load_credentials, extract_alpha_id, parse_check_result, merge_check_details, check_expression, simulation_started,
+    child_progress_url, UNRESUMABLE_STATUSES, DEFAULT_SIMULATION_SETTINGS, DEFAULT_TOKEN_EXPIRY, API_BASE
+)
+from rate_limiter import RATE_LIMITER, parse_retry_after, backoff_delay
+from simulate_from_csv import (
+    parse_settings, decide_alpha_tag, lookup_cached_result, save_result_to_cache, journal_submitted, journal_stage,
+    DEFAULT_CSV_PATH
+)
+from state_store import (
+    AlphaStateStore, PendingTaskQueue, default_db_path, resume_point,
+    STAGE_SUBMITTED, STAGE_COMPLETED, STAGE_CHECKED, STAGE_TAGGED
+)
+from result_cache import ResultCache, default_cache_path
+from metrics import METRICS, endpoint_of, rss_bytes, result_label
+from readiness import ALPHA_READINESS, CHECK_READINESS, alpha_info_ready
+from session_pool import SessionPool
+from tag_queue import TagQueue, default_tag_db_path
+from results_warehouse import ResultsWarehouse, default_warehouse_dir
+from operator_catalog import OperatorCatalog
+
+
+class AsyncResponse:
+    """已读取完毕的aiohttp响应，提供与requests.Response相同的常用接口"""
+
+    __slots__ = ('status_code', 'headers', 'text')
+
+    def __init__(self, status_code, headers, text):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncBrainClient:
+    """
+    WorldQuant Brain API的异步客户端
+
+    所有协程共享一个aiohttp会话（连接池）；遇到401时只重新认证一次，
+    其他同时遇到401的协程等待认证完成后直接重试。
+
+    用法:
+        async with AsyncBrainClient() as client:
+            alpha_id = await client.simulate_alpha(expr, settings)
+    """
+
+    def __init__(self, max_connections=100):
+        """
+        Args:
+            max_connections: aiohttp连接池的最大连接数
+        """
+        self.max_connections = max_connections
+        self.token_expires_at = 0
+        self._session = None
+        self._auth_lock = None
+        self._auth_generation = 0
+
+    async def __aenter__(self):
+        username, password = load_credentials()
+        self._auth_lock = asyncio.Lock()
+        self._session = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(username, password),
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            # 允许IP地址主机设置cookie（WQ_API_BASE指向本地模拟服务器时需要）
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+        )
+        await self.sign_in()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+
+    async def sign_in(self, generation=None):
+        """
+        登录WorldQuant Brain API
+
+        Args:
+            generation: 发起请求时的认证代数；如果其他协程已经重新认证过，则跳过
+        """
+        async with self._auth_lock:
+            if generation is not None and generation != self._auth_generation:
+                return
+            await RATE_LIMITER.acquire_async()
+            async with self._session.post(f"{API_BASE}/authentication") as resp:
+                body = await resp.text()
+            print(f"登录状态: {resp.status}")
+            METRICS.inc('auth_total', kind='login' if generation is None else 'relogin', status=resp.status)
+            # 认证失败时保持过期，下次请求前重新认证
+            self.token_expires_at = 0
+            if resp.status in (200, 201):
+                body = json.loads(body)
+                print(f"用户ID: {body.get('user', {}).get('id', 'N/A')}")
+                expiry = float(body.get('token', {}).get('expiry', DEFAULT_TOKEN_EXPIRY))
+                self.token_expires_at = asyncio.get_running_loop().time() + expiry
+            self._auth_generation += 1
+
+    async def requests_wq(self, type='get', url='', json_data=None, t=15, pass_statuses=()):
+        """封装请求协程，处理重试和错误（与同步版 requests_wq 行为一致，共用进程级限流器）"""
+        attempt = 0
+        endpoint = endpoint_of(url)
+        while True:
+            generation = self._auth_generation
+            with METRICS.timer('rate_limit_wait_seconds'):
+                await RATE_LIMITER.acquire_async()
+            try:
+                start = time.monotonic()
+                async with self._session.request(type.upper(), url, json=json_data) as resp:
+                    ret = AsyncResponse(resp.status, CIMultiDict(resp.headers), await resp.text())
+                METRICS.observe('http_request_seconds', time.monotonic() - start,
+                                method=type, endpoint=endpoint)
+                METRICS.inc('http_requests_total', method=type, endpoint=endpoint, status=ret.status_code)
+
+                if ret.status_code in pass_statuses:
+                    return ret
+                if ret.status_code == 429:
+                    METRICS.inc('http_retries_total', endpoint=endpoint, reason='429')
+                    retry_after = parse_retry_after(ret.headers)
+                    if retry_after is None:
+                        retry_after = backoff_delay(attempt, cap=t)
+                    RATE_LIMITER.on_throttle(retry_after)
+                    attempt += 1
+                    continue
+                if ret.status_code in (200, 201):
+                    RATE_LIMITER.on_success()
+                    return ret
+                if ret.status_code == 401:
+                    print("认证失败，重新登录...")
+                    METRICS.inc('relogins_total', reason='401')
+                    await self.sign_in(generation)
+                    continue
+                METRICS.inc('http_retries_total', endpoint=endpoint, reason=f'status_{ret.status_code}')
+                delay = backoff_delay(attempt)
+                print(f"\033[31m状态={ret.status_code}，{delay:.1f}秒后重试\033[0m")
+                await asyncio.sleep(delay)
+                attempt += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                METRICS.inc('http_retries_total', endpoint=endpoint, reason='connection_error')
+                METRICS.inc('relogins_total', reason='connection_error')
+                delay = backoff_delay(attempt)
+                print(f"请求错误: {e}. {delay:.1f}秒后重试...")
+                await asyncio.sleep(delay)
+                attempt += 1
+                await self.sign_in(generation)
+
+    async def simulate_alpha(self, expression, settings=None, on_submitted=None):
+        """
+        仿真一个alpha表达式
+
+        Args:
+            expression: alpha表达式字符串
+            settings: 仿真设置字典，如果为None则使用默认设置
+            on_submitted: 提交成功后的回调 on_submitted(进度URL)，用于立即持久化进度URL
+
+        Returns:
+            alpha_id: 仿真完成后的alpha ID，失败时返回None
+        """
+        if settings is None:
+            settings = dict(DEFAULT_SIMULATION_SETTINGS)
+
+        simulation_data = {
+            'type': 'REGULAR',
+            'settings': settings,
+            'regular': expression
+        }
+        with METRICS.timer('submit_seconds'):
+            sim_resp = await self.requests_wq(
+                'post', f"{API_BASE}/simulations", json_data=simulation_data
+            )
+        sim_progress_url = sim_resp.headers.get('Location')
+        if not sim_progress_url:
+            print("无法获取仿真进度URL")
+            return None
+        METRICS.inc('simulations_submitted_total', batch='false')
+        if on_submitted is not None:
+            on_submitted(sim_progress_url)
+
+        body = await self.wait_for_simulation(sim_progress_url)
+        return extract_alpha_id(body) if body else None
+
+    async def wait_for_simulation(self, sim_progress_url, record_metrics=True):
+        """
+        按Retry-After挂起协程轮询仿真进度，直到仿真结束（同同步版 wait_for_simulation）
+
+        Returns:
+            body: 仿真结束后进度接口的JSON字典，进度URL失效或返回不是JSON时返回None
+        """
+        start = time.monotonic()
+        queued = True
+        while True:
+            sim_progress_resp = await self.requests_wq('get', sim_progress_url)
+            if sim_progress_resp.status_code != 200:
+                print(f"获取仿真进度失败: HTTP {sim_progress_resp.status_code}")
+                return None
+            retry_after_sec = float(sim_progress_resp.headers.get("Retry-After", 0))
+            if record_metrics:
+                METRICS.inc('simulation_polls_total')
+                if queued and (retry_after_sec == 0 or simulation_started(sim_progress_resp)):
+                    METRICS.observe('simulation_queued_seconds', time.monotonic() - start)
+                    queued = False
+            if retry_after_sec == 0:  # simulation done!模拟完成!
+                break
+            await asyncio.sleep(retry_after_sec)
+        if record_metrics:
+            METRICS.observe('simulation_seconds', time.monotonic() - start)
+
+        try:
+            return sim_progress_resp.json()
+        except ValueError:
+            print("仿真完成但进度接口返回不是合法 JSON，原始内容为：")
+            print(sim_progress_resp.text)
+            return None
+
+    async def resume_simulation(self, resume):
+        """
+        继续等待上次已提交、还没有拿到Alpha ID的仿真（同同步版 resume_simulation）
+
+        Returns:
+            tuple: (alpha_id, resubmit)，resubmit 表示进度URL已失效或无权访问，需要重新提交
+        """
+        stage, progress_url, batch_index, alpha_id, _ = resume
+        if stage != STAGE_SUBMITTED:
+            return alpha_id, False
+        probe = await self.requests_wq('get', progress_url, pass_statuses=UNRESUMABLE_STATUSES)
+        if probe.status_code in UNRESUMABLE_STATUSES:
+            return None, True
+        body = await self.wait_for_simulation(progress_url, record_metrics=False)
+        if body is None:
+            return None, True
+        if batch_index >= 0:
+            children = body.get("children", [])
+            if batch_index >= len(children):
+                return None, False
+            body = await self.wait_for_simulation(child_progress_url(children[batch_index]), record_metrics=False)
+            if body is None:
+                return None, True
+        return extract_alpha_id(body), False
+
+    async def get_alpha_info(self, alpha_id):
+        """获取Alpha的详细信息"""
+        with METRICS.timer('alpha_info_seconds'):
+            response = await self.requests_wq('get', f"{API_BASE}/alphas/{alpha_id}")
+        if response.status_code == 200:
+            return response.json()
+        return None
+
+    async def wait_for_alpha_info(self, alpha_id, policy=ALPHA_READINESS):
+        """轮询Alpha信息直到IS指标就绪（同同步版 wait_for_alpha_info）"""
+        start = time.monotonic()
+        delay = policy.first_delay()
+        attempt = 0
+        while True:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            alpha_info = await self.get_alpha_info(alpha_id)
+            attempt += 1
+            elapsed = time.monotonic() - start
+            if alpha_info_ready(alpha_info):
+                policy.record_ready(elapsed)
+                METRICS.observe('alpha_ready_seconds', elapsed)
+                return alpha_info
+            delay = policy.next_delay(attempt, elapsed)
+            if delay is None:
+                print(f"Alpha {alpha_id}: 等待 {elapsed:.0f} 秒后IS指标仍未就绪，放弃等待")
+                return alpha_info
+
+    async def wait_for_check(self, alpha_id, policy=CHECK_READINESS, is_data=None):
+        """轮询检查结果直到不再是 "sleep"（同同步版 wait_for_check）"""
+        start = time.monotonic()
+        delay = policy.first_delay()
+        attempt = 0
+        while True:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            check_result = await self.get_check_submission(alpha_id, is_data)
+            attempt += 1
+            elapsed = time.monotonic() - start
+            if check_result != "sleep":
+                policy.record_ready(elapsed)
+                return check_result
+            delay = policy.next_delay(attempt, elapsed)
+            if delay is None:
+                print(f"Alpha {alpha_id}: 等待 {elapsed:.0f} 秒后检查数据仍未准备好，放弃等待")
+                return check_result
+
+    async def get_check_submission(self, alpha_id, is_data=None):
+        """
+        检查Alpha提交状态（is_data 同同步版 get_check_submission）
+
+        Returns:
+            check_result: 检查结果 ("SUCCESS", "ERROR", "FAIL", "nan", "sleep")
+        """
+        start = time.monotonic()
+        while True:
+            result = await self.requests_wq(
+                'get', f"{API_BASE}/alphas/{alpha_id}/check"
+            )
+            METRICS.inc('check_polls_total')
+            if "retry-after" in result.headers:
+                await asyncio.sleep(float(result.headers["Retry-After"]))
+            else:
+                break
+        METRICS.observe('check_wait_seconds', time.monotonic() - start)
+        check_body = result.json()
+        check_result = parse_check_result(alpha_id, check_body)
+        merge_check_details(is_data, check_body)
+        METRICS.inc('check_results_total', result=result_label(check_result))
+        return check_result
+
+    async def set_alpha_properties(self, alpha_id, name=None, color=None,
+                                   selection_desc="None", combo_desc="None",
+                                   tags="SUCCESS", regular_desc="None"):
+        """设置Alpha属性，包括标签（参数同同步版 set_alpha_properties）"""
+        tags = [tags] if isinstance(tags, str) else list(tags)
+        params = {
+            "color": color,
+            "name": name,
+            "tags": tags,
+            "category": None,
+            "regular": {"description": regular_desc},
+            "combo": {"description": combo_desc},
+            "selection": {"description": selection_desc},
+        }
+        with METRICS.timer('tag_seconds'):
+            response = await self.requests_wq(
+                'patch', f"{API_BASE}/alphas/{alpha_id}", json_data=params
+            )
+        METRICS.inc('tags_total', tag=','.join(tags))
+        return response
+
+
+async def process_single_alpha(client, expression, settings_str, row_index, index, total, cache=None,
+                               tagger=None, journal=None, resume=None):
+    """
+    处理单个alpha：仿真、回测、标记（协程版本）
+
+    Args:
+        client: AsyncBrainClient
+        expression: alpha表达式
+        settings_str: CSV中的settings字符串
+        row_index: DataFrame中的原始行索引
+        index: 当前alpha在处理队列中的索引（从0开始）
+        total: 总待处理alpha数量
+        cache: ResultCache结果缓存，None表示不使用缓存
+        tagger: TagQueue打标签队列，None表示在协程中当场打标签
+        journal: 记录处理阶段的状态存储，None表示不记录
+        resume: resume_point() 的结果，上次已提交的alpha从记录的阶段继续；None表示从头处理
+
+    Returns:
+        tuple: (success: bool, alpha_id: str, check_result: str, row_index: int, is_data: dict)
+    """
+    tag = f"[Alpha {index + 1}/{total}]"
+    settings = parse_settings(settings_str)
+    if settings is None:
+        print(f"{tag} 跳过: settings解析失败")
+        return False, None, "SETTINGS_ERROR", row_index, None
+    if resume is None:
+        cached = lookup_cached_result(cache, expression, settings, row_index)
+        if cached:
+            return cached
+        if not check_expression(expression):
+            return False, None, "INVALID_EXPRESSION", row_index, None
+
+    try:
+        alpha_id = None
+        if resume is not None:
+            print(f"{tag} [断点续跑] 从上次记录的阶段继续: {resume[0]}")
+            alpha_id, resubmit = await client.resume_simulation(resume)
+            if resubmit:
+                print(f"{tag} 上次的进度URL已失效，重新提交")
+                resume = None
+        if resume is None:
+            print(f"{tag} 开始仿真: {expression}")
+            alpha_id = await client.simulate_alpha(
+                expression, settings, on_submitted=lambda url: journal_submitted(journal, [row_index], url)
+            )
+        if not alpha_id:
+            print(f"{tag} 仿真失败")
+            return False, None, "SIMULATION_FAILED", row_index, None
+        if resume is None or resume[0] == STAGE_SUBMITTED:
+            journal_stage(journal, row_index, STAGE_COMPLETED, alpha_id=alpha_id)
+        stage = resume[0] if resume else None
+
+        # 轮询直到IS指标就绪（已就绪时立即返回）
+        alpha_info = await client.wait_for_alpha_info(alpha_id) or {}
+        is_data = alpha_info.get("is", {})
+        print(f"{tag} {alpha_id} Sharpe: {is_data.get('sharpe', 'N/A')} "
+              f"Fitness: {is_data.get('fitness', 'N/A')} Turnover: {is_data.get('turnover', 'N/A')}")
+
+        if stage in (STAGE_CHECKED, STAGE_TAGGED):
+            # 上次已经检查完成：直接使用记录的检查结果
+            check_result = resume[4]
+        else:
+            # 检查数据未准备好时按自适应间隔重试，直到就绪或达到停止条件
+            check_result = await client.wait_for_check(alpha_id, is_data=is_data)
+            journal_stage(journal, row_index, STAGE_CHECKED, check_result=check_result)
+
+        save_result_to_cache(cache, expression, settings, alpha_id, is_data, check_result)
+        tag_kwargs = decide_alpha_tag(check_result, is_data, alpha_info.get("tags", []))
+        if stage == STAGE_TAGGED:
+            tag_kwargs = None
+        if tag_kwargs and tagger is not None:
+            # 只写入本地队列，由后台线程发送，不占用在途名额
+            tagger.enqueue(alpha_id, **tag_kwargs)
+        elif tag_kwargs:
+            response = await client.set_alpha_properties(alpha_id, **tag_kwargs)
+            if response.status_code in (200, 201):
+                print(f"{tag} ✓ 成功为Alpha {alpha_id} 打上 {tag_kwargs['tags']} 标签")
+        if stage != STAGE_TAGGED:
+            journal_stage(journal, row_index, STAGE_TAGGED)
+        return check_result == "SUCCESS", alpha_id, check_result, row_index, is_data
+    except Exception as e:
+        print(f"{tag} 处理Alpha时发生错误: {e}")
+        return False, None, f"Exception: {str(e)}", row_index, None
+
+
+async def run_async(store, max_in_flight=100, cache=None, tagger=None, warehouse=None):
+    """
+    并发处理状态数据库中所有待处理的alpha
+
+    Args:
+        store: AlphaStateStore状态存储，每完成一个alpha写一行，处理中的每一步（进度URL、阶段）也立即写入
+        max_in_flight: 同时在途的仿真数量上限
+        cache: ResultCache结果缓存，None表示不使用缓存
+        tagger: TagQueue打标签队列，None表示在协程中当场打标签
+        warehouse: ResultsWarehouse列式结果仓库，None表示不写入
+
+    Returns:
+        tuple: (success_count, fail_count)
+    """
+    # 行在有空闲名额时才从状态数据库读出，同一时刻只有max_in_flight个协程，不为每行预先创建协程
+    task_queue = PendingTaskQueue(store)
+    total = len(task_queue)
+    success_count = 0
+    fail_count = 0
+    completed_count = 0
+
+    async with AsyncBrainClient(max_connections=max_in_flight) as client:
+        def start_next():
+            task = task_queue.next_task()
+            if task is None:
+                return None
+            row, row_index, index, _ = task
+            # 上次已提交的行从记录的阶段继续，不重新提交
+            return asyncio.ensure_future(process_single_alpha(
+                client, row['regular'], row['settings'], row_index, index, total, cache, tagger, store,
+                resume_point(row)
+            ))
+
+        running = {task for task in (start_next() for _ in range(max_in_flight)) if task}
+        while running:
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                success, alpha_id, check_result, row_index, is_data = task.result()
+                store.record_result(row_index, success, alpha_id, check_result)
+                if warehouse is not None:
+                    warehouse.record(task_queue.rows[row_index], 'SUCCESS' if success else 'FAILED',
+                                     alpha_id, check_result, is_data)
+                task_queue.finish(row_index)
+                METRICS.inc('alphas_processed_total', result=result_label(check_result))
+                rss = rss_bytes()
+                if rss is not None:
+                    METRICS.set_gauge('process_rss_bytes', rss)
+                completed_count += 1
+                if success:
+                    success_count += 1
+                else:
+                    fail_count += 1
+                print(f"\n[进度] 已完成 {completed_count}/{total} 个Alpha (成功: {success_count}, 失败: {fail_count})")
+                following = start_next()
+                if following is not None:
+                    running.add(following)
+    return success_count, fail_count
+
+
+def main():
+    """主函数：从CSV读取alpha列表，用asyncio并发批量处理"""
+    print("=" * 80)
+    print("Alpha批量仿真和回测脚本（从CSV读取）- asyncio版本")
+    print(f"开始时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 80)
+
+    # 在途仿真数量（可以在命令行参数中指定，默认100）
+    max_in_flight = 100
+    if len(sys.argv) > 1:
+        try:
+            max_in_flight = int(sys.argv[1])
+        except ValueError:
+            print(f"警告: 无效的并发数参数 '{sys.argv[1]}'，使用默认值100")
+    print(f"在途仿真数量上限: {max_in_flight}")
+
+    # CSV路径（第二个命令行参数，默认 DEFAULT_CSV_PATH）
+    csv_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_CSV_PATH
+    store = AlphaStateStore(default_db_path(csv_path))
+    try:
+        store.import_csv(csv_path)
+    except ValueError as e:
+        print(f"错误: {e}")
+        store.close()
+        return
+    print(f"待处理 {store.pending_count()} 个Alpha")
+    cache = ResultCache(default_cache_path(csv_path))
+    # 打标签队列：后台线程用单独的同步会话发送，与协程共用进程级限流器
+    tag_pool = SessionPool(size=1)
+    # 运算符目录：缓存过期时从 /operators 重新获取，提交前的本地校验以服务端的运算符为准
+    OperatorCatalog().get(tag_pool)
+    tagger = TagQueue(default_tag_db_path(csv_path), tag_pool).start()
+    warehouse = ResultsWarehouse(default_warehouse_dir(csv_path))
+
+    try:
+        success_count, fail_count = asyncio.run(run_async(store, max_in_flight, cache, tagger, warehouse))
+    except KeyboardInterrupt:
+        print("\n\n用户中断，进度已保存在状态数据库中，程序退出")
+        return
+    finally:
+        # 导出回CSV，保持与旧格式兼容
+        store.export_csv(csv_path)
+        store.close()
+        cache.close()
+        tagger.close()
+        tag_pool.close()
+        warehouse.close()
+        print("\n指标摘要:")
+        print(METRICS.summary())
+
+    print("\n" + "=" * 80)
+    print("处理完成！")
+    print(f"成功: {success_count}")
+    print(f"失败: {fail_count}")
+    print(f"完成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    # 用法: python async_engine.py [在途仿真数量]
+    main()
@@ -0,0 +1,228 @@
+# 槽位取值老虎机调度器
+# 功能：模板展开得到的是笛卡尔积，按CSV顺序仿真时，一个表现很差的数据字段会把所有 days/group 变体都跑一遍。
+#      这里把每个 (槽位, 取值) 当作一个臂（如 company_fundamentals=fnd6_acdo、days=65），
+#      每个alpha完成后按它的 Sharpe/Fitness 更新所涉及的臂的得分（UCB1），
+#      待处理队列按“所含各臂的UCB得分平均值”重新排序，优先仿真有希望的区域。
+#      配合 max_simulations（每日仿真配额）使用时，同样的仿真次数能找到更多 SUCCESS/POTENTIAL。
+#      臂的统计保存在 <csv>.bandit.json 中，第二天继续运行时接着用。
+#
+# 用法:
+#     bandit = SlotBandit.load(default_bandit_path(csv_path))
+#     queue = BanditTaskQueue(tasks, bandit, max_tasks=500)
+#     for alpha_row, row_index, index, total in queue:   # 每次取当前得分最高的待处理行
+#         ...
+#         queue.record(row_index, is_data, check_result)  # 结果反馈给老虎机
+#     bandit.save()
+import json
+import math
+import os
+import random
+import threading
+
+# 奖励归一化的目标值（与提交检查的 LOW_SHARPE / LOW_FITNESS 下限一致）
+SHARPE_TARGET = 1.25
+FITNESS_TARGET = 1.0
+
+
+def alpha_reward(is_data, check_result):
+    """
+    把一个alpha的结果换算成 [0, 1] 的奖励
+
+    检查通过记1；否则按 Sharpe、Fitness 相对目标值的平均完成度计分；仿真失败、表达式无效等没有指标时记0。
+    """
+    if check_result == "SUCCESS":
+        return 1.0
+    if not is_data:
+        return 0.0
+    sharpe = is_data.get('sharpe')
+    fitness = is_data.get('fitness')
+    if sharpe is None or fitness is None:
+        return 0.0
+    score = 0.5 * sharpe / SHARPE_TARGET + 0.5 * fitness / FITNESS_TARGET
+    return min(1.0, max(0.0, score))
+
+
+def row_bindings(alpha_row):
+    """
+    从状态数据库的行中取出槽位取值（枚举脚本写入的 bindings 列，保存在extra中）
+
+    Returns:
+        dict: {槽位名: 取值}，没有 bindings 列时返回空字典
+    """
+    try:
+        extra = json.loads(alpha_row['extra'] or '{}')
+        return json.loads(extra.get('bindings') or '{}')
+    except (KeyError, IndexError, TypeError, ValueError):
+        return {}
+
+
+def arm_keys(bindings):
+    """一组槽位取值涉及的臂，如 ['days=65', 'group="subindustry"']"""
+    return [f"{slot}={json.dumps(value)}" for slot, value in sorted(bindings.items())]
+
+
+class SlotBandit:
+    """
+    (槽位, 取值) 臂的UCB1得分（线程安全）
+
+    每个臂带 prior_count 次、平均奖励为 prior_mean 的先验观测，没见过的取值得分偏高，会先被尝试。
+    """
+
+    def __init__(self, path=None, exploration=0.5, prior_mean=0.5, prior_count=1.0):
+        """
+        Args:
+            path: 臂统计的保存路径，None表示不保存
+            exploration: UCB探索系数，越大越倾向于尝试样本少的取值
+            prior_mean: 先验平均奖励
+            prior_count: 先验观测次数
+        """
+        self.path = path
+        self.exploration = exploration
+        self.prior_mean = prior_mean
+        self.prior_count = prior_count
+        self._lock = threading.Lock()
+        self._arms = {}  # 臂 -> [观测次数, 奖励之和]
+        self._total = 0
+
+    @classmethod
+    def load(cls, path, **options):
+        """从path加载臂统计（文件不存在时返回空的老虎机）"""
+        bandit = cls(path, **options)
+        try:
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return bandit
+        bandit._arms = {arm: list(stats) for arm, stats in state.get('arms', {}).items()}
+        bandit._total = state.get('total', 0)
+        return bandit
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            state = {'total': self._total, 'arms': self._arms}
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def total(self):
+        return self._total
+
+    def update(self, bindings, reward):
+        """把一次奖励记到这组取值涉及的每个臂上"""
+        with self._lock:
+            self._total += 1
+            for arm in arm_keys(bindings):
+                stats = self._arms.setdefault(arm, [0, 0.0])
+                stats[0] += 1
+                stats[1] += reward
+
+    def scorer(self):
+        """
+        返回当前统计下的行打分函数 score(arms)，arms 为 arm_keys 的结果
+        （对统计做快照，重排大量行时不必反复加锁）
+        """
+        with self._lock:
+            log_total = math.log(self._total + 1)
+            arm_scores = {}
+            for arm, (count, reward_sum) in self._arms.items():
+                n = count + self.prior_count
+                arm_scores[arm] = ((reward_sum + self.prior_mean * self.prior_count) / n
+                                   + self.exploration * math.sqrt(log_total / n))
+        unseen = self.prior_mean + self.exploration * math.sqrt(log_total / self.prior_count)
+
+        def score(arms):
+            if not arms:
+                return unseen
+            return sum(arm_scores.get(arm, unseen) for arm in arms) / len(arms)
+
+        return score
+
+    def top_arms(self, n=10):
+        """平均奖励最高的n个臂 [(臂, 观测次数, 平均奖励), ...]"""
+        with self._lock:
+            arms = [(arm, count, reward_sum / count)
+                    for arm, (count, reward_sum) in self._arms.items() if count]
+        return sorted(arms, key=lambda item: item[2], reverse=True)[:n]
+
+
+class BanditTaskQueue:
+    """
+    按老虎机得分动态排序的任务队列（线程安全）
+
+    可以直接替代 run_threaded / run_scheduled 的 tasks 列表：迭代时每次给出当前得分最高的待处理行，
+    每收到 rerank_every 个新结果就对剩余行重新排序。
+    """
+
+    def __init__(self, tasks, bandit, max_tasks=None, rerank_every=5, seed=0):
+        """
+        Args:
+            tasks: [(alpha_row, row_index, index, total), ...]
+            bandit: SlotBandit
+            max_tasks: 最多发出的任务数（仿真配额），None表示全部
+            rerank_every: 每收到多少个新结果重新排序一次
+            seed: 得分相同时随机次序的种子
+        """
+        self.bandit = bandit
+        self.rerank_every = rerank_every
+        self._lock = threading.Lock()
+        self._bindings = {}
+        self._arms = {}
+        # 得分相同时按固定种子的随机次序：没有观测时不会先把同一个数据字段的所有变体都跑一遍
+        tiebreak = random.Random(seed)
+        self._tiebreak = {}
+        for alpha_row, row_index, _, _ in tasks:
+            bindings = row_bindings(alpha_row)
+            self._bindings[row_index] = bindings
+            self._arms[row_index] = arm_keys(bindings)
+            self._tiebreak[row_index] = tiebreak.random()
+        self._remaining = list(tasks)
+        self._limit = len(self._remaining) if max_tasks is None else min(max_tasks, len(self._remaining))
+        self._issued = 0
+        self._pending_updates = 0
+        self._rerank()
+
+    def __len__(self):
+        return self._limit
+
+    def __iter__(self):
+        while True:
+            task = self.next_task()
+            if task is None:
+                return
+            yield task
+
+    def _rerank(self):
+        score = self.bandit.scorer()
+        arms = self._arms
+        tiebreak = self._tiebreak
+        # 剩余行按得分从低到高排列，从末尾弹出
+        self._remaining.sort(key=lambda task: (score(arms[task[1]]), tiebreak[task[1]]))
+        self._pending_updates = 0
+
+    def next_task(self):
+        """取出当前得分最高的任务，达到配额或没有剩余任务时返回None"""
+        with self._lock:
+            if self._issued >= self._limit or not self._remaining:
+                return None
+            if self._pending_updates >= self.rerank_every:
+                self._rerank()
+            self._issued += 1
+            return self._remaining.pop()
+
+    def record(self, row_index, is_data, check_result):
+        """把一个alpha的结果反馈给老虎机"""
+        bindings = self._bindings.get(row_index)
+        if not bindings:
+            return
+        self.bandit.update(bindings, alpha_reward(is_data, check_result))
+        with self._lock:
+            self._pending_updates += 1
+
+
+def default_bandit_path(csv_path):
+    """CSV对应的臂统计文件路径"""
+    return csv_path + '.bandit.json'
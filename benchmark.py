@@ -0,0 +1,238 @@
+# 端到端吞吐量基准测试
+# 功能：启动本地模拟服务器（mock_brain_server.py），生成一批alpha写入临时CSV，
+#      在子进程中用 WQ_API_BASE 指向模拟服务器运行各个引擎，
+#      报告 alphas/小时、各阶段（仿真/读取/检查/打标签）延迟的p50/p99、各接口请求数和状态码。
+#      新引擎只需在 ENGINES 中登记启动命令。autotune 引擎自动调节在途上限（并发数为初始值），
+#      报告中附带每次调节的记录，可与固定并发数的 scheduled 对比。
+#
+# 用法:
+#     python benchmark.py --alphas 50 --workers 10 --engines scheduled,async
+#     python benchmark.py --latency 0.05 --throttle-rate 0.02 --max-concurrent-simulations 8 --json report.json
+#     python benchmark.py --workers 2 --max-concurrent-simulations 8 --engines scheduled,autotune
+import argparse
+import csv
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_brain_server import MockBrainServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# autotune 引擎的调节日志（相对于临时目录）
+AUTOTUNE_LOG = 'autotune.jsonl'
+
+# 引擎名 -> 启动命令（参数：并发数、CSV路径）
+ENGINES = {
+    'scheduled': lambda workers, csv_path: [
+        sys.executable, os.path.join(HERE, 'simulate_from_csv.py'), str(workers), '--csv', csv_path],
+    'threaded': lambda workers, csv_path: [
+        sys.executable, os.path.join(HERE, 'simulate_from_csv.py'), str(workers), '--csv', csv_path,
+        '--threaded'],
+    'autotune': lambda workers, csv_path: [
+        sys.executable, os.path.join(HERE, 'simulate_from_csv.py'), str(workers), '--csv', csv_path,
+        '--autotune', '--autotune-log', AUTOTUNE_LOG],
+    'async': lambda workers, csv_path: [
+        sys.executable, os.path.join(HERE, 'async_engine.py'), str(workers), csv_path],
+}
+
+# 生成测试alpha用的表达式模板（{i} 保证每个表达式不同，不会命中结果缓存）
+BENCH_EXPRESSION = "rank(ts_delta(close, {i}) / ts_std_dev(returns, 20))"
+
+
+def percentile(values, q):
+    """最近秩百分位数，values为空时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def write_alpha_csv(csv_path, n):
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['type', 'settings', 'regular'])
+        for i in range(1, n + 1):
+            writer.writerow(['REGULAR', '{}', BENCH_EXPRESSION.format(i=i)])
+
+
+def count_statuses(csv_path):
+    counts = {}
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            status = row.get('status') or 'PENDING'
+            counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+def run_engine(engine, alphas, workers, server_options, timeout=None, keep_logs=False):
+    """
+    启动一个模拟服务器，运行一个引擎直到处理完所有alpha
+
+    Args:
+        engine: ENGINES中的引擎名
+        alphas: alpha数量
+        workers: 并发数（传给引擎的第一个参数）
+        server_options: MockBrainServer的参数字典
+        timeout: 引擎运行超时（秒）
+        keep_logs: 保留临时目录和引擎输出
+
+    Returns:
+        dict: 报告
+    """
+    workdir = tempfile.mkdtemp(prefix=f"wq_bench_{engine}_")
+    csv_path = os.path.join(workdir, 'alphas.csv')
+    log_path = os.path.join(workdir, 'engine.log')
+    write_alpha_csv(csv_path, alphas)
+    # 引擎从当前目录读取 brain_credentials.txt
+    with open(os.path.join(workdir, 'brain_credentials.txt'), 'w') as f:
+        json.dump(['bench', 'bench'], f)
+
+    server = MockBrainServer(**server_options).start()
+    env = dict(os.environ, WQ_API_BASE=server.base_url, PYTHONUNBUFFERED='1')
+    start = time.monotonic()
+    try:
+        with open(log_path, 'w', encoding='utf-8') as log:
+            proc = subprocess.run(ENGINES[engine](workers, csv_path), cwd=workdir, env=env,
+                                  stdout=log, stderr=subprocess.STDOUT, timeout=timeout)
+        returncode = proc.returncode
+    except subprocess.TimeoutExpired:
+        returncode = 'timeout'
+    elapsed = time.monotonic() - start
+    stats = server.stats()
+    server.stop()
+
+    statuses = count_statuses(csv_path)
+    completed = sum(count for status, count in statuses.items() if status != 'PENDING')
+    report = {
+        'engine': engine,
+        'alphas': alphas,
+        'workers': workers,
+        'returncode': returncode,
+        'elapsed_seconds': round(elapsed, 2),
+        'completed': completed,
+        'statuses': statuses,
+        'alphas_per_hour': round(completed / elapsed * 3600, 1) if elapsed > 0 else None,
+        'stages': {
+            name: {'count': len(values), 'p50': percentile(values, 50), 'p99': percentile(values, 99)}
+            for name, values in stats['stages'].items()
+        },
+        'requests': stats['requests'],
+        'request_latency': {
+            route: {'p50': percentile(values, 50), 'p99': percentile(values, 99)}
+            for route, values in stats['latency'].items()
+        },
+        'total_requests': sum(sum(codes.values()) for codes in stats['requests'].values()),
+        'server_options': server_options,
+    }
+    autotune = read_autotune_log(os.path.join(workdir, AUTOTUNE_LOG))
+    if autotune is not None:
+        report['autotune'] = autotune
+    if keep_logs:
+        report['workdir'] = workdir
+    else:
+        # 结果仓库等是子目录，整个目录一起删除
+        shutil.rmtree(workdir)
+    return report
+
+
+def read_autotune_log(path):
+    """读取调节日志，返回 {'decisions', 'final_limit', 'max_limit', 'ceiling', 'log'}，没有日志时返回None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        decisions = [json.loads(line) for line in f if line.strip()]
+    if not decisions:
+        return {'decisions': 0, 'final_limit': None, 'max_limit': None, 'ceiling': None, 'log': []}
+    return {
+        'decisions': len(decisions),
+        'final_limit': decisions[-1]['to'],
+        'max_limit': max(decision['to'] for decision in decisions),
+        'ceiling': decisions[-1]['ceiling'],
+        'log': decisions,
+    }
+
+
+def _fmt(seconds):
+    return '-' if seconds is None else f"{seconds:.2f}s"
+
+
+def print_report(report):
+    print("=" * 80)
+    print(f"引擎: {report['engine']}  alpha: {report['alphas']}  并发: {report['workers']}  "
+          f"退出码: {report['returncode']}")
+    print(f"用时: {report['elapsed_seconds']}s  完成: {report['completed']}  状态: {report['statuses']}")
+    print(f"吞吐量: {report['alphas_per_hour']} alphas/小时")
+    print("阶段延迟:")
+    for name, stage in report['stages'].items():
+        print(f"  {name:<10} n={stage['count']:<6} p50={_fmt(stage['p50']):<10} p99={_fmt(stage['p99'])}")
+    print(f"请求数: {report['total_requests']}")
+    for route, codes in sorted(report['requests'].items()):
+        latency = report['request_latency'].get(route, {})
+        print(f"  {route:<12} {dict(sorted(codes.items()))}  "
+              f"p50={_fmt(latency.get('p50'))} p99={_fmt(latency.get('p99'))}")
+    autotune = report.get('autotune')
+    if autotune is not None:
+        print(f"并发调节: {autotune['decisions']} 次，最终上限 {autotune['final_limit']}，"
+              f"最高 {autotune['max_limit']}，估计服务端名额 {autotune['ceiling']}")
+    if 'workdir' in report:
+        print(f"日志和CSV: {report['workdir']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用本地模拟服务器对各引擎做端到端基准测试")
+    parser.add_argument('--engines', default='scheduled',
+                        help=f"逗号分隔的引擎列表，可选: {','.join(ENGINES)}")
+    parser.add_argument('--alphas', type=int, default=30, help='alpha数量')
+    parser.add_argument('--workers', type=int, default=10, help='并发数')
+    parser.add_argument('--timeout', type=float, default=None, help='每个引擎的超时（秒）')
+    parser.add_argument('--json', help='把报告写入JSON文件')
+    parser.add_argument('--keep-logs', action='store_true', help='保留临时目录（CSV和引擎输出）')
+    # 模拟服务器参数
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-retry-after', type=float, default=1.0)
+    parser.add_argument('--max-concurrent-simulations', type=int, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--sim-fail-rate', type=float, default=0.0)
+    parser.add_argument('--sim-time', type=float, default=2.0)
+    parser.add_argument('--check-time', type=float, default=1.0)
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--ready-delay', type=float, default=0.0)
+    parser.add_argument('--pass-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server_options = {
+        key: getattr(args, key) for key in (
+            'latency', 'latency_jitter', 'throttle_rate', 'throttle_retry_after',
+            'max_concurrent_simulations', 'error_rate', 'sim_fail_rate', 'sim_time',
+            'check_time', 'poll_interval', 'ready_delay', 'pass_rate', 'seed',
+        )
+    }
+    reports = []
+    for engine in args.engines.split(','):
+        engine = engine.strip()
+        if engine not in ENGINES:
+            parser.error(f"未知的引擎: {engine}，可选: {','.join(ENGINES)}")
+        print(f"运行引擎 {engine} ...")
+        report = run_engine(engine, args.alphas, args.workers, server_options,
+                            timeout=args.timeout, keep_logs=args.keep_logs)
+        print_report(report)
+        reports.append(report)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+        print(f"报告已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
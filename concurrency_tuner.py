@@ -0,0 +1,165 @@
+# 在途仿真数量自适应调节器
+# 功能：固定的 max_workers 设小了服务端仿真名额闲置，设大了提交被拒绝（429 / CONCURRENT_SIMULATION_LIMIT_EXCEEDED）。
+#      调节器在运行中调整同时在途的仿真数量上限：
+#        慢启动 —— 名额用满且提交成功时每次加1（每轮翻倍），直到第一次被拒绝；
+#        拥塞避免 —— 此后服务端正在运行的仿真数达到上限时，每轮（上限个提交成功）加1，试探名额是否变大；
+#                   上限最多比估计的服务端名额多1，服务端接受了超过估计名额的仿真（试探成功）后估计名额才上移；
+#        名额已满 —— 上限降到被拒绝时已占用的名额数，服务端正在运行的仿真数记为估计的服务端名额；
+#        提交被限流 —— 上限乘以 decrease（乘法减）。
+#      同一波拒绝在冷却时间内只降一次。每次调整都打印、写入指标（concurrency_limit），
+#      并可追加写入JSON-lines日志，便于在基准测试中与固定设置对比。
+#
+# 用法:
+#     tuner = ConcurrencyTuner(initial=3, max_limit=100, log_path='autotune.jsonl')
+#     tuner.acquire()               # 提交前占一个在途名额（替代 BoundedSemaphore）
+#     tuner.on_accepted()           # 提交成功
+#     tuner.on_limit_exceeded()     # 服务端仿真名额已满
+#     tuner.on_finished()           # 服务端仿真结束（名额可能还要等下游接收后才归还）
+#     tuner.release()               # 仿真结束，归还名额
+import json
+import threading
+import time
+from datetime import datetime
+
+from metrics import METRICS
+
+# 在途上限的默认最大值
+DEFAULT_MAX_LIMIT = 100
+
+
+class ConcurrencyTuner:
+    """
+    可调上限的在途名额（线程安全），接口与 threading.BoundedSemaphore 的 acquire/release 相同
+
+    上限降低后已经在途的仿真不受影响，在途数量降到新上限以下之前 acquire() 阻塞。
+    在途名额从提交前占用到下游接收为止，比服务端正在运行的仿真多出等待下游的部分，
+    因此另外记录服务端正在运行的数量（on_accepted 到 on_finished）用于估计服务端名额。
+    """
+
+    def __init__(self, initial=3, min_limit=1, max_limit=DEFAULT_MAX_LIMIT, decrease=0.75, cooldown=5.0,
+                 log_path=None):
+        """
+        Args:
+            initial: 初始上限
+            min_limit: 上限的下限
+            max_limit: 上限的上限
+            decrease: 提交被限流（非名额已满的429）时上限乘以的系数
+            cooldown: 两次降低上限之间的最小间隔秒数，同一波拒绝只降一次
+            log_path: 调整记录的JSON-lines文件路径，None表示只打印
+        """
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.ceiling = None  # 最近一次被拒绝时估计的服务端名额，None表示还在慢启动
+        self.adjustments = 0
+        self.rejected = 0
+        self._in_flight = 0
+        self._running = 0   # 已被服务端接受、还没结束的仿真数
+        self._accepted = 0  # 上次调整以来名额用满时被接受的提交数
+        self._last_decrease = float('-inf')
+        self._cond = threading.Condition()
+        self._log = open(log_path, 'a', encoding='utf-8') if log_path else None
+        METRICS.set_gauge('concurrency_limit', self.limit)
+
+    def acquire(self):
+        """占一个在途名额，在途数量达到上限时阻塞"""
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+            METRICS.set_gauge('simulations_in_flight', self._in_flight)
+
+    def release(self):
+        """归还一个在途名额"""
+        with self._cond:
+            self._in_flight -= 1
+            METRICS.set_gauge('simulations_in_flight', self._in_flight)
+            self._cond.notify()
+
+    def in_flight(self):
+        return self._in_flight
+
+    def on_accepted(self):
+        """提交被服务端接受：名额用满时向上试探"""
+        with self._cond:
+            self._running += 1
+            if self.ceiling is not None and self._running > self.ceiling:
+                # 试探成功：服务端同时运行的仿真超过了估计的名额
+                self.ceiling = self._running
+            # 名额没用满（任务不够或下游积压）时上限不是瓶颈，不增加
+            if self._in_flight < self.limit or self.limit >= self.max_limit:
+                return
+            self._accepted += 1
+            if self.ceiling is None:
+                self._adjust(self.limit + 1, 'slow_start', '提交成功，慢启动')
+            elif self._running >= self.limit and self._accepted >= self.limit:
+                # 在途名额包含等待下游的部分，只有服务端正在运行的仿真占满上限时才说明上限是瓶颈
+                self._adjust(min(self.limit + 1, self.ceiling + 1), 'probe', '一轮提交成功，试探更高的上限')
+
+    def on_finished(self):
+        """服务端仿真结束（与 on_accepted 成对调用）"""
+        with self._cond:
+            self._running = max(0, self._running - 1)
+
+    def on_limit_exceeded(self):
+        """提交被拒绝：服务端同时运行的仿真数量已达上限"""
+        with self._cond:
+            self.rejected += 1
+            if not self._cooled_down():
+                return
+            self.ceiling = max(self.min_limit, self._running)
+            # 被拒绝的这次提交也占着名额，上限降到其余已占用的名额数
+            self._adjust(min(self.limit - 1, self._in_flight - 1), 'limit',
+                         f"服务端仿真名额已满，估计名额 {self.ceiling}")
+
+    def on_throttled(self):
+        """提交被限流（429，但不是名额已满）：乘法降低上限"""
+        with self._cond:
+            self.rejected += 1
+            if not self._cooled_down():
+                return
+            new_limit = int(self.limit * self.decrease)
+            if self.ceiling is None:
+                self.ceiling = max(self.min_limit, new_limit)
+            self._adjust(new_limit, 'throttle', '提交被限流')
+
+    def _cooled_down(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return False
+        self._last_decrease = now
+        return True
+
+    def _adjust(self, new_limit, cause, reason):
+        """调整上限并记录（调用者持有 self._cond）"""
+        new_limit = max(self.min_limit, min(self.max_limit, new_limit))
+        self._accepted = 0
+        if new_limit == self.limit:
+            return
+        old_limit, self.limit = self.limit, new_limit
+        self.adjustments += 1
+        METRICS.set_gauge('concurrency_limit', new_limit)
+        METRICS.inc('concurrency_adjustments_total', cause=cause)
+        print(f"[并发调节] 在途上限 {old_limit} → {new_limit}（{reason}，当前在途 {self._in_flight}）")
+        if self._log is not None:
+            self._log.write(json.dumps({
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'cause': cause, 'from': old_limit, 'to': new_limit,
+                'in_flight': self._in_flight, 'running': self._running, 'ceiling': self.ceiling,
+            }) + '\n')
+            self._log.flush()
+        if new_limit > old_limit:
+            self._cond.notify_all()
+
+    def summary(self):
+        """一行文字描述最终状态"""
+        ceiling = '未触发' if self.ceiling is None else self.ceiling
+        return (f"最终在途上限 {self.limit}，估计服务端名额 {ceiling}，"
+                f"调整 {self.adjustments} 次，提交被拒绝 {self.rejected} 次")
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
@@ -0,0 +1,167 @@
+# 数据字段目录缓存
+# 功能：按 (region, delay, universe, instrumentType, dataset_id, search) 把 /data-fields 的结果缓存到本地磁盘；
+#      TTL内直接读缓存，不发任何请求；TTL过期后只请求第一页比对count，count不变则继续使用缓存；
+#      未命中的分页在线程池中并发获取，所有请求都经过 requests_wq 的进程级限流器
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from simulate_and_check_for1 import requests_wq, API_BASE
+
+# 每页数量（接口上限）
+PAGE_SIZE = 50
+
+# 默认缓存目录
+DEFAULT_CATALOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.datafield_cache')
+
+
+class DatafieldCatalog:
+    """
+    本地磁盘缓存的数据字段目录
+
+    用法:
+        catalog = DatafieldCatalog()
+        fnd6 = catalog.get(pool, searchScope, dataset_id='fundamental6')
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CATALOG_DIR, ttl=7 * 86400, max_workers=4):
+        """
+        Args:
+            cache_dir: 缓存目录
+            ttl: 缓存有效期（秒），有效期内不发请求
+            max_workers: 并发获取分页的线程数
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_workers = max_workers
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(searchScope, dataset_id='', search=''):
+        params = {
+            'region': searchScope['region'],
+            'delay': str(searchScope['delay']),
+            'universe': searchScope['universe'],
+            'instrumentType': searchScope['instrumentType'],
+            'dataset_id': dataset_id,
+            'search': search,
+        }
+        key = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+        return key, params
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self, key):
+        try:
+            with open(self._cache_path(key), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, key, entry):
+        path = self._cache_path(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def all_field_ids(self):
+        """
+        本地缓存中所有数据字段ID（不发请求，不检查TTL）
+
+        Returns:
+            set: 数据字段ID集合
+        """
+        ids = set()
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            entry = self._load(name[:-len('.json')])
+            if entry is not None:
+                ids.update(field['id'] for field in entry.get('results', []) if 'id' in field)
+        return ids
+
+    @staticmethod
+    def _page_url(params, offset):
+        url = (f"{API_BASE}/data-fields?"
+               f"instrumentType={params['instrumentType']}"
+               f"&region={params['region']}&delay={params['delay']}&universe={params['universe']}"
+               f"&limit={PAGE_SIZE}&offset={offset}")
+        if params['search']:
+            url += f"&search={params['search']}"
+        else:
+            url += f"&dataset.id={params['dataset_id']}"
+        return url
+
+    def _fetch_page(self, pool, params, offset):
+        with pool.session() as sess:
+            response, sess = requests_wq(sess, 'get', self._page_url(params, offset))
+        return response.json()
+
+    def get(self, pool, searchScope, dataset_id='', search='', refresh=False):
+        """
+        获取数据字段列表
+
+        Args:
+            pool: SessionPool会话池（缓存命中时不会借用会话，也就不会登录）
+            searchScope: {'region', 'delay', 'universe', 'instrumentType'}
+            dataset_id: 数据集ID，如 'fundamental6'
+            search: 搜索关键字（指定时忽略dataset_id）
+            refresh: 忽略缓存强制重新获取
+
+        Returns:
+            DataFrame: 数据字段表（列包括 id、type、description 等）
+        """
+        key, params = self.make_key(searchScope, dataset_id, search)
+        entry = None if refresh else self._load(key)
+        if entry is not None and time.time() - entry['fetched_at'] < self.ttl:
+            print(f"[数据字段目录] 命中缓存: {params}")
+            return pd.DataFrame(entry['results'])
+
+        # 第一页同时给出count：缓存过期时用它判断目录是否变化
+        first_page = self._fetch_page(pool, params, 0)
+        if 'count' not in first_page:
+            print("错误: 响应中没有 'count' 键")
+            print(f"响应内容: {first_page}")
+            return pd.DataFrame(entry['results']) if entry else pd.DataFrame()
+        count = first_page['count']
+        if entry is not None and entry['count'] == count:
+            print(f"[数据字段目录] count未变化（{count}），继续使用缓存: {params}")
+            entry['fetched_at'] = time.time()
+            self._save(key, entry)
+            return pd.DataFrame(entry['results'])
+
+        # 其余分页并发获取
+        offsets = list(range(PAGE_SIZE, count, PAGE_SIZE))
+        print(f"[数据字段目录] 获取 {count} 个数据字段，共 {len(offsets) + 1} 页: {params}")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pages = list(executor.map(lambda x: self._fetch_page(pool, params, x), offsets))
+
+        results = list(first_page.get('results', []))
+        complete = True
+        for offset, page in zip(offsets, pages):
+            if 'results' not in page:
+                print(f"警告: 响应中没有 'results' 键 (offset={offset})")
+                print(f"响应内容: {page}")
+                complete = False
+                continue
+            results.extend(page['results'])
+        if len(results) == 0:
+            print("警告: 没有获取到任何数据字段")
+            return pd.DataFrame()
+        if not complete:
+            # 不完整的结果不写入缓存，下次重新获取
+            return pd.DataFrame(results)
+
+        self._save(key, {
+            'params': params,
+            'count': count,
+            'fetched_at': time.time(),
+            'results': results,
+        })
+        return pd.DataFrame(results)
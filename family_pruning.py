@@ -0,0 +1,234 @@
+# 按族逐轮剪枝（successive halving）
+# 功能：待处理CSV中很多行是同一个想法的变体，如一个 fnd6 字段 × days [5, 65, 252] × 多个 group。
+#      这里按共同的槽位取值（默认 company_fundamentals）把行分成族：
+#      第0轮每族只仿真1个代表，代表的 Sharpe/Fitness 低于阈值则整族剩余的行取消（或放到最后）；
+#      通过的族下一轮放出2个、再下一轮4个……每轮结束都重新对照阈值，整轮都不达标就停止该族。
+#      先放出轮次小、得分高的族，大规模基本面扫描中大部分仿真预算都花在有希望的族上。
+#      被取消的行在状态列中记录原因（PRUNED_LOW_SHARPE / PRUNED_LOW_FITNESS / PRUNED_NO_RESULT）。
+#
+# 用法:
+#     queue = FamilyPruningQueue(tasks, family_by=['company_fundamentals'], min_sharpe=0.5, min_fitness=0.2)
+#     for alpha_row, row_index, index, total in queue:    # 代表未出结果前会阻塞等待
+#         ...
+#         queue.record(row_index, is_data, check_result)   # 每个alpha恰好一次
+#     for row_index, status, detail in queue.drain_pruned():
+#         store.record_skipped(row_index, status, detail)
+#     # 调用 record 的线程自己取任务时不能阻塞，否则没有人能送来结果：
+#     task = queue.next_task(block=False)                 # 暂时没有可放出的任务时返回 NOT_READY
+import heapq
+import itertools
+import json
+import threading
+from collections import deque
+
+from bandit_scheduler import row_bindings
+
+# 剪枝模式：cancel 取消剩余的行；deprioritize 把剩余的行放到所有通过的族之后
+PRUNE_MODES = ('cancel', 'deprioritize')
+
+# next_task(block=False) 的返回值：还有代表在途、暂时没有可放出的任务（与取完时的None区分）
+NOT_READY = object()
+
+
+class _Family:
+    __slots__ = ('key', 'rows', 'round', 'outstanding', 'round_results', 'best_sharpe', 'status')
+
+    def __init__(self, key):
+        self.key = key
+        self.rows = deque()
+        self.round = 0
+        self.outstanding = 0
+        self.round_results = []   # 本轮每个alpha的 (sharpe, fitness, check_result)
+        self.best_sharpe = None
+        self.status = None        # 被剪枝时的状态码
+
+
+class FamilyPruningQueue:
+    """
+    按族逐轮放出任务的队列（线程安全）
+
+    可以直接替代 run_threaded / run_scheduled 的 tasks 列表；引擎需要在取下一个任务前
+    对每个已完成的alpha调用 record（feedback 回调）。当前没有可放出的任务、但还有代表在途时，
+    取任务会阻塞到有结果返回；同一个线程既取任务又调用 record 时要用 next_task(block=False)。
+    """
+
+    def __init__(self, tasks, family_by, min_sharpe=0.5, min_fitness=0.2, mode='cancel',
+                 growth=2, max_tasks=None):
+        """
+        Args:
+            tasks: [(alpha_row, row_index, index, total), ...]
+            family_by: 决定族的槽位名列表，这些槽位取值相同的行属于同一族；
+                       没有这些槽位（没有 bindings 列）的行各自成族，不会被剪枝
+            min_sharpe: 一轮中至少有一个alpha的Sharpe不低于该值，族才继续
+            min_fitness: 同上，Fitness阈值（与Sharpe阈值同时满足）
+            mode: 'cancel' 或 'deprioritize'
+            growth: 每轮放出的数量相对上一轮的倍数（第r轮放出 growth**r 个）
+            max_tasks: 最多发出的任务数（仿真配额），None表示不限
+        """
+        if mode not in PRUNE_MODES:
+            raise ValueError(f"未知的剪枝模式: {mode}，可选: {PRUNE_MODES}")
+        self.family_by = list(family_by)
+        self.min_sharpe = min_sharpe
+        self.min_fitness = min_fitness
+        self.mode = mode
+        self.growth = growth
+        self._total = len(tasks)
+        self._limit = self._total if max_tasks is None else min(max_tasks, self._total)
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._families = {}
+        for task in tasks:
+            bindings = row_bindings(task[0])
+            if all(slot in bindings for slot in self.family_by):
+                key = json.dumps([bindings[slot] for slot in self.family_by])
+            else:
+                key = f"row:{task[1]}"
+            family = self._families.get(key)
+            if family is None:
+                family = self._families[key] = _Family(key)
+            family.rows.append(task)
+        # (轮次, -最好Sharpe, 序号, 族)：轮次小的先放出，同轮次得分高的先放出
+        self._heap = [(0, 0.0, next(self._seq), family) for family in self._families.values()]
+        heapq.heapify(self._heap)
+        self._ready = deque()
+        self._row_family = {}
+        self._outstanding = 0
+        self._issued = 0
+        self._pruned = []         # 尚未取走的 (row_index, status, detail)
+        self._deferred = []       # deprioritize 模式下被推迟的族
+        self.pruned_count = 0
+
+    def __len__(self):
+        """最多发出的任务数（剪枝后实际发出的会更少）"""
+        return self._limit
+
+    def __iter__(self):
+        while True:
+            task = self.next_task()
+            if task is None:
+                return
+            yield task
+
+    @property
+    def family_count(self):
+        return len(self._families)
+
+    def next_task(self, block=True):
+        """
+        取出下一个任务；全部结束或达到配额时返回None
+
+        Args:
+            block: 没有可放出的任务但还有结果未返回时，True 阻塞到有结果返回，False 立即返回 NOT_READY
+        """
+        with self._cond:
+            while True:
+                if self._issued >= self._limit:
+                    return None
+                if not self._ready:
+                    self._release_next_round()
+                if self._ready:
+                    task = self._ready.popleft()
+                    self._issued += 1
+                    self._outstanding += 1
+                    return task
+                if self._outstanding == 0:
+                    if self.mode == 'deprioritize' and self._deferred:
+                        self._release_deferred()
+                        continue
+                    return None
+                if not block:
+                    return NOT_READY
+                self._cond.wait()
+
+    def _release_next_round(self):
+        while self._heap:
+            _, _, _, family = heapq.heappop(self._heap)
+            size = self.growth ** family.round
+            while family.rows and size > 0:
+                task = family.rows.popleft()
+                self._row_family[task[1]] = family
+                self._ready.append(task)
+                family.outstanding += 1
+                size -= 1
+            if family.outstanding:
+                family.round_results = []
+                return
+
+    def _release_deferred(self):
+        # 被推迟的族按代表的Sharpe从高到低放出全部剩余行
+        self._deferred.sort(key=lambda family: -(family.best_sharpe or float('-inf')))
+        for family in self._deferred:
+            self._ready.extend(family.rows)
+            family.rows.clear()
+        self._deferred = []
+
+    def record(self, row_index, is_data, check_result):
+        """记录一个alpha的最终结果；一轮的结果齐了就决定该族是继续、剪枝还是结束"""
+        with self._cond:
+            self._outstanding = max(0, self._outstanding - 1)
+            family = self._row_family.pop(row_index, None)
+            if family is None:
+                # deprioritize 模式下最后放出的行不再参与评估
+                self._cond.notify_all()
+                return
+            is_data = is_data or {}
+            family.round_results.append((is_data.get('sharpe'), is_data.get('fitness'), check_result))
+            family.outstanding -= 1
+            sharpe = is_data.get('sharpe')
+            if sharpe is not None and (family.best_sharpe is None or sharpe > family.best_sharpe):
+                family.best_sharpe = sharpe
+            if family.outstanding == 0:
+                self._finish_round(family)
+            self._cond.notify_all()
+
+    def _finish_round(self, family):
+        status = self._judge(family.round_results)
+        if status is None:
+            if family.rows:
+                family.round += 1
+                heapq.heappush(self._heap, (family.round, -(family.best_sharpe or 0.0),
+                                            next(self._seq), family))
+            return
+        family.status = status
+        if not family.rows:
+            return
+        if self.mode == 'deprioritize':
+            self._deferred.append(family)
+            return
+        detail = self._describe(family)
+        for task in family.rows:
+            self._pruned.append((task[1], status, detail))
+        self.pruned_count += len(family.rows)
+        print(f"[剪枝] 族 {family.key} 第{family.round}轮未达标（{detail}），取消剩余 {len(family.rows)} 个Alpha")
+        family.rows.clear()
+
+    def _judge(self, round_results):
+        """一轮中有一个alpha达标（或检查通过）则返回None，否则返回剪枝状态码"""
+        best_status = 'PRUNED_NO_RESULT'
+        for sharpe, fitness, check_result in round_results:
+            if check_result == "SUCCESS":
+                return None
+            if sharpe is None or fitness is None:
+                continue
+            if sharpe < self.min_sharpe:
+                if best_status == 'PRUNED_NO_RESULT':
+                    best_status = 'PRUNED_LOW_SHARPE'
+                continue
+            if fitness < self.min_fitness:
+                best_status = 'PRUNED_LOW_FITNESS'
+                continue
+            return None
+        return best_status
+
+    def _describe(self, family):
+        parts = []
+        for sharpe, fitness, check_result in family.round_results:
+            parts.append(f"sharpe={sharpe}, fitness={fitness}" if sharpe is not None else str(check_result))
+        return (f"round {family.round}: {'; '.join(parts)} "
+                f"(min_sharpe={self.min_sharpe}, min_fitness={self.min_fitness})")
+
+    def drain_pruned(self):
+        """取走自上次调用以来被取消的行 [(row_index, status, detail), ...]"""
+        with self._cond:
+            pruned, self._pruned = self._pruned, []
+        return pruned
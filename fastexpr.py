@@ -0,0 +1,470 @@
+# FASTEXPR 本地解析与提交前校验
+# 功能：在发送到 /simulations 之前解析表达式，提前发现语法错误、未知运算符、参数个数/关键字参数错误、
+#      未定义的变量，避免浪费仿真名额；
+#      支持以 ; 分隔的多语句、赋值语句、关键字参数（如 std = 3）、中缀/一元运算符和三元运算符。
+#      单遍正则分词 + 递归下降解析，不构造语法树，每秒可校验数万条枚举表达式。
+#      运算符以服务端 /operators 的列表为准（operator_catalog.py 缓存在本地）；从来没有获取成功过时
+#      退回内置的运算符表，此时未知的运算符只给出警告，不阻止提交。
+#
+# 用法:
+#     errors, warnings = validate_expression("rank(close) / rank(cap)")
+#     if errors:
+#         ...拒绝提交
+import difflib
+import re
+
+# 内置的运算符签名："参数, 可选参数=默认值"；"..." 表示可以有任意多个位置参数
+_OPERATOR_SIGNATURES = {
+    # 算术
+    'abs': 'x', 'add': 'x, y, ..., filter=false', 'densify': 'x', 'divide': 'x, y',
+    'inverse': 'x', 'log': 'x', 'max': 'x, y, ...', 'min': 'x, y, ...',
+    'multiply': 'x, y, ..., filter=false', 'power': 'x, y', 'reverse': 'x', 'sign': 'x',
+    'signed_power': 'x, y', 'sqrt': 'x', 'subtract': 'x, y, filter=false', 'exp': 'x',
+    'log_diff': 'x', 'nan_mask': 'x, y', 'purify': 'x', 'replace': 'x, target, dest',
+    'round': 'x', 'round_down': 'x, f=1', 's_log_1p': 'x', 'fraction': 'x',
+    'to_nan': 'x, value=0, reverse=false', 'arc_cos': 'x', 'arc_sin': 'x', 'arc_tan': 'x',
+    'tanh': 'x', 'sigmoid': 'x', 'floor': 'x', 'ceiling': 'x',
+    # 逻辑
+    'and': 'x, y', 'or': 'x, y', 'not': 'x', 'if_else': 'condition, x, y', 'is_nan': 'x',
+    'equal': 'x, y', 'not_equal': 'x, y', 'greater': 'x, y', 'greater_equal': 'x, y',
+    'less': 'x, y', 'less_equal': 'x, y',
+    # 时间序列
+    'days_from_last_change': 'x', 'hump': 'x, hump=0.01', 'hump_decay': 'x, p=0',
+    'jump_decay': 'x, d, sensitivity=0.5, force=0.1', 'kth_element': 'x, d, k=1, ignore=NaN',
+    'last_diff_value': 'x, d', 'inst_tvr': 'x, d',
+    'ts_arg_max': 'x, d', 'ts_arg_min': 'x, d', 'ts_av_diff': 'x, d',
+    'ts_backfill': 'x, lookback, k=1, ignore=NAN', 'ts_corr': 'x, y, d', 'ts_count_nans': 'x, d',
+    'ts_covariance': 'y, x, d', 'ts_decay_linear': 'x, d, dense=false',
+    'ts_decay_exp_window': 'x, d, factor=1.0', 'ts_delay': 'x, d', 'ts_delta': 'x, d',
+    'ts_delta_limit': 'x, y, limit_volume=0.1', 'ts_entropy': 'x, d, buckets=10',
+    'ts_ir': 'x, d', 'ts_kurtosis': 'x, d', 'ts_max': 'x, d', 'ts_max_diff': 'x, d',
+    'ts_mean': 'x, d', 'ts_median': 'x, d', 'ts_min': 'x, d', 'ts_min_diff': 'x, d',
+    'ts_min_max_cps': 'x, d, f=2', 'ts_min_max_diff': 'x, d, f=0.5', 'ts_moment': 'x, d, k=0',
+    'ts_partial_corr': 'x, y, z, d', 'ts_percentage': 'x, d, percentage=0.5',
+    'ts_poly_regression': 'y, x, d, k=1', 'ts_product': 'x, d',
+    'ts_quantile': 'x, d, driver=gaussian', 'ts_rank': 'x, d, constant=0',
+    'ts_regression': 'y, x, d, lag=0, rettype=0', 'ts_returns': 'x, d, mode=1',
+    'ts_scale': 'x, d, constant=0', 'ts_skewness': 'x, d', 'ts_std_dev': 'x, d',
+    'ts_step': 'x', 'ts_sum': 'x, d', 'ts_theilsen': 'x, y, d', 'ts_triple_corr': 'x, y, z, d',
+    'ts_co_kurtosis': 'y, x, d', 'ts_co_skewness': 'y, x, d', 'ts_zscore': 'x, d',
+    'ts_target_tvr_decay': 'x, lambda_min=0, lambda_max=1, target_tvr=0.1',
+    'ts_target_tvr_delta_limit': 'x, y, lambda_min=0, lambda_max=1, target_tvr=0.1',
+    'ts_vector_neut': 'x, y, d', 'ts_vector_proj': 'x, y, d', 'ts_weighted_decay': 'x, k=0.5',
+    'ts_rank_gmean_amean_diff': 'x, y, ...',
+    # 横截面
+    'normalize': 'x, useStd=false, limit=0.0', 'one_side': 'x, side=long',
+    'quantile': 'x, driver=gaussian, sigma=1.0', 'rank': 'x, rate=2',
+    'rank_by_side': 'x, rate=2, scale=1', 'rank_gmean_amean_diff': 'x, y, ...',
+    'generalized_rank': 'x, m=1', 'regression_neut': 'y, x', 'regression_proj': 'y, x',
+    'scale': 'x, scale=1, longscale=1, shortscale=1', 'scale_down': 'x, constant=0',
+    'truncate': 'x, maxPercent=0.01', 'vector_neut': 'x, y', 'vector_proj': 'x, y',
+    'winsorize': 'x, std=4', 'zscore': 'x', 'left_tail': 'x, maximum=0',
+    'right_tail': 'x, minimum=0', 'tail': 'x, lower=0, upper=0, newval=0',
+    'bucket': 'x, range=, buckets=, skipBegin=false, skipEnd=false, skipBoth=false, NANGroup=false',
+    'trade_when': 'x, y, z', 'clamp': 'x, lower=0, upper=0, inverse=false, mask=',
+    'filter': 'x, h=, t=', 'keep': 'x, f, period=5', 'pasteurize': 'x',
+    'convert': 'x, mode=dollar2share', 'inst_pnl': 'x', 'self_corr': 'x',
+    'combo_a': 'x, nlength=250, mode=algo1',
+    # 分组
+    'group_backfill': 'x, group, d, std=4.0', 'group_cartesian_product': 'g1, g2',
+    'group_coalesce': 'group, group2, ...', 'group_count': 'x, group',
+    'group_extra': 'x, weight, group', 'group_max': 'x, group', 'group_mean': 'x, weight, group',
+    'group_median': 'x, group', 'group_min': 'x, group', 'group_neutralize': 'x, group',
+    'group_normalize': 'x, group, constantCheck=false, tolerance=0.01, scale=1',
+    'group_percentage': 'x, group, percentage=0.5', 'group_rank': 'x, group',
+    'group_scale': 'x, group', 'group_std_dev': 'x, group', 'group_sum': 'x, group',
+    'group_vector_neut': 'x, y, group', 'group_vector_proj': 'x, y, group',
+    'group_zscore': 'x, group', 'group_multi_regression': 'y, x, group, ...',
+    # 向量
+    'vec_avg': 'x', 'vec_choose': 'x, nth=0', 'vec_count': 'x', 'vec_filter': 'x, value=nan',
+    'vec_ir': 'x', 'vec_kurtosis': 'x', 'vec_max': 'x', 'vec_min': 'x', 'vec_norm': 'x',
+    'vec_percentage': 'x, percentage=0.5', 'vec_powersum': 'x, constant=2', 'vec_range': 'x',
+    'vec_skewness': 'x', 'vec_stddev': 'x', 'vec_sum': 'x',
+}
+
+
+def _parse_signature(signature):
+    """'x, d, constant=0' -> (参数名列表, 必填个数, 是否可变参数)"""
+    params = []
+    required = 0
+    variadic = False
+    for part in signature.split(','):
+        part = part.strip()
+        if part == '...':
+            variadic = True
+            continue
+        name, has_default, _ = part.partition('=')
+        params.append(name.strip())
+        if not has_default:
+            required = len(params)
+    return params, required, variadic
+
+
+# 运算符 -> (参数名列表, 必填个数, 是否可变参数)；None表示签名未知，不检查参数
+OPERATORS = {name: _parse_signature(sig) for name, sig in _OPERATOR_SIGNATURES.items()}
+
+_NAME = re.compile(r'[A-Za-z_]\w*')
+_SIGNATURE_PARAM = re.compile(r'\s*(?:[A-Za-z_]\w*\s*(?:=[^=]*)?|\.\.\.)\s*')
+
+
+def _signature_from_definition(name, definition):
+    """从 /operators 的 definition（如 'ts_rank(x, d, constant = 0)'）解析签名，解析不出时返回None"""
+    match = re.search(rf'\b{re.escape(name)}\s*\(([^()]*)\)', definition)
+    if match is None:
+        return None
+    parts = match.group(1).split(',')
+    if not all(_SIGNATURE_PARAM.fullmatch(part) for part in parts):
+        return None
+    return _parse_signature(match.group(1))
+
+
+def operators_from_api(entries):
+    """
+    /operators 返回的运算符列表 -> 运算符签名表
+
+    内置表中有的运算符沿用内置签名；其余的从 definition 解析，解析不出时签名未知（只检查运算符存在）。
+    """
+    operators = {}
+    for entry in entries:
+        name = entry.get('name') if isinstance(entry, dict) else None
+        if not name or not _NAME.fullmatch(name):
+            continue  # 中缀运算符（+、-等）由解析器处理
+        if name in OPERATORS:
+            operators[name] = OPERATORS[name]
+        else:
+            operators[name] = _signature_from_definition(name, entry.get('definition') or '')
+    return operators
+
+# 不在数据字段目录中但始终可用的变量（分组字段、常用价量字段、常量）
+BUILTIN_VARIABLES = frozenset({
+    'market', 'sector', 'industry', 'subindustry', 'country', 'exchange', 'currency',
+    'open', 'high', 'low', 'close', 'volume', 'vwap', 'returns', 'cap', 'sharesout',
+    'adv20', 'split', 'dividend', 'enterprise_value',
+    'true', 'false', 'nan', 'NaN', 'NAN', 'inf',
+})
+
+# 运算符优先级（数值越大结合越紧）；^ 右结合
+_BINARY_PRECEDENCE = {
+    '||': 2, '&&': 3,
+    '==': 4, '!=': 4,
+    '<': 5, '<=': 5, '>': 5, '>=': 5,
+    '+': 6, '-': 6,
+    '*': 7, '/': 7,
+    '^': 8,
+}
+_UNARY_PRECEDENCE = 9
+_TERNARY_PRECEDENCE = 1
+
+# 数字 | 字符串 | 名字 | 运算符 | 其他非空白字符（非法）
+_TOKEN = re.compile(r"""
+    ((?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | ("[^"]*"|'[^']*')
+  | ([A-Za-z_]\w*)
+  | (<=|>=|==|!=|&&|\|\||[-+*/^<>!?:(),;=])
+  | (\S)
+""", re.VERBOSE)
+
+
+class FastExprError(ValueError):
+    """表达式未通过本地校验"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__('; '.join(self.errors))
+
+
+def tokenize(expression):
+    """
+    分词
+
+    Returns:
+        list[tuple]: (类型, 文本)；类型为 num/str/name，运算符和标点的类型就是其本身，
+                     末尾追加 ('end', '')
+
+    Raises:
+        FastExprError: 出现无法识别的字符
+    """
+    tokens = []
+    append = tokens.append
+    for num, string, name, op, bad in _TOKEN.findall(expression):
+        if name:
+            append(('name', name))
+        elif op:
+            append((op, op))
+        elif num:
+            append(('num', num))
+        elif string:
+            append(('str', string))
+        else:
+            pos = token_positions(expression)[len(tokens)]
+            raise FastExprError([f"位置 {pos}: 无法识别的字符 {bad!r}"])
+    append(('end', ''))
+    return tokens
+
+
+def token_positions(expression):
+    """每个token在表达式中的起始位置（只在生成错误信息时使用）"""
+    return [m.start() for m in _TOKEN.finditer(expression)] + [len(expression)]
+
+
+class _Checker:
+    """对一条表达式做一次递归下降解析，边解析边收集错误"""
+
+    def __init__(self, validator, expression, tokens):
+        self.v = validator
+        self.expression_text = expression
+        self.tokens = tokens
+        self.i = 0
+        self.errors = []
+        self.warnings = []
+        self.assigned = set()
+        self.used_names = []
+        self._positions = None
+
+    def pos(self, index):
+        """token序号 -> 表达式中的字符位置"""
+        if self._positions is None:
+            self._positions = token_positions(self.expression_text)
+        return self._positions[index]
+
+    def error(self, index, message):
+        self.errors.append(f"位置 {self.pos(index)}: {message}")
+
+    def fail(self, message):
+        text = self.tokens[self.i][1]
+        raise FastExprError(self.errors + [
+            f"位置 {self.pos(self.i)}: {message}（遇到 {text or '结尾'!r}）"
+        ])
+
+    def expect(self, op):
+        if self.tokens[self.i][0] != op:
+            self.fail(f"缺少 {op!r}")
+        self.i += 1
+
+    def program(self):
+        tokens = self.tokens
+        last_is_expression = False
+        while tokens[self.i][0] != 'end':
+            if tokens[self.i][0] == ';':
+                self.i += 1  # 空语句
+                continue
+            kind, text = tokens[self.i]
+            if kind == 'name' and tokens[self.i + 1][0] == '=':
+                self.i += 2
+                self.expression(0)
+                if text in self.v.operators:
+                    self.warnings.append(f"变量名 {text} 与运算符同名")
+                self.assigned.add(text)
+                last_is_expression = False
+            else:
+                self.expression(0)
+                last_is_expression = True
+            if tokens[self.i][0] == 'end':
+                break
+            self.expect(';')
+        if not last_is_expression:
+            self.errors.append("最后一条语句必须是alpha输出表达式（不能是赋值或空）")
+
+    def expression(self, min_precedence):
+        self.unary()
+        tokens = self.tokens
+        while True:
+            kind = tokens[self.i][0]
+            if kind == '?':
+                if min_precedence > _TERNARY_PRECEDENCE:
+                    return
+                self.i += 1
+                self.expression(_TERNARY_PRECEDENCE)
+                self.expect(':')
+                self.expression(_TERNARY_PRECEDENCE)
+                continue
+            precedence = _BINARY_PRECEDENCE.get(kind)
+            if precedence is None:
+                if kind in ('name', 'num', 'str'):
+                    self.fail("缺少运算符或分隔符")
+                return
+            if precedence < min_precedence:
+                return
+            self.i += 1
+            # ^ 右结合，其余左结合
+            self.expression(precedence if kind == '^' else precedence + 1)
+
+    def unary(self):
+        index = self.i
+        kind, text = self.tokens[index]
+        if kind == 'name':
+            self.i += 1
+            if self.tokens[self.i][0] == '(':
+                self.call(text, index)
+            else:
+                self.variable(text, index)
+        elif kind == 'num' or kind == 'str':
+            self.i += 1
+        elif kind == '(':
+            self.i += 1
+            self.expression(0)
+            self.expect(')')
+        elif kind in ('-', '+', '!'):
+            self.i += 1
+            self.expression(_UNARY_PRECEDENCE)
+        elif kind == 'end':
+            self.fail("表达式不完整")
+        else:
+            self.fail("缺少操作数")
+
+    def call(self, name, index):
+        self.i += 1  # '('
+        tokens = self.tokens
+        positional = 0
+        keywords = []
+        if tokens[self.i][0] != ')':
+            while True:
+                kind, text = tokens[self.i]
+                if kind == 'name' and tokens[self.i + 1][0] == '=':
+                    keywords.append((text, self.i))
+                    self.i += 2
+                    if tokens[self.i][0] == 'name' and tokens[self.i + 1][0] in (',', ')'):
+                        self.i += 1  # 枚举值，如 driver = gaussian
+                    else:
+                        self.expression(0)
+                else:
+                    if keywords:
+                        self.error(self.i, f"{name} 的位置参数不能出现在关键字参数之后")
+                    self.expression(0)
+                    positional += 1
+                if tokens[self.i][0] != ',':
+                    break
+                self.i += 1
+        self.expect(')')
+        self.check_arity(name, index, positional, keywords)
+
+    def check_arity(self, name, index, positional, keywords):
+        if name not in self.v.operators:
+            if name in self.assigned or name in self.v.fields or name in BUILTIN_VARIABLES:
+                self.error(index, f"{name} 是变量，不能作为运算符调用")
+                return
+            hint = difflib.get_close_matches(name, self.v.operators, n=1)
+            suffix = f"（是否是 {hint[0]}？）" if hint else ''
+            if self.v.strict_operators:
+                self.error(index, f"未知的运算符 {name}{suffix}")
+            else:
+                # 运算符表不是从服务端获取的，可能只是内置表里缺了这个运算符
+                self.warnings.append(f"{name} 不在内置的运算符表中{suffix}")
+            return
+        signature = self.v.operators[name]
+        if signature is None:
+            return
+        params, required, variadic = signature
+        if positional > len(params) and not variadic:
+            self.error(index, f"{name} 最多接受 {len(params)} 个参数，实际 {positional} 个")
+        filled = positional
+        seen = set()
+        for keyword, kw_index in keywords:
+            if keyword not in params:
+                self.error(kw_index, f"{name} 没有关键字参数 {keyword}")
+            elif params.index(keyword) < positional or keyword in seen:
+                self.error(kw_index, f"{name} 的参数 {keyword} 重复指定")
+            elif params.index(keyword) < required:
+                filled += 1
+            seen.add(keyword)
+        if filled < required:
+            self.error(index, f"{name} 至少需要 {required} 个参数，实际 {filled} 个")
+
+    def variable(self, name, index):
+        if name in self.assigned or name in BUILTIN_VARIABLES or name in self.v.fields:
+            return
+        if name in self.v.operators:
+            self.error(index, f"运算符 {name} 缺少参数列表")
+            return
+        self.used_names.append((name, index))
+
+    def finish(self):
+        """所有语句解析完后处理未定义的变量"""
+        for name, index in self.used_names:
+            if name in self.assigned:
+                self.error(index, f"变量 {name} 在赋值之前被使用")
+                continue
+            hint = difflib.get_close_matches(name, self.assigned, n=1, cutoff=0.8)
+            if hint:
+                # 与本表达式中的局部变量只差几个字符，几乎一定是拼写错误
+                self.error(index, f"未定义的变量 {name}（是否是 {hint[0]}？）")
+            elif self.v.strict_fields:
+                self.error(index, f"未定义的变量或数据字段 {name}")
+            else:
+                self.warnings.append(f"{name} 不在本地数据字段目录中")
+
+
+class FastExprValidator:
+    """
+    FASTEXPR 表达式校验器
+
+    语法错误、参数个数或关键字参数错误、变量在赋值前使用，一律视为错误；
+    未知的运算符在 strict_operators=True（运算符表来自 /operators）时视为错误，否则只给出警告；
+    既不是局部变量也不在本地数据字段目录中的名字，默认只给出警告
+    （本地目录只包含获取过的数据集），strict_fields=True 时视为错误。
+    """
+
+    def __init__(self, fields=(), operators=None, strict_fields=False, strict_operators=False):
+        """
+        Args:
+            fields: 已知的数据字段ID集合（通常来自 DatafieldCatalog.all_field_ids()）
+            operators: 运算符签名表，默认内置的 OPERATORS
+            strict_fields: 未知的数据字段是否视为错误
+            strict_operators: 未知的运算符是否视为错误
+        """
+        self.fields = frozenset(fields)
+        self.operators = OPERATORS if operators is None else operators
+        self.strict_fields = strict_fields
+        self.strict_operators = strict_operators
+
+    def validate(self, expression):
+        """
+        校验表达式
+
+        Returns:
+            tuple: (errors, warnings)，两个字符串列表；errors为空表示可以提交
+        """
+        try:
+            checker = _Checker(self, expression, tokenize(expression))
+            checker.program()
+            checker.finish()
+        except FastExprError as e:
+            return e.errors, []
+        return checker.errors, checker.warnings
+
+    def check(self, expression):
+        """
+        校验表达式，有错误时抛出 FastExprError
+
+        Returns:
+            list: 警告信息
+        """
+        errors, warnings = self.validate(expression)
+        if errors:
+            raise FastExprError(errors)
+        return warnings
+
+
+_default_validator = None
+
+
+def default_validator():
+    """
+    使用本地数据字段目录和运算符目录缓存的校验器（首次调用时读取缓存）
+
+    运算符目录缓存存在时以其为准，未知运算符视为错误；否则使用内置的运算符表，未知运算符只给出警告。
+    """
+    global _default_validator
+    if _default_validator is None:
+        from datafield_catalog import DatafieldCatalog
+        from operator_catalog import OperatorCatalog
+        entries = OperatorCatalog().load()
+        operators = operators_from_api(entries) if entries else None
+        _default_validator = FastExprValidator(DatafieldCatalog().all_field_ids(), operators=operators,
+                                               strict_operators=bool(operators))
+    return _default_validator
+
+
+def validate_expression(expression):
+    """用默认校验器校验表达式，返回 (errors, warnings)"""
+    return default_validator().validate(expression)
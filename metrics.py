@@ -0,0 +1,314 @@
+# 进程级指标（计数器 + 计时器 + 瞬时值）
+# 功能：记录请求数、429、重试、重新登录等计数，提交、排队、仿真、检查等待等阶段耗时，以及队列长度等瞬时值；
+#      计时器按固定桶累积，长时间运行内存不增长；
+#      snapshot() 返回当前快照，可导出为 Prometheus 文本格式或追加写入 JSON-lines 文件。
+#      rss_bytes() 读取进程当前的常驻内存，用于观察内存是否随待处理行数增长。
+#
+# 用法:
+#     from metrics import METRICS
+#     METRICS.inc('http_429_total')
+#     with METRICS.timer('simulation_seconds'):
+#         ...
+#     METRICS.observe('check_wait_seconds', 12.3)
+#     METRICS.set_gauge('poll_scheduler_pending', 42)
+#     print(METRICS.snapshot())
+import json
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 计时器的桶上限（秒），覆盖单个请求到一次长时间仿真
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+_ID_SEGMENT = re.compile(r'/(simulations|alphas)/[^/?]+')
+
+
+def endpoint_of(url):
+    """把URL归一化成接口名，如 https://.../alphas/abc/check -> /alphas/{id}/check"""
+    path = re.sub(r'^[a-z]+://[^/]+', '', url).split('?', 1)[0]
+    return _ID_SEGMENT.sub(lambda m: f"/{m.group(1)}/{{id}}", path)
+
+
+def rss_bytes():
+    """当前进程的常驻内存（字节）；没有 /proc 时返回进程的峰值常驻内存，都取不到（Windows）时返回None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以KB为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def result_label(check_result):
+    """
+    检查结果作为指标标签的取值：异常信息（"Exception: ..."）和空值统一记为 ERROR，
+    否则每条不同的异常信息都会成为一个新的时间序列
+    """
+    if not check_result or str(check_result).startswith('Exception'):
+        return 'ERROR'
+    return check_result
+
+
+def _escape_label(value):
+    """按Prometheus文本格式转义标签值中的反斜杠、双引号和换行"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series_key(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in labels) + '}'
+
+
+class _Timer:
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self, n_buckets):
+        self.counts = [0] * (n_buckets + 1)  # 最后一个桶是 +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class Metrics:
+    """
+    线程安全的指标注册表
+
+    名字相同、标签不同的指标是不同的序列，如 http_requests_total{endpoint="/simulations",status="201"}。
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timers = {}
+        self._gauges = {}
+        self._started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        """计数器加value"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """设置瞬时值（如队列长度、在途数量）"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        """记录一次耗时（秒）"""
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = _Timer(len(self.buckets))
+            timer.counts[index] += 1
+            timer.count += 1
+            timer.total += seconds
+            if seconds > timer.max:
+                timer.max = seconds
+
+    def timer(self, name, **labels):
+        """计时上下文管理器：with METRICS.timer('alpha_info_seconds'): ..."""
+        return _TimerContext(self, name, labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+            self._gauges.clear()
+            self._started = time.time()
+
+    def _quantile(self, timer, q):
+        """按桶线性插值估计分位数"""
+        if timer.count == 0:
+            return None
+        target = q * timer.count
+        cumulative = 0
+        lower = 0.0
+        for i, count in enumerate(timer.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else timer.max
+            if count and cumulative + count >= target:
+                fraction = (target - cumulative) / count
+                return min(lower + (upper - lower) * fraction, timer.max)
+            cumulative += count
+            lower = upper
+        return timer.max
+
+    def snapshot(self):
+        """
+        当前所有指标的快照
+
+        Returns:
+            dict: {
+                'timestamp', 'uptime_seconds',
+                'counters': {序列名: 值},
+                'gauges': {序列名: 值},
+                'timers': {序列名: {'count', 'sum', 'mean', 'max', 'p50', 'p90', 'p99'}},
+            }
+        """
+        with self._lock:
+            counters = {_series_key(name, labels): value
+                        for (name, labels), value in sorted(self._counters.items())}
+            gauges = {_series_key(name, labels): value
+                      for (name, labels), value in sorted(self._gauges.items())}
+            timers = {}
+            for (name, labels), timer in sorted(self._timers.items()):
+                timers[_series_key(name, labels)] = {
+                    'count': timer.count,
+                    'sum': round(timer.total, 3),
+                    'mean': round(timer.total / timer.count, 3) if timer.count else None,
+                    'max': round(timer.max, 3),
+                    'p50': self._round(self._quantile(timer, 0.5)),
+                    'p90': self._round(self._quantile(timer, 0.9)),
+                    'p99': self._round(self._quantile(timer, 0.99)),
+                }
+        return {
+            'timestamp': time.time(),
+            'uptime_seconds': round(time.time() - self._started, 1),
+            'counters': counters,
+            'gauges': gauges,
+            'timers': timers,
+        }
+
+    @staticmethod
+    def _round(value):
+        return None if value is None else round(value, 3)
+
+    def prometheus_text(self):
+        """Prometheus文本格式（计数器 -> counter，瞬时值 -> gauge，计时器 -> histogram）"""
+        lines = []
+        with self._lock:
+            typed = set()
+            for kind, series in (('counter', self._counters), ('gauge', self._gauges)):
+                for (name, labels), value in sorted(series.items()):
+                    if name not in typed:
+                        lines.append(f"# TYPE {name} {kind}")
+                        typed.add(name)
+                    lines.append(f"{_series_key(name, labels)} {value}")
+            for (name, labels), timer in sorted(self._timers.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for i, count in enumerate(timer.counts):
+                    cumulative += count
+                    le = str(self.buckets[i]) if i < len(self.buckets) else '+Inf'
+                    lines.append(f"{_series_key(name + '_bucket', labels + (('le', le),))} {cumulative}")
+                lines.append(f"{_series_key(name + '_sum', labels)} {timer.total}")
+                lines.append(f"{_series_key(name + '_count', labels)} {timer.count}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """人可读的摘要文本：各计时器的次数/均值/p50/p99和所有计数器"""
+        snap = self.snapshot()
+        lines = [f"运行时间: {snap['uptime_seconds']} 秒"]
+        for key, timer in snap['timers'].items():
+            lines.append(f"  {key}: n={timer['count']} 合计={timer['sum']}s 均值={timer['mean']}s "
+                         f"p50={timer['p50']}s p99={timer['p99']}s 最大={timer['max']}s")
+        for key, value in list(snap['counters'].items()) + list(snap['gauges'].items()):
+            lines.append(f"  {key}: {value}")
+        return '\n'.join(lines)
+
+
+class _TimerContext:
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.monotonic() - self.start, **self.labels)
+        return False
+
+
+class JsonLinesExporter:
+    """
+    后台线程每隔interval秒把快照追加写入JSON-lines文件，stop()时再写一次
+
+    用法:
+        exporter = JsonLinesExporter('metrics.jsonl').start()
+        ...
+        exporter.stop()
+    """
+
+    def __init__(self, path, interval=60.0, metrics=None):
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics or METRICS
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-jsonl', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.write()
+
+    def write(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.metrics.snapshot(), ensure_ascii=False) + '\n')
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"[指标] 写入 {self.path} 失败: {e}")
+
+
+def start_prometheus_server(port, host='127.0.0.1', metrics=None):
+    """
+    在后台线程启动 /metrics HTTP端点供Prometheus抓取（默认只监听本机，需要从其他机器抓取时指定host）
+
+    Returns:
+        ThreadingHTTPServer: 调用 shutdown() 停止
+    """
+    registry = metrics or METRICS
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            data = registry.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    print(f"[指标] Prometheus端点: http://{host}:{port}/metrics")
+    return server
+
+
+# 进程内所有模块共用的指标注册表
+METRICS = Metrics()
@@ -0,0 +1,549 @@
+# 本地模拟 WorldQuant Brain API 服务器（仅用标准库）
+# 功能：实现 /authentication、/simulations（Location + Retry-After，支持multi-simulation）、
+#      /alphas/{id}、/alphas/{id}/check、PATCH /alphas/{id}、
+#      /alphas/{id}/recordsets/{pnl,turnover,long-short-count}、
+#      /users/self/alphas（已提交alpha列表）、/data-fields 分页；
+#      可配置响应延迟、429注入、同时运行的仿真数量上限、5xx失败率和仿真失败率，
+#      并按接口统计请求数、状态码、延迟以及每个alpha各阶段的时间点，供 benchmark.py 生成报告。
+#
+# 用法:
+#     python mock_brain_server.py --port 8777 --latency 0.05 --throttle-rate 0.02
+#     WQ_API_BASE=http://127.0.0.1:8777 python simulate_from_csv.py 10
+import argparse
+import base64
+import itertools
+import json
+import random
+import re
+import secrets
+import threading
+import time
+import zlib
+from collections import defaultdict
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# 路由：(方法, 正则) -> 统计用的接口名
+_ROUTES = [
+    ('POST', re.compile(r'^/authentication$'), 'auth'),
+    ('POST', re.compile(r'^/simulations$'), 'simulate'),
+    ('GET', re.compile(r'^/simulations/(?P<id>[^/]+)$'), 'progress'),
+    ('GET', re.compile(r'^/alphas/(?P<id>[^/]+)$'), 'alpha'),
+    ('PATCH', re.compile(r'^/alphas/(?P<id>[^/]+)$'), 'patch'),
+    ('GET', re.compile(r'^/alphas/(?P<id>[^/]+)/check$'), 'check'),
+    ('GET', re.compile(r'^/alphas/(?P<id>[^/]+)/recordsets/(?P<name>[^/]+)$'), 'recordset'),
+    ('GET', re.compile(r'^/users/self/alphas$'), 'user-alphas'),
+    ('GET', re.compile(r'^/data-fields$'), 'data-fields'),
+    ('GET', re.compile(r'^/mock/stats$'), 'stats'),
+]
+
+# 每个alpha记录的时间点，相邻两个时间点之差即为一个阶段的耗时
+ALPHA_STAGES = [
+    ('simulate', 'submitted', 'sim_seen'),    # 提交 -> 客户端轮询到仿真完成
+    ('fetch', 'sim_seen', 'fetched'),         # 仿真完成 -> 读取alpha信息
+    ('check', 'fetched', 'check_done'),       # 读取alpha信息 -> 拿到检查结果
+    ('tag', 'check_done', 'tagged'),          # 拿到检查结果 -> 打标签
+]
+
+
+class MockBrainServer(ThreadingHTTPServer):
+    """
+    模拟 Brain API 的多线程HTTP服务器
+
+    用法:
+        server = MockBrainServer(latency=0.05).start()
+        os.environ['WQ_API_BASE'] = server.base_url
+        ...
+        print(server.stats())
+        server.stop()
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, latency_jitter=0.0,
+                 throttle_rate=0.0, throttle_retry_after=1.0, max_concurrent_simulations=0,
+                 error_rate=0.0, sim_fail_rate=0.0, sim_time=5.0, check_time=2.0,
+                 poll_interval=1.0, ready_delay=0.0, pass_rate=0.3, token_ttl=4 * 3600, datafields=200,
+                 pnl_days=756, submitted_alphas=0, seed=None):
+        """
+        Args:
+            host, port: 监听地址，port=0 表示自动选择空闲端口
+            latency: 每个请求的固定延迟（秒）
+            latency_jitter: 在固定延迟上额外增加的 [0, jitter] 均匀随机延迟
+            throttle_rate: 随机返回429的概率（/authentication 除外）
+            throttle_retry_after: 429响应的Retry-After秒数
+            max_concurrent_simulations: 同时运行的仿真数量上限，超过时提交返回429，0表示不限制
+            error_rate: 随机返回500的概率
+            sim_fail_rate: 仿真结束时状态为ERROR的概率
+            sim_time: 平均仿真耗时（秒），实际在 [0.5, 1.5] 倍之间随机
+            check_time: 检查接口从首次请求到给出结果的耗时（秒）
+            poll_interval: 进度接口和检查接口返回的Retry-After秒数
+            ready_delay: 仿真完成后alpha数据就绪的耗时（秒）；就绪前alpha信息没有IS指标，
+                         检查接口返回不带Retry-After的空结果（客户端视为 "sleep"）
+            pass_rate: alpha通过全部检查的概率
+            token_ttl: 认证token有效期（秒），过期后返回401
+            datafields: /data-fields 返回的数据字段数量
+            pnl_days: PnL记录集的交易日数量；去掉数字参数后表达式相同的alpha（如只有days不同）PnL高度相关
+            submitted_alphas: 预先创建的已提交（ACTIVE）alpha数量，作为自相关参考集
+            seed: 随机数种子
+        """
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.throttle_rate = throttle_rate
+        self.throttle_retry_after = throttle_retry_after
+        self.max_concurrent_simulations = max_concurrent_simulations
+        self.error_rate = error_rate
+        self.sim_fail_rate = sim_fail_rate
+        self.sim_time = sim_time
+        self.check_time = check_time
+        self.poll_interval = poll_interval
+        self.ready_delay = ready_delay
+        self.pass_rate = pass_rate
+        self.token_ttl = token_ttl
+        self.datafields = datafields
+        self.pnl_days = pnl_days
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._tokens = {}        # token -> 过期时间
+        self._simulations = {}   # 仿真ID -> 仿真记录
+        self._alphas = {}        # alpha ID -> alpha记录
+        self._requests = defaultdict(lambda: defaultdict(int))  # 接口 -> 状态码 -> 次数
+        self._latencies = defaultdict(list)                      # 接口 -> 响应耗时列表
+        self._thread = None
+        self._pnl_dates = self._trading_days(pnl_days)
+        for i in range(submitted_alphas):
+            self._alphas[f"R{i}"] = {
+                'submitted': 0.0, 'sim_seen': None, 'ready_at': 0.0, 'passed': True,
+                'sharpe': round(self._random.uniform(1.25, 2.5), 2),
+                'fitness': round(self._random.uniform(1.0, 1.8), 2),
+                'turnover': round(self._random.uniform(0.01, 0.3), 4),
+                'regular': f"rank(ts_mean(mock_f{i % max(datafields, 1)}, 20))",
+                'tags': [], 'status': 'ACTIVE',
+            }
+
+    @staticmethod
+    def _trading_days(n, end=date(2024, 12, 31)):
+        days = []
+        day = end
+        while len(days) < n:
+            if day.weekday() < 5:
+                days.append(day.isoformat())
+            day -= timedelta(days=1)
+        return days[::-1]
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程中运行服务器"""
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-brain', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    # ------------------------------------------------------------------ 统计
+
+    def stats(self):
+        """
+        请求与阶段统计
+
+        Returns:
+            dict: {
+                'requests': {接口: {状态码: 次数}},
+                'latency': {接口: [秒, ...]},
+                'stages': {阶段: [秒, ...]},
+                'alphas': alpha总数, 'checked': 拿到检查结果的alpha数, 'tagged': 打过标签的alpha数,
+            }
+        """
+        with self._lock:
+            stages = {name: [] for name, _, _ in ALPHA_STAGES}
+            stages['total'] = []
+            for alpha in self._alphas.values():
+                for name, start, end in ALPHA_STAGES:
+                    if alpha.get(start) is not None and alpha.get(end) is not None:
+                        stages[name].append(alpha[end] - alpha[start])
+                last = alpha.get('tagged') or alpha.get('check_done')
+                if last is not None:
+                    stages['total'].append(last - alpha['submitted'])
+            return {
+                'requests': {route: dict(codes) for route, codes in self._requests.items()},
+                'latency': {route: list(values) for route, values in self._latencies.items()},
+                'stages': stages,
+                'alphas': len(self._alphas),
+                'checked': sum(1 for a in self._alphas.values() if a.get('check_done') is not None),
+                'tagged': sum(1 for a in self._alphas.values() if a.get('tagged') is not None),
+            }
+
+    def _record(self, route, status, elapsed):
+        with self._lock:
+            self._requests[route][status] += 1
+            self._latencies[route].append(elapsed)
+
+    # ------------------------------------------------------------------ 请求处理
+
+    def handle_request_from(self, handler, method):
+        start = time.monotonic()
+        url = urlsplit(handler.path)
+        route, match = 'unknown', None
+        for route_method, pattern, name in _ROUTES:
+            m = pattern.match(url.path)
+            if m and route_method == method:
+                route, match = name, m
+                break
+
+        delay = self.latency + (self._random.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+        if delay > 0 and route != 'stats':
+            time.sleep(delay)
+
+        status, headers, body = self._dispatch(handler, method, route, match, url)
+        handler.send_json(status, body, headers)
+        if route != 'stats':
+            self._record(route, status, time.monotonic() - start)
+
+    def _dispatch(self, handler, method, route, match, url):
+        if route == 'unknown':
+            return 404, {}, {'detail': 'Not found.'}
+        if route == 'stats':
+            return 200, {}, self.stats()
+        if route == 'auth':
+            return self._authenticate(handler)
+        if self.throttle_rate and self._random.random() < self.throttle_rate:
+            return 429, {'Retry-After': str(self.throttle_retry_after)}, {'detail': 'Too many requests.'}
+        if self.error_rate and self._random.random() < self.error_rate:
+            return 500, {}, {'detail': 'Injected server error.'}
+        if not self._authorized(handler):
+            return 401, {}, {'detail': 'Incorrect authentication credentials.'}
+
+        if route == 'simulate':
+            return self._create_simulation(handler)
+        if route == 'progress':
+            return self._simulation_progress(match['id'])
+        if route == 'alpha':
+            return self._alpha_info(match['id'])
+        if route == 'patch':
+            return self._patch_alpha(match['id'], handler.read_json())
+        if route == 'check':
+            return self._check_alpha(match['id'])
+        if route == 'recordset':
+            return self._recordset(match['id'], match['name'])
+        if route == 'user-alphas':
+            return self._user_alphas(parse_qs(url.query))
+        return self._data_fields(parse_qs(url.query))
+
+    def _authenticate(self, handler):
+        auth = handler.headers.get('Authorization', '')
+        if not auth.startswith('Basic '):
+            return 401, {}, {'detail': 'Authentication credentials were not provided.'}
+        try:
+            username = base64.b64decode(auth[6:]).decode('utf-8').split(':', 1)[0]
+        except ValueError:
+            return 401, {}, {'detail': 'Invalid basic auth header.'}
+        token = secrets.token_hex(16)
+        with self._lock:
+            self._tokens[token] = time.monotonic() + self.token_ttl
+        headers = {'Set-Cookie': f't={token}; Path=/'}
+        return 201, headers, {'user': {'id': username or 'MOCK'}, 'token': {'expiry': self.token_ttl}}
+
+    def _authorized(self, handler):
+        cookies = handler.headers.get('Cookie', '')
+        for part in cookies.split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == 't':
+                with self._lock:
+                    expires_at = self._tokens.get(value)
+                return expires_at is not None and expires_at > time.monotonic()
+        return False
+
+    def _running_simulations(self, now):
+        return sum(1 for sim in self._simulations.values()
+                   if sim['parent'] is None and sim['done_at'] > now)
+
+    def _new_simulation(self, payload, now, duration, parent=None):
+        sim_id = f"S{next(self._ids)}"
+        sim = {
+            'id': sim_id,
+            'parent': parent,
+            'created_at': now,
+            'done_at': now + duration,
+            'failed': self._random.random() < self.sim_fail_rate,
+            'alpha_id': None,
+            'children': None,
+            'payload': payload,
+        }
+        self._simulations[sim_id] = sim
+        return sim
+
+    def _create_simulation(self, handler):
+        payload = handler.read_json()
+        if isinstance(payload, list):
+            if not 2 <= len(payload) <= 10:
+                return 400, {}, {'detail': 'A multi-simulation must contain 2 to 10 simulations.'}
+        elif not isinstance(payload, dict) or 'regular' not in payload:
+            return 400, {}, {'detail': 'Invalid simulation payload.'}
+
+        now = time.monotonic()
+        with self._lock:
+            if self.max_concurrent_simulations and \
+                    self._running_simulations(now) >= self.max_concurrent_simulations:
+                return 429, {'Retry-After': str(self.poll_interval)}, \
+                    {'detail': 'CONCURRENT_SIMULATION_LIMIT_EXCEEDED'}
+            duration = self.sim_time * self._random.uniform(0.5, 1.5)
+            sim = self._new_simulation(payload, now, duration)
+            if isinstance(payload, list):
+                sim['failed'] = False
+                sim['children'] = [
+                    self._new_simulation(child, now, duration, parent=sim['id'])['id']
+                    for child in payload
+                ]
+        return 201, {'Location': f"{self.base_url}/simulations/{sim['id']}"}, {}
+
+    def _simulation_progress(self, sim_id):
+        now = time.monotonic()
+        with self._lock:
+            sim = self._simulations.get(sim_id)
+            if sim is None:
+                return 404, {}, {'detail': 'Not found.'}
+            if now < sim['done_at']:
+                progress = 1 - (sim['done_at'] - now) / max(self.sim_time, 1e-9)
+                return 200, {'Retry-After': str(self.poll_interval)}, {'progress': round(max(progress, 0), 2)}
+            if sim['children'] is not None:
+                return 200, {}, {'id': sim_id, 'status': 'COMPLETE', 'children': sim['children']}
+            if sim['failed']:
+                return 200, {}, {'id': sim_id, 'status': 'ERROR', 'message': 'Injected simulation failure.'}
+            if sim['alpha_id'] is None:
+                alpha_id = f"A{next(self._ids)}"
+                sim['alpha_id'] = alpha_id
+                self._alphas[alpha_id] = {
+                    'submitted': sim['created_at'],
+                    'sim_seen': now,
+                    'ready_at': now + self.ready_delay,
+                    'passed': self._random.random() < self.pass_rate,
+                    'sharpe': round(self._random.uniform(-1.0, 2.5), 2),
+                    'fitness': round(self._random.uniform(-0.5, 1.8), 2),
+                    'turnover': round(self._random.uniform(0.01, 0.8), 4),
+                    'regular': sim['payload'].get('regular'),
+                    'tags': [],
+                    'status': 'UNSUBMITTED',
+                }
+            return 200, {}, {'id': sim_id, 'status': 'COMPLETE', 'alpha': sim['alpha_id']}
+
+    def _alpha_info(self, alpha_id):
+        now = time.monotonic()
+        with self._lock:
+            alpha = self._alphas.get(alpha_id)
+            if alpha is None:
+                return 404, {}, {'detail': 'Not found.'}
+            if now < alpha['ready_at']:
+                return 200, {}, {'id': alpha_id, 'type': 'REGULAR', 'tags': alpha['tags'], 'is': {}}
+            if alpha.get('fetched') is None:
+                alpha['fetched'] = now
+            return 200, {}, {
+                'id': alpha_id,
+                'type': 'REGULAR',
+                'regular': {'code': alpha['regular']},
+                'tags': alpha['tags'],
+                'is': {
+                    'sharpe': alpha['sharpe'],
+                    'fitness': alpha['fitness'],
+                    'turnover': alpha['turnover'],
+                    'returns': round(alpha['sharpe'] * 0.05, 4),
+                    'drawdown': round(abs(alpha['sharpe']) * 0.02, 4),
+                    'margin': round(alpha['sharpe'] * 0.0003, 6),
+                    'longCount': alpha.setdefault('long_count', self._random.randint(1200, 1800)),
+                    'shortCount': alpha.setdefault('short_count', self._random.randint(1200, 1800)),
+                },
+            }
+
+    def _check_alpha(self, alpha_id):
+        now = time.monotonic()
+        with self._lock:
+            alpha = self._alphas.get(alpha_id)
+            if alpha is None:
+                return 404, {}, {'detail': 'Not found.'}
+            if now < alpha['ready_at']:
+                return 200, {}, {}
+            if alpha.get('check_started') is None:
+                alpha['check_started'] = now
+            if now < alpha['check_started'] + self.check_time:
+                return 200, {'Retry-After': str(self.poll_interval)}, {}
+            if alpha.get('check_done') is None:
+                alpha['check_done'] = now
+            result = 'PASS' if alpha['passed'] else 'FAIL'
+            return 200, {}, {'is': {'checks': [
+                {'name': 'LOW_SHARPE', 'result': result, 'limit': 1.25, 'value': alpha['sharpe']},
+                {'name': 'LOW_FITNESS', 'result': result, 'limit': 1.0, 'value': alpha['fitness']},
+                {'name': 'SELF_CORRELATION', 'result': 'PASS', 'limit': 0.7,
+                 'value': round(self._random.uniform(0.1, 0.6), 4)},
+            ]}}
+
+    def _daily_pnl(self, alpha_id, alpha):
+        """日PnL = 表达式共同因子 + alpha自身噪声；去掉数字参数后表达式相同的alpha共用因子"""
+        family = re.sub(r'\b\d+(\.\d+)?\b', '', alpha['regular'] or '')
+        factor = random.Random(zlib.crc32(family.encode('utf-8')))
+        noise = random.Random(zlib.crc32(alpha_id.encode('utf-8')))
+        drift = alpha['sharpe'] / 16.0
+        return [1000.0 * (drift + 0.9 * factor.gauss(0, 1) + 0.45 * noise.gauss(0, 1))
+                for _ in self._pnl_dates]
+
+    def _daily_turnover(self, alpha_id, alpha):
+        noise = random.Random(zlib.crc32(f"{alpha_id}/turnover".encode('utf-8')))
+        return [round(max(0.0, alpha['turnover'] * (1 + 0.2 * noise.gauss(0, 1))), 4) for _ in self._pnl_dates]
+
+    def _daily_long_short_count(self, alpha_id):
+        noise = random.Random(zlib.crc32(f"{alpha_id}/count".encode('utf-8')))
+        return [(1500 + int(noise.gauss(0, 50)), 1500 + int(noise.gauss(0, 50))) for _ in self._pnl_dates]
+
+    def _recordset(self, alpha_id, name):
+        now = time.monotonic()
+        with self._lock:
+            alpha = self._alphas.get(alpha_id)
+            if alpha is None or name not in ('pnl', 'turnover', 'long-short-count'):
+                return 404, {}, {'detail': 'Not found.'}
+            if now < alpha['ready_at']:
+                return 200, {'Retry-After': str(self.poll_interval)}, {}
+            alpha = dict(alpha)
+        if name == 'turnover':
+            columns = [('turnover', 'percent')]
+            records = [[day, value] for day, value in zip(self._pnl_dates, self._daily_turnover(alpha_id, alpha))]
+        elif name == 'long-short-count':
+            columns = [('longCount', 'integer'), ('shortCount', 'integer')]
+            records = [[day, long_count, short_count] for day, (long_count, short_count)
+                       in zip(self._pnl_dates, self._daily_long_short_count(alpha_id))]
+        else:
+            columns = [('pnl', 'amount')]
+            cumulative = 0.0
+            records = []
+            for day, pnl in zip(self._pnl_dates, self._daily_pnl(alpha_id, alpha)):
+                cumulative += pnl
+                records.append([day, round(cumulative, 2)])
+        properties = [{'name': 'date', 'type': 'date'}] + [{'name': col, 'type': t} for col, t in columns]
+        return 200, {}, {'schema': {'name': name, 'properties': properties}, 'records': records}
+
+    def _user_alphas(self, query):
+        limit = int(query.get('limit', ['100'])[0])
+        offset = int(query.get('offset', ['0'])[0])
+        status = query.get('status', [None])[0]
+        with self._lock:
+            matched = [
+                {'id': alpha_id, 'status': alpha['status'], 'tags': alpha['tags']}
+                for alpha_id, alpha in self._alphas.items()
+                if status is None or alpha['status'] == status
+            ]
+        return 200, {}, {'count': len(matched), 'results': matched[offset:offset + limit]}
+
+    def _patch_alpha(self, alpha_id, body):
+        now = time.monotonic()
+        with self._lock:
+            alpha = self._alphas.get(alpha_id)
+            if alpha is None:
+                return 404, {}, {'detail': 'Not found.'}
+            if alpha.get('tagged') is None:
+                alpha['tagged'] = now
+            if isinstance(body, dict) and 'tags' in body:
+                alpha['tags'] = body['tags']
+            return 200, {}, {'id': alpha_id, 'tags': alpha['tags']}
+
+    def _data_fields(self, query):
+        limit = int(query.get('limit', ['50'])[0])
+        offset = int(query.get('offset', ['0'])[0])
+        dataset = query.get('dataset.id', [''])[0] or 'mock'
+        results = [
+            {
+                'id': f"{dataset}_f{i}",
+                'type': 'MATRIX' if i % 3 else 'VECTOR',
+                'description': f"Mock field {i}",
+                'dataset': {'id': dataset},
+            }
+            for i in range(offset, min(offset + limit, self.datafields))
+        ]
+        return 200, {}, {'count': self.datafields, 'results': results}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # 不打印每个请求
+
+    def read_json(self):
+        if not self.body:
+            return None
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+    def send_json(self, status, body, headers):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        # 先读完请求体：提前返回429/401时未读取的请求体会破坏keep-alive连接上的下一个请求
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+        self.server.handle_request_from(self, method)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟 WorldQuant Brain API 服务器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8777)
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的固定延迟（秒）')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='额外的随机延迟上限（秒）')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='随机返回429的概率')
+    parser.add_argument('--throttle-retry-after', type=float, default=1.0, help='429的Retry-After秒数')
+    parser.add_argument('--max-concurrent-simulations', type=int, default=0,
+                        help='同时运行的仿真数量上限，0表示不限制')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='随机返回500的概率')
+    parser.add_argument('--sim-fail-rate', type=float, default=0.0, help='仿真失败的概率')
+    parser.add_argument('--sim-time', type=float, default=5.0, help='平均仿真耗时（秒）')
+    parser.add_argument('--check-time', type=float, default=2.0, help='检查耗时（秒）')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='Retry-After秒数')
+    parser.add_argument('--ready-delay', type=float, default=0.0, help='仿真完成后alpha数据就绪的耗时（秒）')
+    parser.add_argument('--pass-rate', type=float, default=0.3, help='通过全部检查的概率')
+    parser.add_argument('--token-ttl', type=float, default=4 * 3600, help='token有效期（秒）')
+    parser.add_argument('--datafields', type=int, default=200, help='数据字段数量')
+    parser.add_argument('--pnl-days', type=int, default=756, help='PnL记录集的交易日数量')
+    parser.add_argument('--submitted-alphas', type=int, default=0, help='预先创建的已提交alpha数量')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockBrainServer(**vars(args))
+    print(f"模拟服务器已启动: {server.base_url}")
+    print(f"使用方法: WQ_API_BASE={server.base_url} python simulate_from_csv.py")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# 运算符目录缓存
+# 功能：把 /operators 返回的运算符列表缓存到本地磁盘，供 fastexpr 做提交前校验；
+#      TTL内直接读缓存，不发任何请求；获取失败时继续使用过期的缓存，
+#      从来没有获取成功过时 fastexpr 退回内置的运算符表（未知运算符只给出警告）
+import json
+import os
+import time
+
+from simulate_and_check_for1 import requests_wq, API_BASE
+
+# 默认缓存文件
+DEFAULT_OPERATOR_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.operator_cache.json')
+
+
+class OperatorCatalog:
+    """
+    本地磁盘缓存的运算符目录
+
+    用法:
+        catalog = OperatorCatalog()
+        catalog.get(pool)          # 缓存过期时请求 /operators 并写入缓存
+        entries = catalog.load()   # 只读缓存，不发请求；没有缓存时为None
+    """
+
+    def __init__(self, cache_path=DEFAULT_OPERATOR_CACHE, ttl=7 * 86400):
+        """
+        Args:
+            cache_path: 缓存文件路径
+            ttl: 缓存有效期（秒），有效期内不发请求
+        """
+        self.cache_path = cache_path
+        self.ttl = ttl
+
+    def _load(self):
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, entry):
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+    def load(self):
+        """
+        本地缓存的运算符列表（不发请求，不检查TTL）
+
+        Returns:
+            list | None: /operators 返回的运算符（每个是含 name、definition 等键的字典），没有缓存时为None
+        """
+        entry = self._load()
+        return entry['results'] if entry else None
+
+    def get(self, pool, refresh=False):
+        """
+        获取运算符列表
+
+        Args:
+            pool: SessionPool会话池（缓存命中时不会借用会话，也就不会登录）
+            refresh: 忽略缓存强制重新获取
+
+        Returns:
+            list | None: 运算符列表；获取失败且没有缓存时为None
+        """
+        entry = None if refresh else self._load()
+        if entry is not None and time.time() - entry['fetched_at'] < self.ttl:
+            print(f"[运算符目录] 命中缓存: {len(entry['results'])} 个运算符")
+            return entry['results']
+
+        with pool.session() as sess:
+            response, sess = requests_wq(sess, 'get', f"{API_BASE}/operators", pass_statuses=(403, 404))
+        results = None
+        if response is not None and response.status_code == 200:
+            try:
+                results = response.json()
+            except ValueError:
+                results = None
+            if isinstance(results, dict):
+                results = results.get('results')
+        if not isinstance(results, list) or not results:
+            status = response.status_code if response is not None else 'None'
+            print(f"警告: 获取运算符列表失败（状态码: {status}），"
+                  f"{'继续使用过期的缓存' if entry else '使用内置的运算符表'}")
+            return entry['results'] if entry else None
+
+        print(f"[运算符目录] 获取到 {len(results)} 个运算符")
+        self._save({'fetched_at': time.time(), 'results': results})
+        return results
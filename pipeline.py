@@ -0,0 +1,172 @@
+# 分阶段流水线
+# 功能：把一个alpha的处理拆成 提交 → 轮询 → 获取指标 → 检查 → 打标签 等阶段，
+#      每个阶段有自己的线程数和有界队列：下游处理不过来时上游的 put() 阻塞（背压），
+#      每个阶段可以按自己的真实瓶颈（服务端仿真名额、限流器、轮询数量）单独调大小，
+#      而不是所有阶段都用同一个 max_workers。
+#      各阶段的排队数量和忙碌线程数写入指标（pipeline_queue_depth / pipeline_busy_workers），
+#      并可定期打印。
+#
+# 用法:
+#     fetch = Stage('fetch', handle_fetch, workers=4, capacity=100)
+#     pipeline = Pipeline([submit, fetch, check, tag]).start(report_interval=30)
+#     submit.put(item)            # 队列满时阻塞
+#     ...
+#     pipeline.stop()
+import itertools
+import queue
+import threading
+import time
+import traceback
+
+from metrics import METRICS
+
+
+class Stage:
+    """
+    一个流水线阶段：有界队列 + 固定数量的工作线程
+
+    handler(item) 在工作线程中执行，处理完后自行把结果 put 到下一个阶段；
+    handler 抛出异常时调用 on_error(item, exc)，保证每个item都有去处。
+    队列按 priority 从小到大取出，同优先级先进先出。
+    """
+
+    def __init__(self, name, handler, workers=1, capacity=100, on_error=None):
+        """
+        Args:
+            name: 阶段名，用于线程名、日志和指标标签
+            handler: 处理函数 handler(item)
+            workers: 工作线程数
+            capacity: 队列容量，队列满时 put() 阻塞
+            on_error: 出错回调 on_error(item, exc)，None时只打印错误
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.capacity = capacity
+        self.on_error = on_error
+        self._queue = queue.PriorityQueue(maxsize=capacity)
+        self._seq = itertools.count()
+        self._stopped = threading.Event()
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f'{name}-{i}', daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        """停止工作线程；队列中未处理的item被丢弃"""
+        self._stopped.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def put(self, item, priority=0):
+        """
+        放入一个item；队列满时阻塞直到有空位（流水线已停止时直接丢弃）
+
+        Args:
+            item: 交给 handler 的item
+            priority: 优先级，数值越小越先处理
+        """
+        entry = (priority, next(self._seq), item)
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(entry, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        self._update_gauges()
+
+    def depth(self):
+        """排队中（尚未被工作线程取走）的item数量"""
+        return self._queue.qsize()
+
+    def busy(self):
+        """正在处理item的工作线程数"""
+        return self._busy
+
+    def _update_gauges(self):
+        METRICS.set_gauge('pipeline_queue_depth', self._queue.qsize(), stage=self.name)
+        METRICS.set_gauge('pipeline_busy_workers', self._busy, stage=self.name)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                _, _, item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self._busy += 1
+            self._update_gauges()
+            try:
+                with METRICS.timer('pipeline_stage_seconds', stage=self.name):
+                    self.handler(item)
+            except Exception as e:
+                print(f"[流水线] 阶段 {self.name} 处理时发生错误: {e}")
+                traceback.print_exc()
+                if self.on_error is not None:
+                    try:
+                        self.on_error(item, e)
+                    except Exception:
+                        traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                self._update_gauges()
+
+
+class Pipeline:
+    """一组按顺序排列的阶段，统一启动、停止和报告队列深度"""
+
+    def __init__(self, stages, probes=None):
+        """
+        Args:
+            stages: 按处理顺序排列的 Stage 列表
+            probes: 不属于Stage的其他队列 {名称: 返回当前数量的函数}，如轮询调度器中等待的URL数量，
+                    一并出现在 describe() 中
+        """
+        self.stages = list(stages)
+        self.probes = dict(probes or {})
+        self._stopped = threading.Event()
+        self._reporter = None
+
+    def start(self, report_interval=None):
+        """
+        启动所有阶段
+
+        Args:
+            report_interval: 每隔多少秒打印一次各阶段的队列深度，None表示不打印
+        """
+        for stage in self.stages:
+            stage.start()
+        if report_interval:
+            self._reporter = threading.Thread(target=self._report, args=(report_interval,),
+                                              name='pipeline-report', daemon=True)
+            self._reporter.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        for stage in self.stages:
+            stage.stop()
+
+    def depths(self):
+        """各阶段的 {阶段名: (排队数量, 忙碌线程数)}"""
+        return {stage.name: (stage.depth(), stage.busy()) for stage in self.stages}
+
+    def describe(self):
+        """一行文字描述各阶段的排队/忙碌情况，如 submit 0/100 忙1/2 | fetch ..."""
+        parts = [f"{name} 等待{probe()}" for name, probe in self.probes.items()]
+        parts += [f"{stage.name} 排队{stage.depth()}/{stage.capacity} 忙{stage.busy()}/{stage.workers}"
+                  for stage in self.stages]
+        return ' | '.join(parts)
+
+    def _report(self, interval):
+        while not self._stopped.wait(interval):
+            print(f"[流水线] {self.describe()}")
@@ -0,0 +1,150 @@
+# 集中式轮询调度器
+# 功能：所有待轮询的仿真进度URL和检查URL放在一个按截止时间排序的堆中，
+#      调度线程只在最近一个截止时间到达时醒来发出请求；
+#      响应带Retry-After则按新的截止时间重新入堆，否则把结果交给下游线程池处理。
+#      在途仿真数量与线程数量从此无关。
+#      call_later 登记不发请求的定时回调（如就绪检测的下一次重试），同样由调度线程按截止时间触发。
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from simulate_and_check_for1 import requests_wq
+from metrics import METRICS, endpoint_of
+
+
+class PollScheduler:
+    """
+    按Retry-After截止时间驱动的轮询调度器
+
+    用法:
+        scheduler = PollScheduler(pool, dispatcher)
+        scheduler.start()
+        scheduler.watch(progress_url, on_done)   # on_done(resp) 在dispatcher中执行
+        scheduler.call_later(5, retry)           # retry() 在dispatcher中执行，不发请求
+        ...
+        scheduler.stop()
+    """
+
+    def __init__(self, pool, dispatcher, max_concurrent_polls=4):
+        """
+        Args:
+            pool: SessionPool会话池，轮询请求从中借用会话
+            dispatcher: 执行下游回调的线程池（concurrent.futures.Executor）
+            max_concurrent_polls: 同时进行中的轮询请求数量上限
+        """
+        self.pool = pool
+        self.dispatcher = dispatcher
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._in_poll = 0
+        self._pollers = ThreadPoolExecutor(max_workers=max_concurrent_polls,
+                                           thread_name_prefix='poll')
+        self._thread = threading.Thread(target=self._run, name='poll-scheduler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止调度线程；堆中尚未到期的URL将被丢弃"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+        self._pollers.shutdown(wait=True)
+
+    def watch(self, url, callback, delay=0.0):
+        """
+        登记一个待轮询的URL
+
+        Args:
+            url: 仿真进度URL或 /alphas/{id}/check 等带Retry-After的URL
+            callback: 完成（响应不再带Retry-After）时调用 callback(resp)
+            delay: 首次轮询前等待的秒数
+        """
+        deadline = time.monotonic() + delay
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._seq), url, callback))
+            METRICS.set_gauge('poll_scheduler_pending', len(self._heap) + self._in_poll)
+            # 新的截止时间可能早于当前等待的那个，唤醒调度线程重新计算
+            self._cond.notify()
+
+    def call_later(self, delay, callback):
+        """
+        登记一个定时回调：delay秒后在dispatcher中调用 callback()，不发请求
+
+        Args:
+            delay: 等待秒数
+            callback: 无参数的回调
+        """
+        deadline = time.monotonic() + delay
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._seq), None, callback))
+            self._cond.notify()
+
+    def pending_count(self):
+        """等待轮询（含正在请求中）的URL和定时回调数量"""
+        with self._cond:
+            return len(self._heap) + self._in_poll
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._heap:
+                        timeout = self._heap[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, url, callback = heapq.heappop(self._heap)
+                if url is None:
+                    # 定时回调：不占用轮询线程
+                    METRICS.set_gauge('poll_scheduler_pending', len(self._heap) + self._in_poll)
+                    self.dispatcher.submit(self._dispatch_timer, callback)
+                    continue
+                self._in_poll += 1
+            self._pollers.submit(self._poll, url, callback)
+
+    def _poll(self, url, callback):
+        try:
+            METRICS.inc('scheduler_polls_total', endpoint=endpoint_of(url))
+            with self.pool.session() as sess:
+                resp, sess = requests_wq(sess, 'get', url)
+            retry_after = float(resp.headers.get("Retry-After", 0))
+            if retry_after > 0:
+                self.watch(url, callback, retry_after)
+            else:
+                self.dispatcher.submit(self._dispatch, callback, resp)
+        except Exception as e:
+            print(f"[调度器] 轮询 {url} 时发生错误: {e}")
+            traceback.print_exc()
+            self.dispatcher.submit(self._dispatch, callback, None)
+        finally:
+            with self._cond:
+                self._in_poll -= 1
+                METRICS.set_gauge('poll_scheduler_pending', len(self._heap) + self._in_poll)
+
+    @staticmethod
+    def _dispatch_timer(callback):
+        try:
+            callback()
+        except Exception as e:
+            print(f"[调度器] 定时回调发生错误: {e}")
+            traceback.print_exc()
+
+    @staticmethod
+    def _dispatch(callback, resp):
+        try:
+            callback(resp)
+        except Exception as e:
+            print(f"[调度器] 下游处理发生错误: {e}")
+            traceback.print_exc()
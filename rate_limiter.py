@@ -0,0 +1,135 @@
+# 进程级自适应限流器
+# 功能：所有会话（同步线程和asyncio协程）的请求都经过同一个令牌桶；
+#      成功时按加法缓慢提速，收到429时按乘法降速并让整个进程暂停到Retry-After之后（AIMD），
+#      避免多个线程各自休眠、再同时醒来撞上限流
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+class AdaptiveRateLimiter:
+    """
+    令牌桶 + AIMD 自适应限流器（线程安全，同步和异步共用）
+
+    用法:
+        RATE_LIMITER.acquire()              # 同步：发请求前调用
+        await RATE_LIMITER.acquire_async()  # 异步：发请求前调用
+        RATE_LIMITER.on_success()           # 请求成功
+        RATE_LIMITER.on_throttle(retry_after)  # 收到429
+    """
+
+    def __init__(self, rate=5.0, min_rate=0.2, max_rate=20.0, burst=5,
+                 increase=0.05, decrease=0.5, decrease_cooldown=2.0):
+        """
+        Args:
+            rate: 初始速率（请求/秒）
+            min_rate: 速率下限
+            max_rate: 速率上限
+            burst: 令牌桶容量，允许的瞬时突发请求数
+            increase: 每次成功后速率增加的量（加法增）
+            decrease: 收到429时速率乘以的系数（乘法减）
+            decrease_cooldown: 两次降速之间的最小间隔秒数，
+                               同一波429只降速一次，避免速率被一次限流打到底
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.decrease_cooldown = decrease_cooldown
+        self._lock = threading.Lock()
+        self._tat = 0.0  # 理论到达时间（GCRA）
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self.throttled_count = 0
+
+    def _reserve(self):
+        """预约一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            interval = 1.0 / self.rate
+            tat = max(self._tat, now)
+            start = max(tat - (self.burst - 1) * interval, self._paused_until, now)
+            self._tat = max(tat, start) + interval
+            return start - now
+
+    def acquire(self):
+        """阻塞直到允许发出下一个请求"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """挂起协程直到允许发出下一个请求"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        """请求成功：加法增速"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after):
+        """
+        收到429：乘法降速，并让整个进程暂停到Retry-After之后
+
+        Args:
+            retry_after: 服务端要求等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.throttled_count += 1
+            self._paused_until = max(self._paused_until, now + retry_after)
+            if now - self._last_decrease >= self.decrease_cooldown:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_decrease = now
+            rate = self.rate
+        print(f"[限流器] 收到429，全进程暂停 {retry_after:.1f} 秒，速率降至 {rate:.2f} 请求/秒")
+
+
+def parse_retry_after(headers):
+    """
+    解析Retry-After响应头（秒数或HTTP日期）
+
+    Returns:
+        float: 等待秒数，没有该响应头或无法解析时返回None
+    """
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# 退避指数的上限，2**32 倍的base早已超过任何cap
+MAX_BACKOFF_EXPONENT = 32
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """
+    指数退避 + 全抖动（full jitter）
+
+    Args:
+        attempt: 第几次重试（从0开始）
+        base: 首次退避的上限秒数
+        cap: 退避上限秒数
+
+    Returns:
+        float: 本次需要等待的秒数，在 [0, min(cap, base * 2**attempt)] 中均匀随机
+    """
+    # 指数部分封顶：重试次数不设上限的调用方（如 requests_wq）长时间重试后 2**attempt 不会溢出
+    return random.uniform(0, min(cap, base * 2 ** min(attempt, MAX_BACKOFF_EXPONENT)))
+
+
+# 进程内所有会话共用的限流器
+RATE_LIMITER = AdaptiveRateLimiter()
@@ -0,0 +1,110 @@
+# 就绪检测策略
+# 功能：仿真完成后，alpha信息和检查结果要过一段时间才就绪。
+#      以前固定等待10秒、检查未就绪时再固定等待40秒；现在改为短间隔自适应轮询：
+#      服务端给出Retry-After时严格遵守，否则从短间隔开始按倍数放大；
+#      记录最近若干次实际就绪所需的时间，第一次轮询直接安排在“通常就绪”的时间点附近；
+#      总等待时间和轮询次数上限（停止条件）可配置。
+#
+# 用法:
+#     policy = CHECK_READINESS
+#     delay = policy.first_delay()                   # 第一次轮询前等待
+#     delay = policy.next_delay(attempt, elapsed)    # 未就绪时下一次轮询前等待，None表示放弃
+#     policy.record_ready(elapsed)                   # 就绪后记录耗时，用于学习
+import threading
+from collections import deque
+
+
+class ReadinessPolicy:
+    """
+    自适应就绪轮询策略（线程安全，同步线程、调度器和asyncio协程共用）
+    """
+
+    def __init__(self, name, min_interval=1.0, max_interval=15.0, factor=1.5,
+                 max_wait=300.0, max_attempts=None, history=200, quantile=0.2):
+        """
+        Args:
+            name: 策略名，用于日志
+            min_interval: 未就绪时第一次重试的间隔秒数
+            max_interval: 重试间隔上限秒数
+            factor: 每次未就绪后间隔乘以的倍数
+            max_wait: 从开始等待算起的最长等待秒数，超过后放弃（None表示不限）
+            max_attempts: 最多轮询次数，超过后放弃（None表示不限）
+            history: 用于学习的最近就绪耗时条数
+            quantile: 第一次轮询安排在历史就绪耗时的该分位数处（偏早，避免错过就绪时间）
+        """
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.max_wait = max_wait
+        self.max_attempts = max_attempts
+        self.quantile = quantile
+        self._lock = threading.Lock()
+        self._observed = deque(maxlen=history)
+
+    def configure(self, **options):
+        """修改停止条件或间隔参数，如 configure(max_wait=120, min_interval=0.5)"""
+        with self._lock:
+            for key, value in options.items():
+                if not hasattr(self, key) or key.startswith('_'):
+                    raise AttributeError(f"未知的就绪策略参数: {key}")
+                setattr(self, key, value)
+
+    def record_ready(self, elapsed):
+        """记录一次从开始等待到就绪的耗时（秒）"""
+        with self._lock:
+            self._observed.append(elapsed)
+
+    def typical_delay(self):
+        """历史就绪耗时的quantile分位数，没有历史时返回0"""
+        with self._lock:
+            if not self._observed:
+                return 0.0
+            ordered = sorted(self._observed)
+        return ordered[int(self.quantile * (len(ordered) - 1))]
+
+    def first_delay(self):
+        """第一次轮询前应等待的秒数"""
+        return min(self.typical_delay(), self.max_interval)
+
+    def next_delay(self, attempt, elapsed, retry_after=None):
+        """
+        未就绪时下一次轮询前应等待的秒数
+
+        Args:
+            attempt: 已经轮询的次数（从1开始）
+            elapsed: 从开始等待到现在的秒数
+            retry_after: 服务端给出的Retry-After秒数（有则优先遵守）
+
+        Returns:
+            float: 等待秒数；达到停止条件时返回None
+        """
+        if self.max_attempts is not None and attempt >= self.max_attempts:
+            return None
+        if self.max_wait is not None and elapsed >= self.max_wait:
+            return None
+        if retry_after is not None and retry_after > 0:
+            delay = retry_after
+        else:
+            delay = min(self.max_interval, self.min_interval * self.factor ** (attempt - 1))
+            # 还没到通常的就绪时间：直接等到那个时间点，中间不必再问
+            remaining = self.typical_delay() - elapsed
+            if remaining > delay:
+                delay = min(remaining, self.max_interval)
+        if self.max_wait is not None:
+            delay = min(delay, max(0.0, self.max_wait - elapsed))
+        return delay
+
+
+def alpha_info_ready(alpha_info):
+    """alpha信息中IS指标是否已经生成"""
+    if not alpha_info:
+        return False
+    is_data = alpha_info.get("is") or {}
+    return is_data.get("sharpe") is not None
+
+
+# 仿真完成后等待alpha信息（IS指标）就绪
+ALPHA_READINESS = ReadinessPolicy('alpha', min_interval=1.0, max_interval=10.0, max_wait=120.0)
+# 等待提交检查结果就绪（检查接口返回 "sleep" 表示数据未准备好）
+CHECK_READINESS = ReadinessPolicy('check', min_interval=2.0, max_interval=20.0, max_wait=300.0)
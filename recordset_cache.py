@@ -0,0 +1,361 @@
+# 本地日度序列缓存（内存映射）
+# 功能：alpha的日度序列（PnL、换手率、多空持仓数）只从记录集接口下载一次，之后的分析和自相关计算都读本地。
+#      每个字段一个定长dtype的二进制文件（<字段>.bin），所有alpha的数据依次追加在文件末尾，
+#      SQLite索引记录每个alpha在文件中的 (offset, length)；读取时用 np.memmap 映射整个文件，
+#      取一个alpha就是取一段切片视图，不复制数据、不把整个缓存读进内存，几千个alpha也能直接按需切片。
+#      先写数据再提交索引：中途崩溃时文件末尾没有索引的半截数据会在下次打开时被截掉。
+#      同一个alpha再次写入时追加新数据并更新索引，旧数据成为空洞，可用 compact() 回收。
+#
+# 用法:
+#     cache = RecordsetCache(default_recordset_cache_dir(csv_path))
+#     series, sess = fetch_series(sess, alpha_id)      # 下载 pnl / turnover / long-short-count 记录集
+#     cache.put(alpha_id, *series)
+#     dates, pnl = cache.get(alpha_id, 'pnl')          # 内存映射的切片视图
+#
+#     python recordset_cache.py A1 A2 ...              # 下载指定alpha的全部记录集
+#     python recordset_cache.py --state-db alphas.csv.state.db --status SUCCESS
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from simulate_and_check_for1 import requests_wq, API_BASE
+from metrics import METRICS
+
+# 缓存的字段及其定长dtype：日期为 yyyymmdd 的int32，缺失值为NaN
+FIELDS = {
+    'date': np.dtype('<i4'),
+    'pnl': np.dtype('<f8'),
+    'turnover': np.dtype('<f4'),
+    'long_count': np.dtype('<f4'),
+    'short_count': np.dtype('<f4'),
+}
+
+# 记录集名 -> {记录集中的列名: 缓存字段}
+RECORDSETS = {
+    'pnl': {'pnl': 'pnl'},
+    'turnover': {'turnover': 'turnover'},
+    'long-short-count': {'longCount': 'long_count', 'shortCount': 'short_count'},
+}
+
+# 记录集中是累计值、存入缓存前要差分成日度值的列
+CUMULATIVE_COLUMNS = ('pnl',)
+
+
+def recordset_url(alpha_id, name):
+    return f"{API_BASE}/alphas/{alpha_id}/recordsets/{name}"
+
+
+def parse_recordset(body, columns):
+    """
+    解析记录集
+
+    Args:
+        body: {'schema': {'properties': [{'name': 'date'}, ...]}, 'records': [[...], ...]}
+        columns: {记录集中的列名: 缓存字段}，如 RECORDSETS['pnl']
+
+    Returns:
+        tuple: (dates, {缓存字段: 数组})，dates 为 int32 的 yyyymmdd，累计PnL已差分成日PnL；
+               记录为空时返回None
+    """
+    records = body.get('records') or []
+    if not records:
+        return None
+    names = [prop['name'] for prop in body.get('schema', {}).get('properties', [])]
+    date_col = names.index('date') if 'date' in names else 0
+    dates = np.fromiter((int(record[date_col].replace('-', '')) for record in records),
+                        dtype=np.int32, count=len(records))
+    values = {}
+    for position, (column, field) in enumerate(columns.items(), start=1):
+        col = names.index(column) if column in names else position
+        data = np.array([np.nan if record[col] is None else record[col] for record in records], dtype=np.float64)
+        if column in CUMULATIVE_COLUMNS:
+            data = np.diff(data, prepend=0.0)
+        values[field] = data
+    return dates, values
+
+
+def get_recordset(s, alpha_id, name, max_wait=120.0):
+    """
+    下载一个记录集（服务端还在生成时按Retry-After等待）
+
+    Returns:
+        series: parse_recordset 的结果 (dates, {缓存字段: 数组})，下载失败或超时返回None
+        sess: 会话对象
+    """
+    sess = s
+    start = time.monotonic()
+    while True:
+        with METRICS.timer('recordset_fetch_seconds', recordset=name):
+            response, sess = requests_wq(sess, 'get', recordset_url(alpha_id, name))
+        retry_after = float(response.headers.get("Retry-After", 0))
+        if retry_after <= 0:
+            return parse_recordset(response.json(), RECORDSETS[name]), sess
+        if time.monotonic() - start + retry_after > max_wait:
+            print(f"Alpha {alpha_id}: 记录集 {name} {max_wait:.0f} 秒内未生成，放弃")
+            return None, sess
+        time.sleep(retry_after)
+
+
+def fetch_series(s, alpha_id, recordsets=tuple(RECORDSETS), max_wait=120.0):
+    """
+    下载多个记录集并按日期合并（以第一个记录集的交易日为准，其他记录集缺的日期为NaN）
+
+    Returns:
+        series: (dates, {缓存字段: 数组})，第一个记录集下载失败时返回None
+        sess: 会话对象
+    """
+    sess = s
+    dates, fields = None, {}
+    for name in recordsets:
+        parsed, sess = get_recordset(sess, alpha_id, name, max_wait)
+        if parsed is None:
+            if dates is None:
+                return None, sess
+            continue
+        if dates is None:
+            dates, fields = parsed[0], dict(parsed[1])
+            continue
+        cols = np.searchsorted(parsed[0], dates).clip(max=len(parsed[0]) - 1)
+        matched = parsed[0][cols] == dates
+        for field, data in parsed[1].items():
+            fields[field] = np.where(matched, data[cols], np.nan)
+    return (dates, fields), sess
+
+
+class RecordsetCache:
+    """
+    按alpha_id索引的日度序列缓存（单进程写，多进程读；线程安全）
+
+    数据文件只追加，get() 返回的是内存映射的切片视图（只读），调用方不应修改。
+    """
+
+    def __init__(self, root):
+        """
+        Args:
+            root: 缓存目录，其中 index.db 为索引，<字段>.bin 为各字段的数据
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, 'index.db'), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS series (
+                alpha_id TEXT PRIMARY KEY,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                first_date INTEGER,
+                last_date INTEGER,
+                updated_time TEXT DEFAULT ''
+            )
+        """)
+        self._conn.commit()
+        self._index = {alpha_id: (offset, length) for alpha_id, offset, length in
+                       self._conn.execute("SELECT alpha_id, offset, length FROM series")}
+        self._end = max((offset + length for offset, length in self._index.values()), default=0)
+        self._maps = {}
+        self._truncate_tail()
+
+    def _path(self, field):
+        return os.path.join(self.root, f"{field}.bin")
+
+    def _truncate_tail(self):
+        """截掉数据文件末尾没有索引的部分（上次写入中途崩溃留下的）"""
+        for field, dtype in FIELDS.items():
+            path = self._path(field)
+            size = self._end * dtype.itemsize
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+            if os.path.getsize(path) != size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+
+    def close(self):
+        with self._lock:
+            self._maps.clear()
+            self._conn.close()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, alpha_id):
+        return alpha_id in self._index
+
+    def alpha_ids(self):
+        with self._lock:
+            return list(self._index)
+
+    def put(self, alpha_id, dates, fields):
+        """
+        写入一个alpha的日度序列（已有时整体替换；未给出的字段在日期相同时沿用旧值，否则为NaN）
+
+        Args:
+            alpha_id: Alpha ID
+            dates: yyyymmdd 日期数组（升序）
+            fields: {缓存字段: 与dates等长的数组}
+        """
+        dates = np.asarray(dates, dtype=FIELDS['date'])
+        length = len(dates)
+        if length == 0:
+            return
+        with self._lock:
+            old = self._index.get(alpha_id)
+            columns = {'date': dates}
+            for field, dtype in FIELDS.items():
+                if field == 'date':
+                    continue
+                if field in fields:
+                    columns[field] = np.asarray(fields[field], dtype=dtype)
+                elif old is not None and np.array_equal(self._slice('date', *old), dates):
+                    columns[field] = np.array(self._slice(field, *old))
+                else:
+                    columns[field] = np.full(length, np.nan, dtype=dtype)
+            offset = self._end
+            for field, data in columns.items():
+                with open(self._path(field), 'ab') as f:
+                    f.write(data.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            # 数据落盘之后再提交索引
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO series (alpha_id, offset, length, first_date, last_date, updated_time) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (alpha_id, offset, length, int(dates[0]), int(dates[-1]),
+                     datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                )
+            self._index[alpha_id] = (offset, length)
+            self._end = offset + length
+        METRICS.inc('recordset_cache_writes_total')
+
+    def _column(self, field, end):
+        """字段文件的内存映射（至少覆盖前end个元素；文件追加后重新映射，旧映射上的视图仍然有效）"""
+        mapped = self._maps.get(field)
+        if mapped is None or len(mapped) < end:
+            if end == 0:
+                return np.empty(0, dtype=FIELDS[field])
+            mapped = np.memmap(self._path(field), dtype=FIELDS[field], mode='r', shape=(self._end,))
+            self._maps[field] = mapped
+        return mapped
+
+    def _slice(self, field, offset, length):
+        return self._column(field, offset + length)[offset:offset + length]
+
+    def get(self, alpha_id, field='pnl'):
+        """
+        读取一个alpha的一个字段
+
+        Returns:
+            tuple: (dates, values) 内存映射的只读切片视图，没有缓存时返回None
+        """
+        with self._lock:
+            location = self._index.get(alpha_id)
+            if location is None:
+                return None
+            return self._slice('date', *location), self._slice(field, *location)
+
+    def column(self, field):
+        """
+        整个字段文件的内存映射和索引，用于跨大量alpha的向量化分析
+
+        Returns:
+            values: 所有alpha依次排列的只读数组
+            index: {alpha_id: (offset, length)}，values[offset:offset + length] 为该alpha的数据
+        """
+        with self._lock:
+            return self._column(field, self._end), dict(self._index)
+
+    def compact(self):
+        """重写数据文件，回收被替换的旧数据占用的空间；返回回收的元素数量"""
+        with self._lock:
+            live = sorted(self._index.items(), key=lambda item: item[1][0])
+            total = sum(length for _, (_, length) in live)
+            reclaimed = self._end - total
+            if reclaimed == 0:
+                return 0
+            new_index = {}
+            position = 0
+            for alpha_id, (offset, length) in live:
+                new_index[alpha_id] = (position, length)
+                position += length
+            for field in FIELDS:
+                source = self._column(field, self._end)
+                tmp_path = self._path(field) + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    for _, (offset, length) in live:
+                        f.write(source[offset:offset + length].tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            # 旧映射在替换文件之前释放
+            self._maps.clear()
+            with self._conn:
+                self._conn.executemany("UPDATE series SET offset = ? WHERE alpha_id = ?",
+                                       [(offset, alpha_id) for alpha_id, (offset, _) in new_index.items()])
+                for field in FIELDS:
+                    os.replace(self._path(field) + '.tmp', self._path(field))
+            self._index = new_index
+            self._end = total
+            return reclaimed
+
+
+def default_recordset_cache_dir(csv_path):
+    """与CSV放在同一目录下的日度序列缓存目录"""
+    return os.path.join(os.path.dirname(os.path.abspath(csv_path)), '.recordset_cache')
+
+
+def main():
+    """下载指定alpha（或状态数据库中某个状态的全部alpha）的记录集到缓存"""
+    from concurrent.futures import ThreadPoolExecutor
+    from simulate_from_csv import DEFAULT_CSV_PATH
+    from session_pool import SessionPool
+    from state_store import AlphaStateStore
+    parser = argparse.ArgumentParser(description="下载alpha的日度序列到本地内存映射缓存")
+    parser.add_argument('alpha_ids', nargs='*', help='要下载的alpha ID')
+    parser.add_argument('--cache-dir', default=default_recordset_cache_dir(DEFAULT_CSV_PATH), help='缓存目录')
+    parser.add_argument('--state-db', default=None, help='从状态数据库中取alpha ID')
+    parser.add_argument('--status', default='SUCCESS', help='与 --state-db 一起使用，取该状态的alpha（默认SUCCESS）')
+    parser.add_argument('--recordsets', default=','.join(RECORDSETS),
+                        help=f"逗号分隔的记录集名（默认 {','.join(RECORDSETS)}）")
+    parser.add_argument('--refresh', action='store_true', help='已有缓存的alpha也重新下载')
+    parser.add_argument('--compact', action='store_true', help='回收被替换的旧数据占用的空间')
+    parser.add_argument('--workers', type=int, default=4, help='并发下载数（默认4）')
+    args = parser.parse_args()
+
+    cache = RecordsetCache(args.cache_dir)
+    alpha_ids = list(args.alpha_ids)
+    if args.state_db:
+        store = AlphaStateStore(args.state_db)
+        alpha_ids += store.alpha_ids(args.status)
+        store.close()
+    missing = [alpha_id for alpha_id in dict.fromkeys(alpha_ids) if args.refresh or alpha_id not in cache]
+    recordsets = args.recordsets.split(',')
+    if missing:
+        print(f"下载 {len(missing)} 个alpha的记录集: {', '.join(recordsets)}")
+        pool = SessionPool(size=args.workers)
+
+        def download(alpha_id):
+            with pool.session() as sess:
+                series, sess = fetch_series(sess, alpha_id, recordsets)
+            return alpha_id, series
+
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for alpha_id, series in executor.map(download, missing):
+                if series is None:
+                    print(f"{alpha_id}: 无法获取记录集")
+                    continue
+                cache.put(alpha_id, *series)
+        pool.close()
+    if args.compact:
+        print(f"回收 {cache.compact()} 个元素的空间")
+    values, index = cache.column('pnl')
+    print(f"缓存中共 {len(cache)} 个alpha，{len(values)} 个交易日记录，目录: {args.cache_dir}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# 仿真结果缓存
+# 功能：以（规范化表达式, settings）的哈希为键，持久化保存alpha_id、IS指标和检查结果；
+#      重复枚举或重复追加到CSV的alpha在提交前命中缓存，直接复用结果，不再消耗仿真额度
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 字符串字面量（其中的空白有意义，规范化时原样保留）
+_STRING_LITERAL = re.compile(r'"[^"]*"|\'[^\']*\'')
+_WHITESPACE = re.compile(r'\s+')
+
+# 内存中最多保留的条目数（其余只在SQLite中），长时间运行内存不随处理过的alpha数量增长
+DEFAULT_MEMORY_ENTRIES = 1024
+
+
+def normalize_expression(expression):
+    """
+    规范化FASTEXPR表达式：去掉字符串字面量以外的所有空白和末尾的分号
+
+    例如 "rank( close ) ;" 与 "rank(close)" 得到相同的结果
+    """
+    parts = []
+    last = 0
+    for m in _STRING_LITERAL.finditer(expression):
+        parts.append(_WHITESPACE.sub('', expression[last:m.start()]))
+        parts.append(m.group())
+        last = m.end()
+    parts.append(_WHITESPACE.sub('', expression[last:]))
+    return ''.join(parts).rstrip(';')
+
+
+def make_cache_key(expression, settings):
+    """
+    计算缓存键：sha256(规范化表达式 + 按键排序的settings JSON)
+
+    Args:
+        expression: alpha表达式
+        settings: 仿真设置字典
+    """
+    payload = normalize_expression(expression) + '\n' + json.dumps(
+        settings, sort_keys=True, separators=(',', ':'), ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    持久化的仿真结果缓存（线程安全）
+
+    最近用过的 memory_entries 个条目保存在内存中（LRU），重复查询不再访问SQLite。
+
+    用法:
+        cache = ResultCache(db_path)
+        entry = cache.get(expression, settings)
+        if entry is None:
+            ...仿真、检查...
+            cache.put(expression, settings, alpha_id, is_data, check_result)
+    """
+
+    def __init__(self, db_path, memory_entries=DEFAULT_MEMORY_ENTRIES):
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                expression TEXT,
+                settings TEXT,
+                alpha_id TEXT,
+                is_data TEXT,
+                check_result TEXT,
+                created_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_created ON results(created_at)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, expression, settings):
+        """
+        查询缓存
+
+        Returns:
+            dict: {'alpha_id', 'is', 'check_result', 'created_at'}，未命中返回None
+        """
+        key = make_cache_key(expression, settings)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                row = self._conn.execute(
+                    "SELECT alpha_id, is_data, check_result, created_at FROM results WHERE key = ?",
+                    (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = {
+                        'alpha_id': row[0],
+                        'is': json.loads(row[1]),
+                        'check_result': row[2],
+                        'created_at': row[3],
+                    }
+                    self._remember(key, entry)
+            else:
+                self._memory.move_to_end(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(self, expression, settings, alpha_id, is_data, check_result):
+        """
+        写入一个已完成检查的结果
+
+        Args:
+            expression: alpha表达式
+            settings: 仿真设置字典
+            alpha_id: Alpha ID
+            is_data: Alpha信息中的 "is" 指标字典
+            check_result: 检查结果
+        """
+        key = make_cache_key(expression, settings)
+        entry = {
+            'alpha_id': alpha_id,
+            'is': is_data or {},
+            'check_result': check_result,
+            'created_at': time.time(),
+        }
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results "
+                "(key, expression, settings, alpha_id, is_data, check_result, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key, expression, json.dumps(settings, sort_keys=True, ensure_ascii=False),
+                    alpha_id, json.dumps(entry['is'], ensure_ascii=False),
+                    check_result, entry['created_at'],
+                )
+            )
+            self._remember(key, entry)
+
+    def _remember(self, key, entry):
+        """放入内存LRU，超出 memory_entries 时丢弃最久没用的条目（调用者持有 self._lock）"""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def invalidate(self, older_than_days=None, expression=None, settings=None):
+        """
+        删除缓存条目
+
+        Args:
+            older_than_days: 删除早于该天数的条目
+            expression, settings: 删除指定alpha的条目
+            都不指定时清空整个缓存
+
+        Returns:
+            int: 删除的条目数量
+        """
+        with self._lock:
+            if expression is not None:
+                key = make_cache_key(expression, settings)
+                cursor = self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._memory.pop(key, None)
+            elif older_than_days is not None:
+                cutoff = time.time() - older_than_days * 86400
+                cursor = self._conn.execute("DELETE FROM results WHERE created_at < ?", (cutoff,))
+                self._memory = OrderedDict(
+                    (k, v) for k, v in self._memory.items() if v['created_at'] >= cutoff
+                )
+            else:
+                cursor = self._conn.execute("DELETE FROM results")
+                self._memory.clear()
+            return cursor.rowcount
+
+    def stats(self):
+        """命中统计 {'hits', 'misses', 'hit_rate', 'entries'}"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+        }
+
+
+def default_cache_path(csv_path):
+    """与CSV放在同一目录下的缓存数据库路径"""
+    return os.path.join(os.path.dirname(os.path.abspath(csv_path)), 'alpha_result_cache.db')
+
+
+def main():
+    """缓存管理：查看条目数量、按时间失效或清空"""
+    from simulate_from_csv import DEFAULT_CSV_PATH
+    parser = argparse.ArgumentParser(description="仿真结果缓存管理")
+    parser.add_argument('--cache', default=default_cache_path(DEFAULT_CSV_PATH), help='缓存数据库路径')
+    parser.add_argument('--invalidate-older-than', type=float, metavar='DAYS',
+                        help='删除早于DAYS天的条目')
+    parser.add_argument('--clear', action='store_true', help='清空缓存')
+    args = parser.parse_args()
+
+    cache = ResultCache(args.cache)
+    if args.invalidate_older_than is not None:
+        print(f"已删除 {cache.invalidate(older_than_days=args.invalidate_older_than)} 个条目")
+    elif args.clear:
+        print(f"已删除 {cache.invalidate()} 个条目")
+    print(f"缓存条目数量: {cache.stats()['entries']}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+# 列式结果仓库（Parquet）
+# 功能：每个alpha的处理结果不再只是状态CSV里的几个字符串列，而是按类型存成列：
+#      Sharpe、Fitness、Turnover、Margin、多空持仓数等IS指标，每项检查的结果和数值（check_<名称> / check_<名称>_value），
+#      模板槽位取值（bind_<槽位>）以及 region / universe / delay 等设置。
+#      每次运行写入 <仓库目录>/run_id=<运行ID>/part-NNNNN.parquet（按运行分区），不同运行的检查项、槽位可以不同，
+#      读取时自动合并成统一的表结构。
+#      查询用 pyarrow.dataset：只读取用到的列，过滤条件下推到文件，分组聚合在Arrow中向量化完成，
+#      几百万行的过滤和聚合在一秒以内。
+#
+# 用法:
+#     warehouse = ResultsWarehouse(default_warehouse_dir(csv_path))
+#     warehouse.record(row, 'SUCCESS', alpha_id, check_result, is_data)   # row 为状态数据库中的行
+#     warehouse.close()
+#
+#     query(root, where=[('check_result', '==', 'SUCCESS')], group_by=['bind_days'],
+#           aggregates=[('sharpe', 'mean'), ('alpha_id', 'count')])
+#     python results_warehouse.py --where "sharpe>1.25" --group-by region --agg sharpe:mean --agg alpha_id:count
+import argparse
+import ast
+import glob
+import json
+import os
+import re
+import threading
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from bandit_scheduler import row_bindings
+
+# 固定列：(列名, 类型)
+BASE_SCHEMA = pa.schema([
+    ('row_id', pa.int64()),
+    ('alpha_id', pa.string()),
+    ('status', pa.string()),
+    ('check_result', pa.string()),
+    ('completed_time', pa.timestamp('s')),
+    ('expression', pa.string()),
+    ('settings', pa.string()),
+    ('region', pa.string()),
+    ('universe', pa.string()),
+    ('delay', pa.int32()),
+    ('decay', pa.int32()),
+    ('neutralization', pa.string()),
+    ('truncation', pa.float64()),
+    ('sharpe', pa.float64()),
+    ('fitness', pa.float64()),
+    ('turnover', pa.float64()),
+    ('margin', pa.float64()),
+    ('returns', pa.float64()),
+    ('drawdown', pa.float64()),
+    ('pnl', pa.float64()),
+    ('long_count', pa.int32()),
+    ('short_count', pa.int32()),
+])
+
+# IS指标字段 -> 列名
+IS_COLUMNS = {
+    'sharpe': 'sharpe', 'fitness': 'fitness', 'turnover': 'turnover', 'margin': 'margin',
+    'returns': 'returns', 'drawdown': 'drawdown', 'pnl': 'pnl',
+    'longCount': 'long_count', 'shortCount': 'short_count',
+}
+
+# 设置字段 -> 列名
+SETTINGS_COLUMNS = {
+    'region': 'region', 'universe': 'universe', 'delay': 'delay', 'decay': 'decay',
+    'neutralization': 'neutralization', 'truncation': 'truncation',
+}
+
+# 每个文件最多缓冲的行数
+DEFAULT_FLUSH_ROWS = 500
+
+# 查询条件中支持的比较运算
+WHERE_PATTERN = re.compile(r'^\s*(\w+)\s*(==|!=|>=|<=|>|<)\s*(.*?)\s*$')
+
+
+def _number(value, cast=float):
+    try:
+        return None if value is None else cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _settings_of(settings_str):
+    """解析settings字符串（JSON或字典字符串），无法解析时返回空字典（只用于填设置列）"""
+    try:
+        return json.loads(settings_str)
+    except (TypeError, ValueError):
+        try:
+            return ast.literal_eval(settings_str)
+        except (TypeError, ValueError, SyntaxError):
+            return {}
+
+
+def _column_name(name):
+    """检查名、槽位名转成列名中可用的形式"""
+    return re.sub(r'\W', '_', str(name))
+
+
+class ResultsWarehouse:
+    """
+    按运行分区的Parquet结果仓库写入器（线程安全）
+
+    结果先在内存中缓冲，每 flush_rows 行（以及 close 时）写成一个新的Parquet文件；
+    文件先写临时文件再改名，读取方不会看到写了一半的文件。
+    """
+
+    def __init__(self, root, run_id=None, flush_rows=DEFAULT_FLUSH_ROWS):
+        """
+        Args:
+            root: 仓库目录
+            run_id: 本次运行的ID，默认为启动时间 YYYYmmdd-HHMMSS
+            flush_rows: 缓冲多少行写一个文件
+        """
+        self.root = root
+        self.run_id = run_id or datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.flush_rows = flush_rows
+        self.run_dir = os.path.join(root, f"run_id={self.run_id}")
+        os.makedirs(self.run_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._rows = []
+        self._part = len(glob.glob(os.path.join(self.run_dir, 'part-*.parquet')))
+        self.written = 0
+
+    def record(self, row, status, alpha_id=None, check_result=None, is_data=None):
+        """
+        记录一个alpha的结果
+
+        Args:
+            row: 状态数据库中的行（row_id、regular、settings、extra）
+            status: 状态，如 'SUCCESS'、'FAILED'、'PRUNED_LOW_SHARPE'
+            alpha_id: Alpha ID
+            check_result: 检查结果（或跳过原因）
+            is_data: Alpha信息中的 "is" 指标字典，包含 checks 时每项检查单独成列
+        """
+        settings = _settings_of(row['settings'])
+        record = {
+            'row_id': row['row_id'],
+            'alpha_id': str(alpha_id) if alpha_id else None,
+            'status': status,
+            'check_result': check_result,
+            'completed_time': datetime.now().replace(microsecond=0),
+            'expression': row['regular'],
+            'settings': row['settings'],
+        }
+        for key, column in SETTINGS_COLUMNS.items():
+            record[column] = settings.get(key)
+        for key, column in IS_COLUMNS.items():
+            record[column] = (is_data or {}).get(key)
+        for check in (is_data or {}).get('checks') or []:
+            name = _column_name(check.get('name'))
+            record[f"check_{name}"] = check.get('result')
+            record[f"check_{name}_value"] = _number(check.get('value'))
+        for slot, value in row_bindings(row).items():
+            record[f"bind_{_column_name(slot)}"] = value if isinstance(value, str) else json.dumps(value)
+        with self._lock:
+            self._rows.append(record)
+            if len(self._rows) >= self.flush_rows:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """写出缓冲中剩余的行"""
+        self.flush()
+
+    def _schema(self, rows):
+        """固定列 + 本批出现的检查列和槽位列（检查数值为float64，其余为字符串）"""
+        extra = sorted({key for record in rows for key in record} - set(BASE_SCHEMA.names))
+        fields = list(BASE_SCHEMA)
+        for name in extra:
+            numeric = name.startswith('check_') and name.endswith('_value')
+            fields.append(pa.field(name, pa.float64() if numeric else pa.string()))
+        return pa.schema(fields)
+
+    def _flush(self):
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        schema = self._schema(rows)
+        columns = {}
+        for field in schema:
+            cast = float if pa.types.is_floating(field.type) else int if pa.types.is_integer(field.type) else None
+            values = [record.get(field.name) for record in rows]
+            if cast is not None:
+                values = [_number(value, cast) for value in values]
+            columns[field.name] = pa.array(values, type=field.type)
+        table = pa.table(columns, schema=schema)
+        path = os.path.join(self.run_dir, f"part-{self._part:05d}.parquet")
+        tmp_path = path + '.tmp'
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+        self._part += 1
+        self.written += len(rows)
+
+
+def default_warehouse_dir(csv_path):
+    """与CSV放在同一目录下的结果仓库目录"""
+    return os.path.join(os.path.dirname(os.path.abspath(csv_path)), 'results_warehouse')
+
+
+def list_runs(root):
+    """仓库中的运行ID（按时间顺序）"""
+    return sorted(os.path.basename(path)[len('run_id='):] for path in glob.glob(os.path.join(root, 'run_id=*')))
+
+
+def open_dataset(root, runs=None):
+    """
+    打开仓库（或指定的几次运行）为 pyarrow Dataset，各文件的表结构合并成统一的表结构，
+    run_id 作为分区列可以直接用于过滤和分组
+
+    Returns:
+        pyarrow.dataset.Dataset，仓库为空时返回None
+    """
+    runs = list_runs(root) if runs is None else list(runs)
+    files = [path for run_id in runs
+             for path in sorted(glob.glob(os.path.join(root, f"run_id={run_id}", 'part-*.parquet')))]
+    if not files:
+        return None
+    schema = pa.unify_schemas([pq.read_schema(path) for path in files])
+    partitioning = ds.partitioning(pa.schema([('run_id', pa.string())]), flavor='hive')
+    return ds.dataset(files, schema=schema.append(pa.field('run_id', pa.string())), format='parquet',
+                      partitioning=partitioning, partition_base_dir=root)
+
+
+def where_expression(where):
+    """
+    把 [(列, 运算, 值), ...]（AND关系）转成过滤表达式
+
+    运算支持 == != > >= < <= in "not in"；值为None时 == / != 表示为空 / 不为空
+    """
+    expression = None
+    for column, op, value in where or []:
+        field = pc.field(column)
+        if value is None and op in ('==', '!='):
+            condition = field.is_null() if op == '==' else field.is_valid()
+        elif op == 'in':
+            condition = field.isin(list(value))
+        elif op == 'not in':
+            condition = ~field.isin(list(value))
+        else:
+            condition = {
+                '==': field == value, '!=': field != value, '>': field > value,
+                '>=': field >= value, '<': field < value, '<=': field <= value,
+            }[op]
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def query(root, where=None, columns=None, group_by=None, aggregates=None, order_by=None, limit=None, runs=None):
+    """
+    查询结果仓库
+
+    Args:
+        root: 仓库目录
+        where: [(列, 运算, 值), ...]，AND关系，见 where_expression
+        columns: 不分组时返回的列，None表示全部
+        group_by: 分组列列表
+        aggregates: 分组时的聚合 [(列, 函数), ...]，函数如 count / mean / max / min / sum / count_distinct，
+                    结果列名为 <列>_<函数>；只指定 group_by 时默认统计行数
+        order_by: [(列, 'ascending' | 'descending'), ...]
+        limit: 最多返回的行数
+        runs: 只查询这些运行ID，None表示全部
+
+    Returns:
+        pyarrow.Table（用 .to_pandas() 转成DataFrame）
+    """
+    dataset = open_dataset(root, runs)
+    if dataset is None:
+        return pa.table({})
+    referenced = list(columns or []) + list(group_by or []) + [column for column, _ in aggregates or []] \
+        + [column for column, _, _ in where or []]
+    unknown = [column for column in referenced if column not in dataset.schema.names]
+    if unknown:
+        raise ValueError(f"仓库中没有这些列: {', '.join(unknown)}")
+    filter_expression = where_expression(where)
+    if group_by:
+        aggregates = list(aggregates or [(group_by[0], 'count')])
+        needed = list(dict.fromkeys(list(group_by) + [column for column, _ in aggregates]))
+        table = dataset.to_table(columns=needed, filter=filter_expression)
+        table = table.group_by(group_by).aggregate(aggregates)
+        # 分组列放在前面
+        table = table.select(list(group_by) + [name for name in table.column_names if name not in group_by])
+    else:
+        table = dataset.to_table(columns=columns, filter=filter_expression)
+    if order_by:
+        table = table.sort_by(list(order_by))
+    if limit is not None:
+        table = table.slice(0, limit)
+    return table
+
+
+def parse_where(text):
+    """解析命令行的过滤条件，如 "sharpe>1.25"、"check_result==SUCCESS" """
+    match = WHERE_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"无法解析过滤条件: {text}")
+    column, op, value = match.groups()
+    try:
+        value = int(value) if re.fullmatch(r'-?\d+', value) else float(value)
+    except ValueError:
+        value = value.strip('"\'')
+    return column, op, value
+
+
+def main():
+    """查询结果仓库"""
+    from simulate_from_csv import DEFAULT_CSV_PATH
+    parser = argparse.ArgumentParser(description="查询列式结果仓库")
+    parser.add_argument('--root', default=default_warehouse_dir(DEFAULT_CSV_PATH), help='仓库目录')
+    parser.add_argument('--run', action='append', default=None, help='只查询指定的运行ID（可重复）')
+    parser.add_argument('--where', action='append', default=[], help='过滤条件，如 "sharpe>1.25"（可重复，AND关系）')
+    parser.add_argument('--columns', default=None, help='逗号分隔的输出列')
+    parser.add_argument('--group-by', default=None, help='逗号分隔的分组列')
+    parser.add_argument('--agg', action='append', default=[], help='聚合，如 sharpe:mean、alpha_id:count（可重复）')
+    parser.add_argument('--order-by', default=None, help='排序列，加 :desc 表示降序，如 sharpe_mean:desc')
+    parser.add_argument('--limit', type=int, default=50, help='最多输出的行数（默认50）')
+    parser.add_argument('--list-runs', action='store_true', help='列出所有运行ID')
+    parser.add_argument('--schema', action='store_true', help='打印合并后的表结构')
+    args = parser.parse_args()
+
+    if args.list_runs:
+        for run_id in list_runs(args.root):
+            print(run_id)
+        return
+    if args.schema:
+        dataset = open_dataset(args.root, args.run)
+        print(dataset.schema if dataset is not None else "仓库为空")
+        return
+    order_by = None
+    if args.order_by:
+        column, _, direction = args.order_by.partition(':')
+        order_by = [(column, 'descending' if direction == 'desc' else 'ascending')]
+    try:
+        table = query(
+            args.root,
+            where=[parse_where(text) for text in args.where],
+            columns=args.columns.split(',') if args.columns else None,
+            group_by=args.group_by.split(',') if args.group_by else None,
+            aggregates=[tuple(agg.split(':', 1)) for agg in args.agg] or None,
+            order_by=order_by,
+            limit=args.limit,
+            runs=args.run,
+        )
+    except ValueError as e:
+        print(f"错误: {e}")
+        return
+    print(table.to_pandas().to_string())
+    print(f"\n共 {table.num_rows} 行")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+# 本地自相关预筛
+# 功能：/check 的 SELF_CORRELATION 检查要在服务端跑很久才失败，而结果本地就能预测：
+#      下载已提交（ACTIVE）和检查通过（SUCCESS）的alpha的日PnL，存入内存映射的日度序列缓存（RecordsetCache），作为参考集；
+#      新alpha仿真完成后只下载它的PnL，用NumPy一次矩阵运算算出它与全部参考alpha的相关系数，
+#      最大相关系数超过阈值（默认0.7，与服务端 SELF_CORRELATION 的limit一致）时跳过或推迟 /check。
+#      参考集在内存中是对齐到同一交易日轴的 (参考数, 交易日) 矩阵，配合逐行前缀和，
+#      一次比较通常只是一次矩阵-向量乘法，几千个参考alpha也只需几毫秒。
+#      本次运行中检查通过的alpha会加入参考集，后面同族的变体直接被筛掉。
+#
+# 用法:
+#     selfcorr = SelfCorrelationFilter(RecordsetCache(default_recordset_cache_dir(csv_path)))
+#     selfcorr.refresh(pool, extra_alpha_ids=store.alpha_ids('SUCCESS'))
+#     series, sess = get_pnl(sess, alpha_id)
+#     max_corr, ref_id = selfcorr.screen(alpha_id, *series)
+#     if max_corr > selfcorr.threshold: ...跳过 /check...
+#     selfcorr.promote(alpha_id)   # 检查通过后加入参考集
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from simulate_and_check_for1 import requests_wq, API_BASE
+from recordset_cache import (
+    RecordsetCache, RECORDSETS, recordset_url, parse_recordset, get_recordset, default_recordset_cache_dir
+)
+from metrics import METRICS
+
+# 服务端 SELF_CORRELATION 检查的上限
+DEFAULT_THRESHOLD = 0.7
+
+# 计算相关系数时使用的最近交易日数量（约4年）
+DEFAULT_WINDOW = 1008
+
+# 两个序列重叠的交易日少于该数量时不计算相关系数
+MIN_OVERLAP = 60
+
+# 列出已提交alpha时每页数量
+LIST_PAGE_SIZE = 100
+
+
+def pnl_recordset_url(alpha_id):
+    return recordset_url(alpha_id, 'pnl')
+
+
+def parse_pnl_recordset(body):
+    """
+    解析PnL记录集
+
+    Returns:
+        tuple: (dates, daily_pnl)，dates 为 int32 的 yyyymmdd，daily_pnl 为 float64 的日PnL（累计PnL的差分）；
+               记录为空时返回None
+    """
+    parsed = parse_recordset(body, RECORDSETS['pnl'])
+    return None if parsed is None else (parsed[0], parsed[1]['pnl'])
+
+
+def get_pnl(s, alpha_id, max_wait=120.0):
+    """
+    下载alpha的PnL记录集（服务端还在生成时按Retry-After等待）
+
+    Returns:
+        series: (dates, daily_pnl)，下载失败或超时返回None
+        sess: 会话对象
+    """
+    parsed, sess = get_recordset(s, alpha_id, 'pnl', max_wait)
+    return (None if parsed is None else (parsed[0], parsed[1]['pnl'])), sess
+
+
+def list_submitted_alpha_ids(sess):
+    """
+    分页列出已提交（ACTIVE）的alpha ID
+
+    Returns:
+        alpha_ids: list
+        sess: 会话对象
+    """
+    alpha_ids = []
+    offset = 0
+    while True:
+        response, sess = requests_wq(
+            sess, 'get', f"{API_BASE}/users/self/alphas?status=ACTIVE&limit={LIST_PAGE_SIZE}&offset={offset}"
+        )
+        body = response.json()
+        results = body.get('results', [])
+        alpha_ids.extend(alpha['id'] for alpha in results)
+        offset += len(results)
+        if not results or offset >= body.get('count', 0):
+            return alpha_ids, sess
+
+
+def correlation_from_sums(n, sx, sy, sxx, syy, sxy):
+    """
+    由逐行的 样本数、Σx、Σy、Σx²、Σy²、Σxy 算相关系数
+
+    Returns:
+        ndarray: 相关系数，样本数不足 MIN_OVERLAP 或方差为0的位置为NaN
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = n * sxy - sx * sy
+        var = (n * sxx - sx * sx) * (n * syy - sy * sy)
+        corr = cov / np.sqrt(var)
+    corr[(n < MIN_OVERLAP) | ~(var > 0)] = np.nan
+    return corr
+
+
+def pairwise_correlation(values, valid, target):
+    """
+    target 与参考矩阵每一行的相关系数（只用该行有数据的交易日）
+
+    Args:
+        values: (n, T) 参考日PnL，缺失处为0
+        valid: (n, T) bool，是否有数据
+        target: (T,) 候选日PnL（不含NaN）
+
+    Returns:
+        ndarray: (n,) 相关系数
+    """
+    mask = valid.astype(np.float64)
+    return correlation_from_sums(
+        mask.sum(axis=1), values.sum(axis=1), mask @ target,
+        np.einsum('ij,ij->i', values, values), mask @ (target * target), values @ target
+    )
+
+
+class SelfCorrelationFilter:
+    """
+    参考alpha日PnL矩阵 + 候选alpha相关系数预筛（线程安全）
+
+    参考alpha和已筛查的候选alpha的PnL都写入 RecordsetCache，下次运行不再下载；
+    参考矩阵直接由缓存的内存映射切片组装，不在内存中另存每个alpha的序列。
+    """
+
+    def __init__(self, cache, threshold=DEFAULT_THRESHOLD, window=DEFAULT_WINDOW):
+        """
+        Args:
+            cache: RecordsetCache 日度序列缓存
+            threshold: 最大相关系数超过该值视为自相关过高
+            window: 只用候选alpha最近window个交易日计算相关系数
+        """
+        self.cache = cache
+        self.threshold = threshold
+        self.window = window
+        self._lock = threading.Lock()
+        self._refs = {}         # 参考alpha ID（保持加入顺序）
+        self._candidates = set()  # 已筛查、尚未决定是否加入参考集的alpha
+        self._ids = []          # 矩阵的行对应的alpha ID
+        self._dates = np.empty(0, dtype=np.int32)
+        self._values = np.empty((0, 0))
+        self._valid = np.empty((0, 0), dtype=bool)
+        self._prefix = None     # 逐行前缀和：样本数、Σx、Σx²，连续交易日区间的行和只需相减
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._refs)
+
+    def refresh(self, pool, extra_alpha_ids=(), max_workers=4):
+        """
+        更新参考集：已提交的alpha + extra_alpha_ids（如状态数据库中检查通过的alpha），
+        本地没有缓存的PnL在线程池中并发下载
+
+        Returns:
+            int: 参考alpha数量
+        """
+        with pool.session() as sess:
+            alpha_ids, sess = list_submitted_alpha_ids(sess)
+        alpha_ids = list(dict.fromkeys(list(alpha_ids) + [a for a in extra_alpha_ids if a]))
+        missing = []
+        for alpha_id in alpha_ids:
+            if alpha_id in self.cache:
+                self._add(alpha_id)
+            else:
+                missing.append(alpha_id)
+        if missing:
+            print(f"[自相关] 下载 {len(missing)} 个参考alpha的PnL...")
+
+            def download(alpha_id):
+                with pool.session() as sess:
+                    series, sess = get_pnl(sess, alpha_id)
+                return alpha_id, series
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for alpha_id, series in executor.map(download, missing):
+                    if series is not None:
+                        self.cache.put(alpha_id, series[0], {'pnl': series[1]})
+                        self._add(alpha_id)
+        print(f"[自相关] 参考alpha: {len(self)} 个，缓存目录: {self.cache.root}")
+        return len(self)
+
+    def _add(self, alpha_id):
+        with self._lock:
+            self._refs[alpha_id] = None
+            self._dirty = True
+
+    def _rebuild(self):
+        """
+        把所有参考序列对齐到共同的交易日轴上，组成 (参考数, 交易日) 矩阵：
+        日PnL（缺失为0）、是否有数据，以及逐行前缀和，查询时不再做任何逐行处理
+        """
+        series = [self.cache.get(alpha_id, 'pnl') for alpha_id in self._refs]
+        ids = [alpha_id for alpha_id, found in zip(self._refs, series) if found is not None]
+        series = [found for found in series if found is not None]
+        if ids:
+            dates = np.unique(np.concatenate([series_dates for series_dates, _ in series]))
+        else:
+            dates = np.empty(0, dtype=np.int32)
+        values = np.zeros((len(ids), len(dates)))
+        valid = np.zeros((len(ids), len(dates)), dtype=bool)
+        for row, (series_dates, pnl) in enumerate(series):
+            cols = np.searchsorted(dates, series_dates)
+            finite = np.isfinite(pnl)
+            values[row, cols[finite]] = pnl[finite]
+            valid[row, cols[finite]] = True
+        zeros = np.zeros((len(ids), 1))
+        self._prefix = tuple(
+            np.concatenate([zeros, np.cumsum(matrix, axis=1)], axis=1)
+            for matrix in (valid.astype(np.float64), values, values * values)
+        )
+        self._ids, self._dates, self._values, self._valid = ids, dates, values, valid
+        self._dirty = False
+
+    def max_correlation(self, dates, daily_pnl, exclude=None):
+        """
+        候选序列与全部参考alpha的最大相关系数
+
+        Args:
+            dates, daily_pnl: 候选alpha的交易日和日PnL
+            exclude: 不参与比较的参考alpha ID（候选alpha自己已在参考集中时）
+
+        Returns:
+            tuple: (max_corr, alpha_id)，没有可比较的参考alpha时为 (None, None)
+        """
+        with self._lock:
+            if self._dirty:
+                self._rebuild()
+            ids, grid = self._ids, self._dates
+            values, valid, prefix = self._values, self._valid, self._prefix
+        if not ids:
+            return None, None
+        dates, daily_pnl = dates[-self.window:], daily_pnl[-self.window:]
+        # 只取候选alpha的交易日对应的列
+        cols = np.searchsorted(grid, dates)
+        present = (cols < len(grid)) & (grid[np.minimum(cols, len(grid) - 1)] == dates) & np.isfinite(daily_pnl)
+        if not present.any():
+            return None, None
+        cols, target = cols[present], daily_pnl[present]
+        start, stop = int(cols[0]), int(cols[-1]) + 1
+        if stop - start == len(cols):
+            # 交易日在参考轴上连续（通常情况）：行和由前缀和相减得到，只需一次矩阵-向量乘法（切片视图，不复制）
+            n, sx, sxx = (p[:, stop] - p[:, start] for p in prefix)
+            sxy = values[:, start:stop] @ target
+            sy = np.full(len(ids), target.sum())
+            syy = np.full(len(ids), target @ target)
+            gaps = n < len(cols)
+            if gaps.any():
+                # 区间内有缺失的参考行，Σy、Σy² 只算它有数据的交易日
+                mask = valid[gaps, start:stop].astype(np.float64)
+                sy[gaps] = mask @ target
+                syy[gaps] = mask @ (target * target)
+            corr = correlation_from_sums(n, sx, sy, sxx, syy, sxy)
+        else:
+            corr = pairwise_correlation(values[:, cols], valid[:, cols], target)
+        if exclude in ids:
+            corr[ids.index(exclude)] = np.nan
+        if np.isnan(corr).all():
+            return None, None
+        best = int(np.nanargmax(corr))
+        return float(corr[best]), ids[best]
+
+    def screen(self, alpha_id, dates, daily_pnl):
+        """
+        计算候选alpha的最大相关系数，并把其PnL写入缓存（检查通过后 promote 加入参考集）
+
+        Returns:
+            tuple: (max_corr, 最相关的参考alpha ID)
+        """
+        with METRICS.timer('selfcorr_screen_seconds'):
+            max_corr, ref_id = self.max_correlation(dates, daily_pnl, exclude=alpha_id)
+        self.cache.put(alpha_id, dates, {'pnl': daily_pnl})
+        with self._lock:
+            self._candidates.add(alpha_id)
+        METRICS.inc('selfcorr_screened_total', result='high' if self.is_high(max_corr) else 'ok')
+        return max_corr, ref_id
+
+    def is_high(self, max_corr):
+        """最大相关系数是否超过阈值"""
+        return max_corr is not None and max_corr > self.threshold
+
+    def promote(self, alpha_id):
+        """把已筛查的候选alpha加入参考集（检查通过时调用）"""
+        with self._lock:
+            if alpha_id not in self._candidates:
+                return
+            self._candidates.discard(alpha_id)
+        self._add(alpha_id)
+
+    def discard(self, alpha_id):
+        """候选alpha不加入参考集（检查未通过时调用；PnL仍保留在缓存中供分析）"""
+        with self._lock:
+            self._candidates.discard(alpha_id)
+
+
+def main():
+    """更新参考集，并可计算指定alpha与参考集的最大相关系数"""
+    from simulate_from_csv import DEFAULT_CSV_PATH
+    from session_pool import SessionPool
+    parser = argparse.ArgumentParser(description="本地自相关预筛")
+    parser.add_argument('alpha_ids', nargs='*', help='要计算最大相关系数的alpha ID')
+    parser.add_argument('--cache-dir', default=default_recordset_cache_dir(DEFAULT_CSV_PATH), help='日度序列缓存目录')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='自相关阈值')
+    args = parser.parse_args()
+
+    pool = SessionPool(size=4)
+    cache = RecordsetCache(args.cache_dir)
+    selfcorr = SelfCorrelationFilter(cache, threshold=args.threshold)
+    selfcorr.refresh(pool)
+    for alpha_id in args.alpha_ids:
+        # 已缓存的alpha直接读本地，不再请求接口
+        series = cache.get(alpha_id, 'pnl')
+        if series is None:
+            with pool.session() as sess:
+                series, sess = get_pnl(sess, alpha_id)
+        if series is None:
+            print(f"{alpha_id}: 无法获取PnL")
+            continue
+        start = time.perf_counter()
+        max_corr, ref_id = selfcorr.max_correlation(*series, exclude=alpha_id)
+        elapsed = (time.perf_counter() - start) * 1000
+        verdict = "过高" if selfcorr.is_high(max_corr) else "正常"
+        print(f"{alpha_id}: 最大相关系数 {max_corr} (参考 {ref_id})，{verdict}，用时 {elapsed:.1f} ms")
+    pool.close()
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
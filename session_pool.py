@@ -0,0 +1,99 @@
+# 会话池
+# 功能：在多个线程之间复用已登录的会话，避免每个alpha都重新登录
+# 每个会话只登录一次，token快过期时自动刷新；requests_wq遇到401时只刷新出问题的那个会话
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from simulate_and_check_for1 import sign_in
+
+
+class SessionPool:
+    """
+    线程安全的会话池
+
+    requests.Session本身不是线程安全的，所以一个会话同一时刻只借给一个线程使用；
+    用完归还后可被其他线程复用，连接保持温热。
+    """
+
+    def __init__(self, size=3, refresh_margin=600):
+        """
+        Args:
+            size: 会话池最大会话数量（一般等于并发数）
+            refresh_margin: token距离过期不足该秒数时，借出前先刷新
+        """
+        self.size = size
+        self.refresh_margin = refresh_margin
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def acquire(self, timeout=None):
+        """
+        借出一个会话，池中没有空闲会话且已达上限时阻塞等待
+
+        Args:
+            timeout: 最长等待秒数，None表示一直等待
+
+        Returns:
+            sess: 已登录的会话对象
+        """
+        try:
+            sess = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    return sign_in()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            sess = self._idle.get(timeout=timeout)
+
+        # token即将过期时，在原会话上重新认证
+        if getattr(sess, 'token_expires_at', 0) - time.time() < self.refresh_margin:
+            print("[会话池] token即将过期，刷新会话...")
+            sess = sign_in(sess)
+        return sess
+
+    def release(self, sess):
+        """归还会话；requests_wq可能在原会话上重新认证过，直接放回即可"""
+        if sess is None:
+            # 会话已丢失，释放名额以便之后重新创建
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(sess)
+
+    @contextmanager
+    def session(self, timeout=None):
+        """
+        以上下文管理器方式借用会话
+
+        用法:
+            with pool.session() as sess:
+                alpha_id, sess = simulate_alpha(sess, expr, settings)
+        """
+        sess = self.acquire(timeout=timeout)
+        try:
+            yield sess
+        finally:
+            self.release(sess)
+
+    def close(self):
+        """关闭池中所有空闲会话"""
+        while True:
+            try:
+                sess = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            sess.close()
+            with self._lock:
+                self._created -= 1
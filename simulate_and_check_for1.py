@@ -1,409 +1,768 @@
-# Alpha仿真和回测检查脚本
-# 功能：对一个alpha表达式进行仿真，然后进行回测检查，通过指标后打上SUCCESS标签以便后续提交
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import time
-import pandas as pd
-from datetime import datetime
-from os.path import expanduser
-
-
-def sign_in():
-    """登录WorldQuant Brain API"""
-    # Load credentials # 加载凭证
-    with open(expanduser('brain_credentials.txt')) as f:
-        credentials = json.load(f)
-
-    # Extract username and password from the list # 从列表中提取用户名和密码
-    username, password = credentials
-
-    # Create a session object # 创建会话对象，用于在多次请求之间保持状态和连接
-    sess = requests.Session()
-
-    # Set up basic authentication # 设置基本身份验证
-    sess.auth = HTTPBasicAuth(username, password)
-
-    # Send a POST request to the API for authentication # 向API发送POST请求进行身份验证
-    response = sess.post('https://api.worldquantbrain.com/authentication')
-
-    # Print response status and content for debugging # 打印响应状态和内容以调试
-    print(f"登录状态: {response.status_code}")
-    if response.status_code == 200:
-        print(f"用户ID: {response.json().get('user', {}).get('id', 'N/A')}")
-    return sess
-
-
-def requests_wq(s, type='get', url='', json_data=None, t=15):
-    """封装请求函数，处理重试和错误"""
-    session = s
-    while True:
-        try:
-            if type == 'get':
-                ret = session.get(url)
-            elif type == 'post':
-                if json_data is None:
-                    ret = session.post(url)
-                else:
-                    ret = session.post(url, json=json_data)
-            elif type == 'patch':
-                ret = session.patch(url, json=json_data)
-            
-            if ret.status_code == 429:
-                print(f"状态={ret.status_code}, 延时{t}秒")
-                time.sleep(t)
-                continue
-            if ret.status_code in (200, 201):
-                return ret, session
-            if ret.status_code == 401:
-                print("认证失败，重新登录...")
-                session = sign_in()
-                continue
-            else:
-                print(f"\033[31m状态={ret.status_code}，continue\033[0m")
-                time.sleep(5)
-                continue
-        except requests.RequestException as e:
-            print(f"请求错误: {e}. 重试中...")
-            time.sleep(10)
-            session = sign_in()
-    return None, None
-
-
-def simulate_alpha(sess, expression, settings=None):
-    """
-    仿真一个alpha表达式
-    
-    Args:
-        sess: 会话对象
-        expression: alpha表达式字符串
-        settings: 仿真设置字典，如果为None则使用默认设置
-    
-    Returns:
-        alpha_id: 仿真完成后的alpha ID
-    """
-    if settings is None:
-        settings = {
-            'instrumentType': 'EQUITY',
-            'region': 'USA',
-            'universe': 'TOP3000',
-            'delay': 1,
-            'decay': 5,
-            'neutralization': 'SUBINDUSTRY',
-            'truncation': 0.08,
-            'pasteurization': 'ON',
-            'unitHandling': 'VERIFY',
-            'nanHandling': 'ON',
-            'language': 'FASTEXPR',
-            'visualization': False,
-        }
-    
-    simulation_data = {
-        'type': 'REGULAR',
-        'settings': settings,
-        'regular': expression
-    }
-    
-    print(f"开始仿真Alpha表达式: {expression}")
-    print(f"仿真设置: {settings}")
-    
-    sim_resp, sess = requests_wq(
-        sess,
-        'post',
-        'https://api.worldquantbrain.com/simulations',
-        json_data=simulation_data
-    )
-    
-    # 这里一般是表达式/参数级别的错误（语法、不可用运算符等），状态码多为 4xx
-    if sim_resp.status_code not in (200, 201):
-        print(f"仿真请求失败: HTTP {sim_resp.status_code}")
-        try:
-            err_body = sim_resp.json()
-            print("仿真错误明细(JSON):")
-            print(json.dumps(err_body, indent=2, ensure_ascii=False))
-            # 常见字段尝试单独打印，方便快速查看
-            for key in ["error", "message", "detail"]:
-                if key in err_body:
-                    print(f"{key}: {err_body[key]}")
-        except Exception:
-            # 如果不是 JSON，就直接打印文本
-            print("仿真错误响应内容:")
-            print(sim_resp.text)
-        return None, sess
-    
-    sim_progress_url = sim_resp.headers.get('Location')
-    if not sim_progress_url:
-        print("无法获取仿真进度URL")
-        return None, sess
-    
-    print("等待仿真完成...")
-    # 等待仿真完成
-    while True:
-        sim_progress_resp, sess = requests_wq(sess, 'get', sim_progress_url)
-        if sim_progress_resp.status_code != 200:
-            print(f"获取仿真进度失败: HTTP {sim_progress_resp.status_code}")
-            try:
-                print("进度接口错误响应(JSON):")
-                print(json.dumps(sim_progress_resp.json(), indent=2, ensure_ascii=False))
-            except Exception:
-                print("进度接口错误响应内容:")
-                print(sim_progress_resp.text)
-            return None, sess
-        
-        retry_after_sec = float(sim_progress_resp.headers.get("Retry-After", 0))
-        if retry_after_sec == 0:  # simulation done!模拟完成!
-            break
-        print(f"仿真进行中，等待 {retry_after_sec} 秒...")
-        time.sleep(retry_after_sec)
-    
-    # 仿真完成后检查返回体，既尝试拿 alpha，也把状态和错误打印出来
-    try:
-        body = sim_progress_resp.json()
-    except Exception:
-        print("仿真完成但进度接口返回不是合法 JSON，原始内容为：")
-        print(sim_progress_resp.text)
-        return None, sess
-
-    # 一般会有 status / state / errors / message 等字段
-    status = body.get("status") or body.get("state")
-    if status and status not in ("COMPLETE", "SUCCESS"):
-        print(f"仿真未成功结束，状态: {status}")
-        # 常见错误字段
-        for key in ["error", "message", "detail"]:
-            if key in body:
-                print(f"{key}: {body[key]}")
-        # 有些接口会把多条错误放在 errors 数组里
-        if "errors" in body:
-            print("errors:")
-            print(json.dumps(body["errors"], indent=2, ensure_ascii=False))
-        # 直接打印整个 body 方便你对照网页上的提示
-        print("仿真进度响应(JSON):")
-        print(json.dumps(body, indent=2, ensure_ascii=False))
-        return None, sess
-
-    alpha_id = body.get("alpha")
-    if not alpha_id:
-        print("仿真完成，但响应中未找到 alpha ID，完整响应为：")
-        print(json.dumps(body, indent=2, ensure_ascii=False))
-        return None, sess
-
-    print(f"仿真完成！Alpha ID: {alpha_id}")
-    return alpha_id, sess
-
-
-def get_check_submission(s, alpha_id):
-    """
-    检查Alpha提交状态
-    
-    Args:
-        s: 会话对象
-        alpha_id: Alpha ID
-    
-    Returns:
-        check_result: 检查结果 ("SUCCESS", "ERROR", "FAIL", "nan", "sleep")
-        sess: 会话对象
-    """
-    sess = s
-    while True:
-        result, sess = requests_wq(sess, 'get', 
-                                    f"https://api.worldquantbrain.com/alphas/{alpha_id}/check")
-        if "retry-after" in result.headers:
-            retry_after = float(result.headers["Retry-After"])
-            print(f"等待检查结果，延时 {retry_after} 秒...")
-            time.sleep(retry_after)
-        else:
-            break
-    
-    if result.json().get("is", 0) == 0:
-        print(f"Alpha {alpha_id}: 未登录或数据未准备好，返回 'sleep'")
-        return "sleep", sess
-    
-    checks_df = pd.DataFrame(result.json()["is"]["checks"])
-    
-    # 检查 SELF_CORRELATION 是否为 "nan"
-    self_correlation_value = checks_df[checks_df["name"] == "SELF_CORRELATION"]["value"].values[0]
-    
-    if any(checks_df["result"] == "ERROR"):
-        print(f"Alpha {alpha_id}: \033[31m ERROR \033[0m，检查失败")
-        return "ERROR", sess
-    
-    if any(checks_df["result"] == "FAIL"):
-        print(f"Alpha {alpha_id}: \033[31m FAIL \033[0m，检查失败")
-        return "FAIL", sess
-    
-    if pd.isna(self_correlation_value) or str(self_correlation_value).lower() == "nan":
-        print(f"Alpha {alpha_id}: SELF_CORRELATION 为 \033[31m nan \033[0m，检查失败")
-        return "nan", sess
-    
-    # 所有检查都通过
-    print(f"Alpha {alpha_id}: \033[32m 所有检查通过 \033[0m")
-    return "SUCCESS", sess
-
-
-def set_alpha_properties(s, alpha_id, name=None, color=None, 
-                        selection_desc="None", combo_desc="None",
-                        tags="SUCCESS", regular_desc="None"):
-    """
-    设置Alpha属性，包括标签
-    
-    Args:
-        s: 会话对象
-        alpha_id: Alpha ID
-        name: Alpha名称
-        color: 颜色
-        selection_desc: 选择描述
-        combo_desc: 组合描述
-        tags: 标签（默认"SUCCESS"）
-        regular_desc: 常规描述
-    
-    Returns:
-        response: API响应
-        sess: 会话对象
-    """
-    sess = s
-    params = {
-        "color": color,
-        "name": name,
-        "tags": [tags],
-        "category": None,
-        "regular": {"description": regular_desc},
-        "combo": {"description": combo_desc},
-        "selection": {"description": selection_desc},
-    }
-    response, sess = requests_wq(sess, 'patch', 
-                                  f"https://api.worldquantbrain.com/alphas/{alpha_id}",
-                                  json_data=params)
-    return response, sess
-
-
-def get_alpha_info(s, alpha_id):
-    """获取Alpha的详细信息"""
-    sess = s
-    response, sess = requests_wq(sess, 'get', 
-                                  f"https://api.worldquantbrain.com/alphas/{alpha_id}")
-    if response.status_code == 200:
-        return response.json(), sess
-    return None, sess
-
-
-def main():
-    """主函数：仿真Alpha并进行回测检查"""
-    print("=" * 50)
-    print("Alpha仿真和回测检查脚本")
-    print(f"开始时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("=" * 50)
-    
-    # 登录
-    sess = sign_in()
-    if not sess:
-        print("登录失败，程序退出")
-        return
-    
-    # 配置Alpha表达式（可以修改这里来测试不同的表达式）
-    # 写法要求：① 用三引号 """ """ 包裹多行；② 语句以分号分隔；③ 最后一句为 alpha 输出
-    alpha_expression = """
-iv_diff = ts_delta(implied_volatility_call_120, 1);
-iv_signal = ts_decay_linear(iv_diff, 5);
-iv_z = zscore(winsorize(iv_signal, std = 3));
-cap_bucket = bucket(rank(cap), range = "0.2, 1, 0.3");
-iv_rank = group_rank(iv_z, cap_bucket);
-alpha = group_neutralize(iv_rank, subindustry);
-alpha
-""".strip()
-    
-    # 可选：自定义仿真设置
-    custom_settings = None  # 使用默认设置，如需自定义可取消注释下面的代码
-    custom_settings = {
-        'instrumentType': 'EQUITY',
-        'region': 'USA',
-        'universe': 'TOP3000',
-        'delay': 1,
-        'decay': 4,
-        'neutralization': 'SECTOR',
-        'truncation': 0.08,
-        'pasteurization': 'ON',
-        'unitHandling': 'VERIFY',
-        'nanHandling': 'ON',
-        'language': 'FASTEXPR',
-        'visualization': False,
-    }
-    
-    # 步骤1: 仿真Alpha
-    print("\n" + "=" * 50)
-    print("步骤1: 开始仿真Alpha")
-    print("=" * 50)
-    alpha_id, sess = simulate_alpha(sess, alpha_expression, custom_settings)
-    
-    if not alpha_id:
-        print("仿真失败，程序退出")
-        return
-    
-    # 等待一段时间，确保Alpha数据已准备好
-    print("\n等待Alpha数据准备...")
-    time.sleep(10)
-    
-    # 步骤2: 获取Alpha信息并显示指标
-    print("\n" + "=" * 50)
-    print("步骤2: 获取Alpha信息")
-    print("=" * 50)
-    alpha_info, sess = get_alpha_info(sess, alpha_id)
-    if alpha_info:
-        is_data = alpha_info.get("is", {})
-        print(f"Sharpe: {is_data.get('sharpe', 'N/A')}")
-        print(f"Fitness: {is_data.get('fitness', 'N/A')}")
-        print(f"Turnover: {is_data.get('turnover', 'N/A')}")
-        print(f"Margin: {is_data.get('margin', 'N/A')}")
-        print(f"Long Count: {is_data.get('longCount', 'N/A')}")
-        print(f"Short Count: {is_data.get('shortCount', 'N/A')}")
-    
-    # 步骤3: 进行回测检查
-    print("\n" + "=" * 50)
-    print("步骤3: 进行回测检查")
-    print("=" * 50)
-    
-    # 重试机制：最多尝试3次
-    max_retries = 3
-    check_result = None
-    for attempt in range(max_retries):
-        check_result, sess = get_check_submission(sess, alpha_id)
-        if check_result != "sleep":
-            break
-        if attempt < max_retries - 1:
-            print(f"Alpha数据未准备好，等待40秒后重试 ({attempt + 1}/{max_retries})...")
-            time.sleep(40)
-    
-    # 步骤4: 根据检查结果处理
-    print("\n" + "=" * 50)
-    print("步骤4: 处理检查结果")
-    print("=" * 50)
-    
-    if check_result == "SUCCESS":
-        print(f"\n\033[32m✓ Alpha {alpha_id} 检查通过！\033[0m")
-        print("正在打上SUCCESS标签...")
-        response, sess = set_alpha_properties(
-            sess, 
-            alpha_id, 
-            name=datetime.now().strftime("%Y.%m.%d"),
-            tags="SUCCESS",
-            regular_desc=f"Simulated and checked on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        )
-        if response and response.status_code in (200, 201):
-            print(f"\033[32m✓ 成功为Alpha {alpha_id} 打上SUCCESS标签\033[0m")
-            print("可以在平台上查看Tag-SUCCESS，并手动提交")
-        else:
-            print(f"\033[33m警告: 打标签可能失败，状态码: {response.status_code if response else 'None'}\033[0m")
-    else:
-        print(f"\n\033[31m✗ Alpha {alpha_id} 检查未通过\033[0m")
-        print(f"检查结果: {check_result}")
-        if check_result == "sleep":
-            print("Alpha数据可能还未准备好，请稍后手动检查")
-        elif check_result in ("ERROR", "FAIL", "nan"):
-            print("Alpha未通过回测检查，不符合提交条件")
-    
-    print("\n" + "=" * 50)
-    print(f"完成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("=" * 50)
-
-
-if __name__ == "__main__":
-    main()
+# Alpha仿真和回测检查脚本
+# 功能：对一个alpha表达式进行仿真，然后进行回测检查，通过指标后打上SUCCESS标签以便后续提交
+import requests
+from requests.auth import HTTPBasicAuth
+import json
+import os
+import time
+from datetime import datetime
+from os.path import expanduser
+
+from rate_limiter import RATE_LIMITER, parse_retry_after, backoff_delay
+from fastexpr import validate_expression
+from metrics import METRICS, endpoint_of, result_label
+from readiness import ALPHA_READINESS, CHECK_READINESS, alpha_info_ready
+
+
+# API地址，可通过环境变量 WQ_API_BASE 指向本地模拟服务器（见 mock_brain_server.py）
+API_BASE = os.environ.get('WQ_API_BASE', 'https://api.worldquantbrain.com').rstrip('/')
+
+# 进度URL已失效（服务端不再认识该仿真）时的状态码，断点续跑遇到时重新提交
+EXPIRED_URL_STATUSES = (404, 410)
+
+# 断点续跑探测进度URL时不能继续轮询的状态码：URL已失效，或仿真属于别的账号（401/403），都重新提交
+UNRESUMABLE_STATUSES = EXPIRED_URL_STATUSES + (401, 403)
+
+# 凭证文件路径，可通过环境变量 WQ_CREDENTIALS 为每个runner指定不同的账号（见 work_queue.py）
+CREDENTIALS_PATH = os.environ.get('WQ_CREDENTIALS', 'brain_credentials.txt')
+
+# 认证token默认有效期（秒），服务端未返回expiry时使用
+DEFAULT_TOKEN_EXPIRY = 4 * 3600
+
+
+def load_credentials():
+    """读取凭证文件（默认 brain_credentials.txt，或环境变量 WQ_CREDENTIALS 指定的文件）中的 [用户名, 密码]"""
+    # Load credentials # 加载凭证
+    with open(expanduser(CREDENTIALS_PATH)) as f:
+        credentials = json.load(f)
+
+    # Extract username and password from the list # 从列表中提取用户名和密码
+    username, password = credentials
+    return username, password
+
+
+def current_account():
+    """当前凭证的用户名；已提交的行记录提交账号，租约过期后被别的账号领取时不再轮询原来的仿真"""
+    global _CURRENT_ACCOUNT
+    if _CURRENT_ACCOUNT is None:
+        _CURRENT_ACCOUNT = load_credentials()[0]
+    return _CURRENT_ACCOUNT
+
+
+_CURRENT_ACCOUNT = None
+
+
+def sign_in(sess=None):
+    """
+    登录WorldQuant Brain API
+    
+    Args:
+        sess: 已有的会话对象；传入时在原会话上重新认证，保留其TCP/TLS连接
+    
+    Returns:
+        sess: 会话对象，token_expires_at属性记录token过期的时间戳（认证失败时为0，即已过期）
+    """
+    username, password = load_credentials()
+
+    # Create a session object # 创建会话对象，用于在多次请求之间保持状态和连接
+    kind = 'login' if sess is None else 'relogin'
+    if sess is None:
+        sess = requests.Session()
+
+    # Set up basic authentication # 设置基本身份验证
+    sess.auth = HTTPBasicAuth(username, password)
+
+    # Send a POST request to the API for authentication # 向API发送POST请求进行身份验证
+    RATE_LIMITER.acquire()
+    response = sess.post(f"{API_BASE}/authentication")
+
+    # Print response status and content for debugging # 打印响应状态和内容以调试
+    print(f"登录状态: {response.status_code}")
+    METRICS.inc('auth_total', kind=kind, status=response.status_code)
+    # 认证失败时不设置有效期：会话池下次取出时重新认证，请求收到401时也会重新认证
+    sess.token_expires_at = 0
+    if response.status_code in (200, 201):
+        body = response.json()
+        print(f"用户ID: {body.get('user', {}).get('id', 'N/A')}")
+        expiry = float(body.get('token', {}).get('expiry', DEFAULT_TOKEN_EXPIRY))
+        sess.token_expires_at = time.time() + expiry
+    return sess
+
+
+# 一个multi-simulation请求最多包含的子仿真数量
+MAX_BATCH_SIZE = 10
+
+# 默认仿真设置
+DEFAULT_SIMULATION_SETTINGS = {
+    'instrumentType': 'EQUITY',
+    'region': 'USA',
+    'universe': 'TOP3000',
+    'delay': 1,
+    'decay': 5,
+    'neutralization': 'SUBINDUSTRY',
+    'truncation': 0.08,
+    'pasteurization': 'ON',
+    'unitHandling': 'VERIFY',
+    'nanHandling': 'ON',
+    'language': 'FASTEXPR',
+    'visualization': False,
+}
+
+
+def requests_wq(s, type='get', url='', json_data=None, t=15, pass_statuses=()):
+    """
+    封装请求函数，处理重试和错误
+    
+    所有请求先经过进程级限流器 RATE_LIMITER；收到429时按Retry-After让整个进程降速暂停，
+    其他错误按指数退避加抖动重试。
+    
+    Args:
+        s: 会话对象
+        type: 'get' / 'post' / 'patch'
+        url: 请求URL
+        json_data: 请求体
+        t: 429响应没有Retry-After时的退避上限秒数
+        pass_statuses: 直接返回给调用方、不重试的状态码（如探测进度URL是否失效时的 EXPIRED_URL_STATUSES，
+                       或由调用方自己处理的429）
+    """
+    session = s
+    attempt = 0
+    endpoint = endpoint_of(url)
+    while True:
+        with METRICS.timer('rate_limit_wait_seconds'):
+            RATE_LIMITER.acquire()
+        try:
+            start = time.monotonic()
+            if type == 'get':
+                ret = session.get(url)
+            elif type == 'post':
+                if json_data is None:
+                    ret = session.post(url)
+                else:
+                    ret = session.post(url, json=json_data)
+            elif type == 'patch':
+                ret = session.patch(url, json=json_data)
+            METRICS.observe('http_request_seconds', time.monotonic() - start,
+                            method=type, endpoint=endpoint)
+            METRICS.inc('http_requests_total', method=type, endpoint=endpoint, status=ret.status_code)
+            
+            if ret.status_code in pass_statuses:
+                return ret, session
+            if ret.status_code == 429:
+                # 暂停由限流器统一执行，下一轮 acquire() 会等到Retry-After之后
+                retry_after = parse_retry_after(ret.headers)
+                if retry_after is None:
+                    retry_after = backoff_delay(attempt, cap=t)
+                RATE_LIMITER.on_throttle(retry_after)
+                METRICS.inc('http_retries_total', endpoint=endpoint, reason='429')
+                attempt += 1
+                continue
+            if ret.status_code in (200, 201):
+                RATE_LIMITER.on_success()
+                return ret, session
+            if ret.status_code == 401:
+                # 只在当前会话上重新认证，不影响其他线程的会话
+                print("认证失败，重新登录...")
+                METRICS.inc('relogins_total', reason='401')
+                session = sign_in(session)
+                continue
+            else:
+                METRICS.inc('http_retries_total', endpoint=endpoint, reason=f'status_{ret.status_code}')
+                delay = backoff_delay(attempt)
+                print(f"\033[31m状态={ret.status_code}，{delay:.1f}秒后重试\033[0m")
+                time.sleep(delay)
+                attempt += 1
+                continue
+        except requests.RequestException as e:
+            METRICS.inc('http_retries_total', endpoint=endpoint, reason='connection_error')
+            METRICS.inc('relogins_total', reason='connection_error')
+            delay = backoff_delay(attempt)
+            print(f"请求错误: {e}. {delay:.1f}秒后重试...")
+            time.sleep(delay)
+            attempt += 1
+            session = sign_in(session)
+    return None, None
+
+
+def check_expression(expression):
+    """
+    提交前在本地校验表达式（语法、运算符、参数个数、未定义变量），未通过时打印原因
+    
+    Returns:
+        bool: 是否可以提交
+    """
+    errors, warnings = validate_expression(expression)
+    for warning in warnings:
+        print(f"表达式警告: {warning}")
+    if errors:
+        print(f"表达式未通过本地校验，不提交仿真: {expression}")
+        for error in errors:
+            print(f"  {error}")
+        return False
+    return True
+
+
+def simulate_alpha(sess, expression, settings=None, validate=True, on_submitted=None):
+    """
+    仿真一个alpha表达式
+    
+    Args:
+        sess: 会话对象
+        expression: alpha表达式字符串
+        settings: 仿真设置字典，如果为None则使用默认设置
+        validate: 提交前是否在本地校验表达式
+        on_submitted: 提交成功后的回调 on_submitted(进度URL, [0])，用于立即持久化进度URL
+    
+    Returns:
+        alpha_id: 仿真完成后的alpha ID
+    """
+    if settings is None:
+        settings = dict(DEFAULT_SIMULATION_SETTINGS)
+    
+    if validate and not check_expression(expression):
+        return None, sess
+    
+    simulation_data = {
+        'type': 'REGULAR',
+        'settings': settings,
+        'regular': expression
+    }
+    
+    print(f"开始仿真Alpha表达式: {expression}")
+    print(f"仿真设置: {settings}")
+    
+    with METRICS.timer('submit_seconds'):
+        sim_resp, sess = requests_wq(
+            sess,
+            'post',
+            f"{API_BASE}/simulations",
+            json_data=simulation_data
+        )
+    METRICS.inc('simulations_submitted_total', batch='false')
+    
+    # 这里一般是表达式/参数级别的错误（语法、不可用运算符等），状态码多为 4xx
+    if sim_resp.status_code not in (200, 201):
+        print(f"仿真请求失败: HTTP {sim_resp.status_code}")
+        try:
+            err_body = sim_resp.json()
+            print("仿真错误明细(JSON):")
+            print(json.dumps(err_body, indent=2, ensure_ascii=False))
+            # 常见字段尝试单独打印，方便快速查看
+            for key in ["error", "message", "detail"]:
+                if key in err_body:
+                    print(f"{key}: {err_body[key]}")
+        except Exception:
+            # 如果不是 JSON，就直接打印文本
+            print("仿真错误响应内容:")
+            print(sim_resp.text)
+        return None, sess
+    
+    sim_progress_url = sim_resp.headers.get('Location')
+    if not sim_progress_url:
+        print("无法获取仿真进度URL")
+        return None, sess
+    if on_submitted is not None:
+        on_submitted(sim_progress_url, [0])
+    
+    print("等待仿真完成...")
+    body, sess = wait_for_simulation(sess, sim_progress_url)
+    if body is None:
+        return None, sess
+
+    alpha_id = extract_alpha_id(body)
+    if alpha_id:
+        print(f"仿真完成！Alpha ID: {alpha_id}")
+    return alpha_id, sess
+
+
+def wait_for_simulation(sess, sim_progress_url, record_metrics=True):
+    """
+    按Retry-After轮询仿真进度，直到仿真结束
+    
+    Args:
+        sess: 会话对象
+        sim_progress_url: 仿真进度URL（提交时返回的Location）
+        record_metrics: 是否记录排队时间和仿真耗时（读取已完成的子仿真时不记录）
+    
+    Returns:
+        body: 仿真结束后进度接口的JSON字典，失败时返回None
+        sess: 会话对象
+    """
+    start = time.monotonic()
+    queued = True
+    while True:
+        sim_progress_resp, sess = requests_wq(sess, 'get', sim_progress_url)
+        if sim_progress_resp.status_code != 200:
+            print(f"获取仿真进度失败: HTTP {sim_progress_resp.status_code}")
+            try:
+                print("进度接口错误响应(JSON):")
+                print(json.dumps(sim_progress_resp.json(), indent=2, ensure_ascii=False))
+            except Exception:
+                print("进度接口错误响应内容:")
+                print(sim_progress_resp.text)
+            return None, sess
+        
+        retry_after_sec = float(sim_progress_resp.headers.get("Retry-After", 0))
+        if record_metrics:
+            METRICS.inc('simulation_polls_total')
+            if queued and (retry_after_sec == 0 or simulation_started(sim_progress_resp)):
+                # 进度第一次大于0（或已完成）之前的时间视为在服务端排队
+                METRICS.observe('simulation_queued_seconds', time.monotonic() - start)
+                queued = False
+        if retry_after_sec == 0:  # simulation done!模拟完成!
+            break
+        print(f"仿真进行中，等待 {retry_after_sec} 秒...")
+        time.sleep(retry_after_sec)
+    if record_metrics:
+        METRICS.observe('simulation_seconds', time.monotonic() - start)
+    
+    # 仿真完成后检查返回体，既尝试拿 alpha，也把状态和错误打印出来
+    try:
+        return sim_progress_resp.json(), sess
+    except Exception:
+        print("仿真完成但进度接口返回不是合法 JSON，原始内容为：")
+        print(sim_progress_resp.text)
+        return None, sess
+
+
+def simulation_limit_exceeded(resp):
+    """提交仿真返回的429是否因为同时运行的仿真数量达到账号上限（而不是请求过快）"""
+    return resp.status_code == 429 and 'CONCURRENT_SIMULATION_LIMIT' in resp.text
+
+
+def simulation_started(resp):
+    """进度响应中的progress是否已大于0"""
+    try:
+        return float(resp.json().get('progress') or 0) > 0
+    except (ValueError, AttributeError):
+        return False
+
+
+def simulate_alpha_batch(sess, alphas, validate=True, on_submitted=None):
+    """
+    以一个multi-simulation请求批量仿真多个alpha
+    
+    父仿真完成后返回children（子仿真ID列表，顺序与提交顺序一致），
+    再逐个读取子仿真的结果，把alpha ID映射回输入的位置。
+    
+    Args:
+        sess: 会话对象
+        alphas: [(expression, settings), ...]，数量不超过 MAX_BATCH_SIZE
+        validate: 提交前是否在本地校验表达式；未通过的alpha不提交，对应位置为None
+        on_submitted: 提交成功后的回调 on_submitted(进度URL, 该请求包含的alphas下标列表)，
+                      用于立即持久化进度URL
+    
+    Returns:
+        alpha_ids: 与alphas一一对应的alpha ID列表，失败的位置为None
+        sess: 会话对象
+    """
+    if validate:
+        valid = [i for i, (expression, _) in enumerate(alphas) if check_expression(expression)]
+        if len(valid) < len(alphas):
+            alpha_ids = [None] * len(alphas)
+            if valid:
+                submitted = None
+                if on_submitted is not None:
+                    submitted = lambda url, indexes: on_submitted(url, [valid[i] for i in indexes])
+                valid_ids, sess = simulate_alpha_batch(sess, [alphas[i] for i in valid], validate=False,
+                                                       on_submitted=submitted)
+                for i, alpha_id in zip(valid, valid_ids):
+                    alpha_ids[i] = alpha_id
+            return alpha_ids, sess
+    if len(alphas) == 1:
+        # multi-simulation至少需要2个子仿真，单个时直接走普通仿真
+        alpha_id, sess = simulate_alpha(sess, *alphas[0], validate=False, on_submitted=on_submitted)
+        return [alpha_id], sess
+    if len(alphas) > MAX_BATCH_SIZE:
+        raise ValueError(f"一次最多批量仿真 {MAX_BATCH_SIZE} 个alpha，实际 {len(alphas)} 个")
+    
+    simulation_data = [
+        {
+            'type': 'REGULAR',
+            'settings': settings if settings is not None else dict(DEFAULT_SIMULATION_SETTINGS),
+            'regular': expression
+        }
+        for expression, settings in alphas
+    ]
+    print(f"开始批量仿真 {len(alphas)} 个Alpha表达式")
+    with METRICS.timer('submit_seconds'):
+        sim_resp, sess = requests_wq(
+            sess,
+            'post',
+            f"{API_BASE}/simulations",
+            json_data=simulation_data
+        )
+    METRICS.inc('simulations_submitted_total', len(alphas), batch='true')
+    sim_progress_url = sim_resp.headers.get('Location')
+    if not sim_progress_url:
+        print("无法获取批量仿真进度URL")
+        return [None] * len(alphas), sess
+    if on_submitted is not None:
+        on_submitted(sim_progress_url, list(range(len(alphas))))
+    
+    print("等待批量仿真完成...")
+    body, sess = wait_for_simulation(sess, sim_progress_url)
+    children = body.get("children", []) if body else []
+    if len(children) != len(alphas):
+        print(f"批量仿真返回的子仿真数量 {len(children)} 与提交数量 {len(alphas)} 不一致")
+        if body:
+            print(json.dumps(body, indent=2, ensure_ascii=False))
+        return [None] * len(alphas), sess
+    
+    alpha_ids = []
+    for child in children:
+        child_body, sess = wait_for_simulation(sess, child_progress_url(child), record_metrics=False)
+        alpha_ids.append(extract_alpha_id(child_body) if child_body else None)
+    print(f"批量仿真完成！Alpha IDs: {alpha_ids}")
+    return alpha_ids, sess
+
+
+def child_progress_url(child):
+    """multi-simulation父仿真 children 中一个子仿真的进度URL"""
+    return f"{API_BASE}/simulations/{child}"
+
+
+def extract_alpha_id(body):
+    """
+    从仿真完成后的进度响应中取出alpha ID，失败时打印错误明细
+    
+    Args:
+        body: 进度接口返回的JSON字典
+    
+    Returns:
+        alpha_id: Alpha ID，仿真失败或缺失时返回None
+    """
+    # 一般会有 status / state / errors / message 等字段
+    status = body.get("status") or body.get("state")
+    if status and status not in ("COMPLETE", "SUCCESS"):
+        print(f"仿真未成功结束，状态: {status}")
+        # 常见错误字段
+        for key in ["error", "message", "detail"]:
+            if key in body:
+                print(f"{key}: {body[key]}")
+        # 有些接口会把多条错误放在 errors 数组里
+        if "errors" in body:
+            print("errors:")
+            print(json.dumps(body["errors"], indent=2, ensure_ascii=False))
+        # 直接打印整个 body 方便你对照网页上的提示
+        print("仿真进度响应(JSON):")
+        print(json.dumps(body, indent=2, ensure_ascii=False))
+        return None
+
+    alpha_id = body.get("alpha")
+    if not alpha_id:
+        print("仿真完成，但响应中未找到 alpha ID，完整响应为：")
+        print(json.dumps(body, indent=2, ensure_ascii=False))
+        return None
+    return alpha_id
+
+
+def get_check_submission(s, alpha_id, is_data=None):
+    """
+    检查Alpha提交状态
+    
+    Args:
+        s: 会话对象
+        alpha_id: Alpha ID
+        is_data: alpha的 "is" 指标字典，传入时用检查接口返回的各项检查结果更新其中的 'checks'
+    
+    Returns:
+        check_result: 检查结果 ("SUCCESS", "ERROR", "FAIL", "nan", "sleep")
+        sess: 会话对象
+    """
+    sess = s
+    start = time.monotonic()
+    while True:
+        result, sess = requests_wq(sess, 'get', 
+                                    f"{API_BASE}/alphas/{alpha_id}/check")
+        METRICS.inc('check_polls_total')
+        if "retry-after" in result.headers:
+            retry_after = float(result.headers["Retry-After"])
+            print(f"等待检查结果，延时 {retry_after} 秒...")
+            time.sleep(retry_after)
+        else:
+            break
+    METRICS.observe('check_wait_seconds', time.monotonic() - start)
+    
+    check_body = result.json()
+    check_result = parse_check_result(alpha_id, check_body)
+    merge_check_details(is_data, check_body)
+    METRICS.inc('check_results_total', result=result_label(check_result))
+    return check_result, sess
+
+
+def merge_check_details(is_data, check_body):
+    """
+    把检查接口返回的各项检查（[{'name', 'result', 'value', 'limit'}, ...]）写入 is_data['checks']，
+    与alpha信息中 "is" 的结构一致，结果仓库据此保存每项检查的结果
+
+    Args:
+        is_data: alpha的 "is" 指标字典，None时什么也不做
+        check_body: 检查接口返回的JSON字典（数据未准备好时没有 checks，不更新）
+    """
+    if is_data is None or not isinstance(check_body.get("is"), dict):
+        return
+    checks = check_body["is"].get("checks")
+    if checks:
+        is_data["checks"] = checks
+
+
+def parse_check_result(alpha_id, check_body):
+    """
+    解析 /alphas/{alpha_id}/check 的返回体
+    
+    Args:
+        alpha_id: Alpha ID
+        check_body: 检查接口返回的JSON字典
+    
+    Returns:
+        check_result: 检查结果 ("SUCCESS", "ERROR", "FAIL", "nan", "sleep")
+    """
+    if check_body.get("is", 0) == 0:
+        print(f"Alpha {alpha_id}: 未登录或数据未准备好，返回 'sleep'")
+        return "sleep"
+    
+    # 只有十来项检查，直接遍历，不构造DataFrame
+    checks = check_body["is"]["checks"]
+    results = {check.get("result") for check in checks}
+    
+    # 检查 SELF_CORRELATION 是否为 "nan"（没有值时返回的是null或缺少value）
+    self_correlation_value = next(
+        (check.get("value") for check in checks if check.get("name") == "SELF_CORRELATION"), None
+    )
+    
+    if "ERROR" in results:
+        print(f"Alpha {alpha_id}: \033[31m ERROR \033[0m，检查失败")
+        return "ERROR"
+    
+    if "FAIL" in results:
+        print(f"Alpha {alpha_id}: \033[31m FAIL \033[0m，检查失败")
+        return "FAIL"
+    
+    if self_correlation_value is None or str(self_correlation_value).lower() == "nan":
+        print(f"Alpha {alpha_id}: SELF_CORRELATION 为 \033[31m nan \033[0m，检查失败")
+        return "nan"
+    
+    # 所有检查都通过
+    print(f"Alpha {alpha_id}: \033[32m 所有检查通过 \033[0m")
+    return "SUCCESS"
+
+
+def set_alpha_properties(s, alpha_id, name=None, color=None, 
+                        selection_desc="None", combo_desc="None",
+                        tags="SUCCESS", regular_desc="None"):
+    """
+    设置Alpha属性，包括标签
+    
+    Args:
+        s: 会话对象
+        alpha_id: Alpha ID
+        name: Alpha名称
+        color: 颜色
+        selection_desc: 选择描述
+        combo_desc: 组合描述
+        tags: 标签（默认"SUCCESS"），也可以是标签列表
+        regular_desc: 常规描述
+    
+    Returns:
+        response: API响应
+        sess: 会话对象
+    """
+    sess = s
+    tags = [tags] if isinstance(tags, str) else list(tags)
+    params = {
+        "color": color,
+        "name": name,
+        "tags": tags,
+        "category": None,
+        "regular": {"description": regular_desc},
+        "combo": {"description": combo_desc},
+        "selection": {"description": selection_desc},
+    }
+    with METRICS.timer('tag_seconds'):
+        response, sess = requests_wq(sess, 'patch', 
+                                      f"{API_BASE}/alphas/{alpha_id}",
+                                      json_data=params)
+    METRICS.inc('tags_total', tag=','.join(tags))
+    return response, sess
+
+
+def get_alpha_info(s, alpha_id):
+    """获取Alpha的详细信息"""
+    sess = s
+    with METRICS.timer('alpha_info_seconds'):
+        response, sess = requests_wq(sess, 'get', 
+                                      f"{API_BASE}/alphas/{alpha_id}")
+    if response.status_code == 200:
+        return response.json(), sess
+    return None, sess
+
+
+def wait_for_alpha_info(s, alpha_id, policy=ALPHA_READINESS):
+    """
+    轮询Alpha信息直到IS指标就绪（按 policy 自适应间隔，代替固定等待10秒）
+    
+    Returns:
+        alpha_info: Alpha信息字典；达到停止条件时返回最后一次获取的信息（可能未就绪或为None）
+        sess: 会话对象
+    """
+    sess = s
+    start = time.monotonic()
+    delay = policy.first_delay()
+    attempt = 0
+    while True:
+        if delay > 0:
+            time.sleep(delay)
+        alpha_info, sess = get_alpha_info(sess, alpha_id)
+        attempt += 1
+        elapsed = time.monotonic() - start
+        if alpha_info_ready(alpha_info):
+            policy.record_ready(elapsed)
+            METRICS.observe('alpha_ready_seconds', elapsed)
+            return alpha_info, sess
+        delay = policy.next_delay(attempt, elapsed)
+        if delay is None:
+            print(f"Alpha {alpha_id}: 等待 {elapsed:.0f} 秒后IS指标仍未就绪，放弃等待")
+            return alpha_info, sess
+
+
+def wait_for_check(s, alpha_id, policy=CHECK_READINESS, is_data=None):
+    """
+    轮询检查结果直到不再是 "sleep"（按 policy 自适应间隔，代替固定等待40秒重试3次）
+    
+    is_data: 传入时各项检查结果写入其中的 'checks'（见 merge_check_details）
+    
+    Returns:
+        check_result: 检查结果 ("SUCCESS", "ERROR", "FAIL", "nan")；达到停止条件时为 "sleep"
+        sess: 会话对象
+    """
+    sess = s
+    start = time.monotonic()
+    delay = policy.first_delay()
+    attempt = 0
+    while True:
+        if delay > 0:
+            time.sleep(delay)
+        # get_check_submission 内部已遵守检查接口的Retry-After
+        check_result, sess = get_check_submission(sess, alpha_id, is_data)
+        attempt += 1
+        elapsed = time.monotonic() - start
+        if check_result != "sleep":
+            policy.record_ready(elapsed)
+            return check_result, sess
+        delay = policy.next_delay(attempt, elapsed)
+        if delay is None:
+            print(f"Alpha {alpha_id}: 等待 {elapsed:.0f} 秒后检查数据仍未准备好，放弃等待")
+            return check_result, sess
+        print(f"Alpha {alpha_id}: 检查数据未准备好，{delay:.1f} 秒后重试")
+
+
+def main():
+    """主函数：仿真Alpha并进行回测检查"""
+    print("=" * 50)
+    print("Alpha仿真和回测检查脚本")
+    print(f"开始时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 50)
+    
+    # 登录
+    sess = sign_in()
+    if not sess:
+        print("登录失败，程序退出")
+        return
+    
+    # 配置Alpha表达式（可以修改这里来测试不同的表达式）
+    # 写法要求：① 用三引号 """ """ 包裹多行；② 语句以分号分隔；③ 最后一句为 alpha 输出
+    alpha_expression = """
+iv_diff = ts_delta(implied_volatility_call_120, 1);
+iv_signal = ts_decay_linear(iv_diff, 5);
+iv_z = zscore(winsorize(iv_signal, std = 3));
+cap_bucket = bucket(rank(cap), range = "0.2, 1, 0.3");
+iv_rank = group_rank(iv_z, cap_bucket);
+alpha = group_neutralize(iv_rank, subindustry);
+alpha
+""".strip()
+    
+    # 可选：自定义仿真设置
+    custom_settings = None  # 使用默认设置，如需自定义可取消注释下面的代码
+    custom_settings = {
+        'instrumentType': 'EQUITY',
+        'region': 'USA',
+        'universe': 'TOP3000',
+        'delay': 1,
+        'decay': 4,
+        'neutralization': 'SECTOR',
+        'truncation': 0.08,
+        'pasteurization': 'ON',
+        'unitHandling': 'VERIFY',
+        'nanHandling': 'ON',
+        'language': 'FASTEXPR',
+        'visualization': False,
+    }
+    
+    # 步骤1: 仿真Alpha
+    print("\n" + "=" * 50)
+    print("步骤1: 开始仿真Alpha")
+    print("=" * 50)
+    alpha_id, sess = simulate_alpha(sess, alpha_expression, custom_settings)
+    
+    if not alpha_id:
+        print("仿真失败，程序退出")
+        return
+    
+    # 步骤2: 获取Alpha信息并显示指标（轮询直到IS指标就绪）
+    print("\n" + "=" * 50)
+    print("步骤2: 获取Alpha信息")
+    print("=" * 50)
+    alpha_info, sess = wait_for_alpha_info(sess, alpha_id)
+    if alpha_info:
+        is_data = alpha_info.get("is", {})
+        print(f"Sharpe: {is_data.get('sharpe', 'N/A')}")
+        print(f"Fitness: {is_data.get('fitness', 'N/A')}")
+        print(f"Turnover: {is_data.get('turnover', 'N/A')}")
+        print(f"Margin: {is_data.get('margin', 'N/A')}")
+        print(f"Long Count: {is_data.get('longCount', 'N/A')}")
+        print(f"Short Count: {is_data.get('shortCount', 'N/A')}")
+    
+    # 步骤3: 进行回测检查
+    print("\n" + "=" * 50)
+    print("步骤3: 进行回测检查")
+    print("=" * 50)
+    
+    # 检查数据未准备好时按自适应间隔重试，直到就绪或达到停止条件
+    check_result, sess = wait_for_check(sess, alpha_id)
+    
+    # 步骤4: 根据检查结果处理
+    print("\n" + "=" * 50)
+    print("步骤4: 处理检查结果")
+    print("=" * 50)
+    
+    if check_result == "SUCCESS":
+        print(f"\n\033[32m✓ Alpha {alpha_id} 检查通过！\033[0m")
+        print("正在打上SUCCESS标签...")
+        response, sess = set_alpha_properties(
+            sess, 
+            alpha_id, 
+            name=datetime.now().strftime("%Y.%m.%d"),
+            tags="SUCCESS",
+            regular_desc=f"Simulated and checked on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        )
+        if response and response.status_code in (200, 201):
+            print(f"\033[32m✓ 成功为Alpha {alpha_id} 打上SUCCESS标签\033[0m")
+            print("可以在平台上查看Tag-SUCCESS，并手动提交")
+        else:
+            print(f"\033[33m警告: 打标签可能失败，状态码: {response.status_code if response else 'None'}\033[0m")
+    else:
+        print(f"\n\033[31m✗ Alpha {alpha_id} 检查未通过\033[0m")
+        print(f"检查结果: {check_result}")
+        if check_result == "sleep":
+            print("Alpha数据可能还未准备好，请稍后手动检查")
+        elif check_result in ("ERROR", "FAIL", "nan"):
+            print("Alpha未通过回测检查，不符合提交条件")
+    
+    print("\n" + "=" * 50)
+    print(f"完成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
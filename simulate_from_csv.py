@@ -1,370 +1,1480 @@
-# Alpha批量仿真和回测脚本（从CSV读取）- 并发版本
-# 功能：从CSV文件读取alpha列表，并发进行仿真和回测，标记已完成的项目，支持断点续跑
-# 支持同时运行多个仿真（默认3个并发）
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import time
-import pandas as pd
-import ast
-from datetime import datetime
-from os.path import expanduser
-import sys
-import os
-import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-# 导入alpha_simulate_and_check.py中的函数
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from simulate_and_check_for1 import (
-    sign_in, requests_wq, simulate_alpha, get_check_submission,
-    set_alpha_properties, get_alpha_info
-)
-
-
-def load_alpha_list_from_csv(csv_path):
-    """
-    从CSV文件加载alpha列表
-    
-    Args:
-        csv_path: CSV文件路径
-    
-    Returns:
-        df: DataFrame，包含alpha列表和状态信息
-    """
-    try:
-        df = pd.read_csv(csv_path, encoding='utf-8')
-        
-        # 如果CSV中没有status列，添加它
-        if 'status' not in df.columns:
-            df['status'] = 'PENDING'
-            df['alpha_id'] = ''
-            df['check_result'] = ''
-            df['completed_time'] = ''
-        
-        # 确保所有必要的列都存在
-        required_columns = ['type', 'settings', 'regular', 'status']
-        for col in required_columns:
-            if col not in df.columns:
-                raise ValueError(f"CSV文件缺少必要的列: {col}")
-        
-        return df
-    except Exception as e:
-        print(f"读取CSV文件失败: {e}")
-        raise
-
-
-# 全局锁，用于保护CSV文件的读写操作
-csv_lock = threading.Lock()
-
-def save_alpha_list_to_csv(df, csv_path, use_lock=True):
-    """
-    保存alpha列表到CSV文件（线程安全）
-    
-    Args:
-        df: DataFrame
-        csv_path: CSV文件路径
-        use_lock: 是否使用锁（如果调用者已经持有锁，可以设为False）
-    """
-    def _save():
-        try:
-            df.to_csv(csv_path, index=False, encoding='utf-8')
-        except Exception as e:
-            print(f"保存CSV文件失败: {e}")
-            raise
-    
-    if use_lock:
-        with csv_lock:
-            _save()
-    else:
-        _save()
-
-
-def parse_settings(settings_str):
-    """
-    解析settings字符串（可能是JSON字符串或字典字符串）
-    
-    Args:
-        settings_str: settings字符串
-    
-    Returns:
-        dict: 解析后的settings字典
-    """
-    try:
-        # 尝试作为JSON解析
-        return json.loads(settings_str)
-    except json.JSONDecodeError:
-        try:
-            # 尝试作为Python字典字符串解析
-            return ast.literal_eval(settings_str)
-        except:
-            print(f"无法解析settings: {settings_str}")
-            return None
-
-
-def process_single_alpha(alpha_row, row_index, index, total, df, csv_path):
-    """
-    处理单个alpha：仿真、回测、标记（线程安全版本）
-    
-    Args:
-        alpha_row: DataFrame的一行，包含alpha信息
-        row_index: DataFrame中的原始行索引
-        index: 当前alpha在处理队列中的索引（从0开始）
-        total: 总待处理alpha数量
-        df: DataFrame对象（用于更新状态）
-        csv_path: CSV文件路径
-    
-    Returns:
-        tuple: (success: bool, alpha_id: str, check_result: str, row_index: int)
-    """
-    thread_id = threading.current_thread().name
-    print("\n" + "=" * 80)
-    print(f"[线程 {thread_id}] 处理Alpha [{index + 1}/{total}]")
-    print("=" * 80)
-    print(f"[线程 {thread_id}] Alpha表达式: {alpha_row['regular']}")
-    
-    # 每个线程使用独立的session（requests.Session不是线程安全的）
-    sess = sign_in()
-    if not sess:
-        print(f"[线程 {thread_id}] 登录失败")
-        return False, None, "LOGIN_FAILED", row_index
-    
-    # 解析settings
-    settings = parse_settings(alpha_row['settings'])
-    if settings is None:
-        print(f"[线程 {thread_id}] 跳过Alpha [{index + 1}]: settings解析失败")
-        return False, None, "SETTINGS_ERROR", row_index
-    
-    try:
-        # 步骤1: 仿真Alpha
-        print(f"[线程 {thread_id}] [步骤1] 开始仿真Alpha...")
-        alpha_id, sess = simulate_alpha(sess, alpha_row['regular'], settings)
-        
-        if not alpha_id:
-            print(f"[线程 {thread_id}] Alpha [{index + 1}] 仿真失败")
-            return False, None, "SIMULATION_FAILED", row_index
-        
-        # 等待一段时间，确保Alpha数据已准备好
-        print(f"[线程 {thread_id}] 等待Alpha数据准备...")
-        time.sleep(10)
-        
-        # 步骤2: 获取Alpha信息并显示指标
-        print(f"[线程 {thread_id}] [步骤2] 获取Alpha信息...")
-        alpha_info, sess = get_alpha_info(sess, alpha_id)
-        if alpha_info:
-            is_data = alpha_info.get("is", {})
-            print(f"[线程 {thread_id}] Sharpe: {is_data.get('sharpe', 'N/A')}")
-            print(f"[线程 {thread_id}] Fitness: {is_data.get('fitness', 'N/A')}")
-            print(f"[线程 {thread_id}] Turnover: {is_data.get('turnover', 'N/A')}")
-            print(f"[线程 {thread_id}] Margin: {is_data.get('margin', 'N/A')}")
-            print(f"[线程 {thread_id}] Long Count: {is_data.get('longCount', 'N/A')}")
-            print(f"[线程 {thread_id}] Short Count: {is_data.get('shortCount', 'N/A')}")
-        
-        # 步骤3: 进行回测检查
-        print(f"[线程 {thread_id}] [步骤3] 进行回测检查...")
-        
-        # 重试机制：最多尝试3次
-        max_retries = 3
-        check_result = None
-        for attempt in range(max_retries):
-            check_result, sess = get_check_submission(sess, alpha_id)
-            if check_result != "sleep":
-                break
-            if attempt < max_retries - 1:
-                print(f"[线程 {thread_id}] Alpha数据未准备好，等待40秒后重试 ({attempt + 1}/{max_retries})...")
-                time.sleep(40)
-        
-        # 步骤4: 根据检查结果处理
-        print(f"[线程 {thread_id}] [步骤4] 处理检查结果...")
-        sharpe = is_data.get('sharpe')
-        fitness = is_data.get('fitness')
-        turnover = is_data.get('turnover')
-        existing_tags = alpha_info.get("tags", []) # 获取现有标签防止重复
-        
-        if check_result == "SUCCESS":
-            print(f"[线程 {thread_id}] ✓ Alpha {alpha_id} 检查通过！")
-
-            # --- PERFECT 标签逻辑 ---
-            is_perfect = (sharpe > 2.0 and fitness > 1.5) and (turnover < 0.2)
-            
-            if is_perfect:
-                print(f"[线程 {thread_id}] ✨ 出现优秀指标，正在打上 PERFECT 标签...")
-                p_resp, sess = set_alpha_properties(
-                    sess, 
-                    alpha_id, 
-                    tags="PERFECT",
-                    regular_desc=f"Simulated and checked on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            )
-                if p_resp and p_resp.status_code in (200, 201):
-                    print(f"[线程 {thread_id}] ✓ 成功为Alpha {alpha_id} 打上 PERFECT 标签")
-                else:
-                    print(f"[线程 {thread_id}] 警告: 完美标签打标失败，状态码: {p_resp.status_code if p_resp else 'None'}")
-            
-            else:
-                print(f"[线程 {thread_id}] 正在打上SUCCESS标签...")
-                response, sess = set_alpha_properties(
-                    sess, 
-                    alpha_id, 
-                    name=datetime.now().strftime("%Y.%m.%d"),
-                    tags="SUCCESS",
-                    regular_desc=f"Simulated and checked on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                )
-                if response and response.status_code in (200, 201):
-                    print(f"[线程 {thread_id}] ✓ 成功为Alpha {alpha_id} 打上SUCCESS标签")
-                else:
-                    print(f"[线程 {thread_id}] 警告: 打标签可能失败，状态码: {response.status_code if response else 'None'}")
-                
-            return True, alpha_id, check_result, row_index
-        else:
-            print(f"[线程 {thread_id}] ✗ Alpha {alpha_id} 检查未通过")
-            print(f"[线程 {thread_id}] 检查结果: {check_result}")
-            
-            # --- POTENTIAL_SUCCESS 标签逻辑 ---
-            # 检查指标是否符合潜力标准且未被标记过
-            is_promising = (sharpe > 1.1 and fitness > 0.8) or (sharpe > 1.5)
-            already_tagged = "SUCCESS" in existing_tags or "POTENTIAL" in existing_tags
-            
-            if is_promising and not already_tagged:
-                print(f"[线程 {thread_id}] ✨ 发现潜力指标，正在打上 POTENTIAL 标签...")
-                p_resp, sess = set_alpha_properties(
-                    sess, 
-                    alpha_id, 
-                    tags="POTENTIAL",
-                    regular_desc=f"Potential candidate: Sharpe={sharpe}, Fitness={fitness}"
-                )
-                if p_resp and p_resp.status_code in (200, 201):
-                    print(f"[线程 {thread_id}] ✓ 成功打上 POTENTIAL 标签")
-                else:
-                    print(f"[线程 {thread_id}] 警告: 潜力标签打标失败，状态码: {p_resp.status_code if p_resp else 'None'}")
-    
-            return False, alpha_id, check_result, row_index
-            
-    except Exception as e:
-        print(f"[线程 {thread_id}] 处理Alpha时发生错误: {e}")
-        import traceback
-        traceback.print_exc()
-        return False, None, f"Exception: {str(e)}", row_index
-
-
-def main():
-    """主函数：从CSV读取alpha列表并并发批量处理"""
-    print("=" * 80)
-    print("Alpha批量仿真和回测脚本（从CSV读取）- 并发版本")
-    print(f"开始时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("=" * 80)
-    
-    # 并发数量（可以在命令行参数中指定，默认3）
-    max_workers = 3
-    if len(sys.argv) > 1:
-        try:
-            max_workers = int(sys.argv[1])
-        except ValueError:
-            print(f"警告: 无效的并发数参数 '{sys.argv[1]}'，使用默认值3")
-    
-    print(f"并发数量: {max_workers}")
-    
-    # CSV文件路径
-    csv_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 
-                           './MyQuantCode/alpha_list_pending_simulated.csv')
-    
-    if not os.path.exists(csv_path):
-        print(f"错误: CSV文件不存在: {csv_path}")
-        return
-    
-    # 加载alpha列表
-    print(f"\n加载Alpha列表: {csv_path}")
-    df = load_alpha_list_from_csv(csv_path)
-    print(f"总共 {len(df)} 个Alpha")
-    
-    # 统计状态
-    status_counts = df['status'].value_counts()
-    print("\n当前状态统计:")
-    for status, count in status_counts.items():
-        print(f"  {status}: {count}")
-    
-    # 筛选出待处理的alpha（状态为PENDING或空）
-    pending_mask = (df['status'] == 'PENDING') | (df['status'].isna()) | (df['status'] == '')
-    pending_df = df[pending_mask].copy()
-    
-    if len(pending_df) == 0:
-        print("\n没有待处理的Alpha，程序退出")
-        return
-    
-    print(f"\n待处理的Alpha数量: {len(pending_df)}")
-    
-    # 准备任务列表
-    tasks = []
-    for idx, (row_index, alpha_row) in enumerate(pending_df.iterrows()):
-        tasks.append((alpha_row, row_index, idx, len(pending_df)))
-    
-    # 使用线程池并发处理
-    success_count = 0
-    fail_count = 0
-    completed_count = 0
-    
-    print(f"\n开始并发处理（最多{max_workers}个并发）...")
-    
-    try:
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            future_to_task = {
-                executor.submit(process_single_alpha, alpha_row, row_index, idx, total, df, csv_path): 
-                (alpha_row, row_index, idx, total)
-                for alpha_row, row_index, idx, total in tasks
-            }
-            
-            # 处理完成的任务
-            for future in as_completed(future_to_task):
-                completed_count += 1
-                try:
-                    success, alpha_id, check_result, row_index = future.result()
-                    
-                    # 更新DataFrame中的状态（使用锁保护）
-                    with csv_lock:
-                        if success:
-                            df.at[row_index, 'status'] = 'SUCCESS'
-                            df.at[row_index, 'alpha_id'] = str(alpha_id) if alpha_id else ''
-                            df.at[row_index, 'check_result'] = check_result
-                            df.at[row_index, 'completed_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            success_count += 1
-                        else:
-                            df.at[row_index, 'status'] = 'FAILED'
-                            df.at[row_index, 'alpha_id'] = str(alpha_id) if alpha_id else ''
-                            df.at[row_index, 'check_result'] = check_result
-                            df.at[row_index, 'completed_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            fail_count += 1
-                        
-                        # 每完成一个任务就保存一次CSV（防止中断丢失进度）
-                        # 注意：这里已经持有锁，所以不需要再次加锁
-                        save_alpha_list_to_csv(df, csv_path, use_lock=False)
-                    
-                    print(f"\n[进度] 已完成 {completed_count}/{len(tasks)} 个Alpha (成功: {success_count}, 失败: {fail_count})")
-                    
-                except Exception as e:
-                    print(f"\n处理任务时发生错误: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    fail_count += 1
-                    
-    except KeyboardInterrupt:
-        print("\n\n用户中断，保存当前进度...")
-        with csv_lock:
-            save_alpha_list_to_csv(df, csv_path, use_lock=False)
-        print("进度已保存，程序退出")
-        return
-    
-    # 最终统计
-    print("\n" + "=" * 80)
-    print("处理完成！")
-    print("=" * 80)
-    print(f"成功: {success_count}")
-    print(f"失败: {fail_count}")
-    print(f"完成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("=" * 80)
-
-
-if __name__ == "__main__":
-    # 支持命令行参数指定并发数
-    # 用法: python alpha_batch_simulate_from_csv.py [并发数]
-    # 例如: python alpha_batch_simulate_from_csv.py 3
-    main()
+# Alpha批量仿真和回测脚本（从CSV读取）- 并发版本
+# 功能：从CSV文件读取alpha列表，并发进行仿真和回测，标记已完成的项目，支持断点续跑
+# 支持同时运行多个仿真（默认3个并发）
+import json
+import time
+import ast
+from datetime import datetime
+import sys
+import os
+import argparse
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# 导入alpha_simulate_and_check.py中的函数
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from simulate_and_check_for1 import (
+    requests_wq, simulate_alpha, simulate_alpha_batch,
+    set_alpha_properties, extract_alpha_id, parse_check_result, check_expression,
+    get_alpha_info, wait_for_alpha_info, wait_for_check, merge_check_details, wait_for_simulation,
+    child_progress_url, simulation_limit_exceeded, current_account, UNRESUMABLE_STATUSES, MAX_BATCH_SIZE,
+    API_BASE
+)
+from session_pool import SessionPool
+from poll_scheduler import PollScheduler
+from pipeline import Stage, Pipeline
+from state_store import (
+    AlphaStateStore, PendingTaskQueue, default_db_path, resume_point,
+    STAGE_SUBMITTED, STAGE_COMPLETED, STAGE_CHECKED, STAGE_TAGGED
+)
+from result_cache import ResultCache, default_cache_path
+from metrics import METRICS, JsonLinesExporter, start_prometheus_server, rss_bytes, result_label
+from readiness import ALPHA_READINESS, CHECK_READINESS, alpha_info_ready
+from bandit_scheduler import SlotBandit, BanditTaskQueue, default_bandit_path
+from family_pruning import FamilyPruningQueue, PRUNE_MODES, NOT_READY
+from tag_queue import TagQueue, default_tag_db_path
+from self_correlation import (
+    SelfCorrelationFilter, get_pnl, parse_pnl_recordset, pnl_recordset_url, DEFAULT_THRESHOLD
+)
+from recordset_cache import RecordsetCache, default_recordset_cache_dir
+from results_warehouse import ResultsWarehouse, default_warehouse_dir
+from work_queue import LeasedTaskQueue, open_queue, default_owner, DEFAULT_LEASE_SECONDS
+from rate_limiter import RATE_LIMITER, parse_retry_after
+from concurrency_tuner import ConcurrencyTuner, DEFAULT_MAX_LIMIT
+from operator_catalog import OperatorCatalog
+
+
+# 默认的待仿真alpha列表CSV路径
+DEFAULT_CSV_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                './MyQuantCode/alpha_list_pending_simulated.csv')
+
+# 可以写入结果缓存的最终检查结果
+CACHEABLE_CHECK_RESULTS = ("SUCCESS", "ERROR", "FAIL", "nan")
+
+# 调度器模式下各阶段的默认线程数：
+# 提交只发POST（在途数量另由服务端仿真名额限制）；轮询请求便宜，可以多开；
+# 获取指标、下载PnL（启用自相关预筛时）、检查、打标签受限流器约束
+DEFAULT_STAGE_WORKERS = {'submit': 2, 'poll': 8, 'fetch': 4, 'pnl': 2, 'check': 4, 'tag': 2}
+
+# 调度器模式下阶段之间队列的默认容量
+DEFAULT_STAGE_QUEUE_SIZE = 100
+
+# 本地自相关预筛的处理方式：skip 不再 /check 直接记为 HIGH_SELF_CORR；deprioritize 排到其他alpha的检查之后
+SELFCORR_MODES = ('skip', 'deprioritize')
+
+# 调度器模式下等待PnL记录集生成的最长秒数，超过后不做预筛直接检查
+PNL_MAX_WAIT = 120.0
+
+
+def load_alpha_list_from_csv(csv_path):
+    """
+    从CSV文件加载alpha列表
+    
+    Args:
+        csv_path: CSV文件路径
+    
+    Returns:
+        df: DataFrame，包含alpha列表和状态信息
+    """
+    # 只有整表读写CSV时才需要pandas，处理alpha的流程不加载它
+    import pandas as pd
+    try:
+        df = pd.read_csv(csv_path, encoding='utf-8')
+        
+        # 如果CSV中没有status列，添加它
+        if 'status' not in df.columns:
+            df['status'] = 'PENDING'
+            df['alpha_id'] = ''
+            df['check_result'] = ''
+            df['completed_time'] = ''
+        
+        # 确保所有必要的列都存在
+        required_columns = ['type', 'settings', 'regular', 'status']
+        for col in required_columns:
+            if col not in df.columns:
+                raise ValueError(f"CSV文件缺少必要的列: {col}")
+        
+        return df
+    except Exception as e:
+        print(f"读取CSV文件失败: {e}")
+        raise
+
+
+# 全局锁，用于保护CSV文件的读写操作
+csv_lock = threading.Lock()
+
+def save_alpha_list_to_csv(df, csv_path, use_lock=True):
+    """
+    保存alpha列表到CSV文件（线程安全）
+    
+    Args:
+        df: DataFrame
+        csv_path: CSV文件路径
+        use_lock: 是否使用锁（如果调用者已经持有锁，可以设为False）
+    """
+    def _save():
+        try:
+            df.to_csv(csv_path, index=False, encoding='utf-8')
+        except Exception as e:
+            print(f"保存CSV文件失败: {e}")
+            raise
+    
+    if use_lock:
+        with csv_lock:
+            _save()
+    else:
+        _save()
+
+
+def parse_settings(settings_str):
+    """
+    解析settings字符串（可能是JSON字符串或字典字符串）
+    
+    Args:
+        settings_str: settings字符串
+    
+    Returns:
+        dict: 解析后的settings字典
+    """
+    try:
+        # 尝试作为JSON解析
+        return json.loads(settings_str)
+    except json.JSONDecodeError:
+        try:
+            # 尝试作为Python字典字符串解析
+            return ast.literal_eval(settings_str)
+        except:
+            print(f"无法解析settings: {settings_str}")
+            return None
+
+
+def decide_alpha_tag(check_result, is_data, existing_tags):
+    """
+    根据检查结果和IS指标决定要打的标签
+    
+    - 检查通过且 Sharpe>2.0、Fitness>1.5、Turnover<0.2：PERFECT
+    - 检查通过：SUCCESS
+    - 检查未通过但指标有潜力且未被标记过：POTENTIAL
+    - 本地自相关预筛未通过（HIGH_SELF_CORR）：不打标签，它与已有alpha高度重复
+    - 没有 Sharpe 或 Fitness（等待alpha信息就绪超时放弃时 is_data 为空）：不打标签
+    
+    Args:
+        check_result: get_check_submission返回的检查结果
+        is_data: Alpha信息中的 "is" 指标字典
+        existing_tags: Alpha已有的标签列表
+    
+    Returns:
+        dict: set_alpha_properties的关键字参数（包含tags），不需要打标签时返回None
+    """
+    if check_result == "HIGH_SELF_CORR":
+        return None
+    is_data = is_data or {}
+    sharpe = is_data.get('sharpe')
+    fitness = is_data.get('fitness')
+    turnover = is_data.get('turnover')
+    if sharpe is None or fitness is None:
+        return None
+    
+    if check_result == "SUCCESS":
+        checked_desc = f"Simulated and checked on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        # --- PERFECT 标签逻辑 ---
+        is_perfect = (sharpe > 2.0 and fitness > 1.5) and turnover is not None and turnover < 0.2
+        if is_perfect:
+            return {'tags': "PERFECT", 'regular_desc': checked_desc}
+        return {
+            'name': datetime.now().strftime("%Y.%m.%d"),
+            'tags': "SUCCESS",
+            'regular_desc': checked_desc,
+        }
+    
+    # --- POTENTIAL_SUCCESS 标签逻辑 ---
+    # 检查指标是否符合潜力标准且未被标记过
+    is_promising = (sharpe > 1.1 and fitness > 0.8) or (sharpe > 1.5)
+    already_tagged = "SUCCESS" in existing_tags or "POTENTIAL" in existing_tags
+    if is_promising and not already_tagged:
+        return {
+            'tags': "POTENTIAL",
+            'regular_desc': f"Potential candidate: Sharpe={sharpe}, Fitness={fitness}",
+        }
+    return None
+
+
+def lookup_cached_result(cache, expression, settings, row_index):
+    """
+    提交前查询结果缓存
+    
+    Returns:
+        tuple: 命中时返回 (success, alpha_id, check_result, row_index, is_data)，未命中或未启用缓存返回None
+    """
+    if cache is None:
+        return None
+    entry = cache.get(expression, settings)
+    if entry is None:
+        return None
+    print(f"[缓存] 命中，跳过仿真: {expression} -> {entry['alpha_id']} ({entry['check_result']})")
+    return entry['check_result'] == "SUCCESS", entry['alpha_id'], entry['check_result'], row_index, entry['is']
+
+
+def save_result_to_cache(cache, expression, settings, alpha_id, is_data, check_result):
+    """把最终检查结果写入结果缓存（"sleep" 等未完成的结果不缓存）"""
+    if cache is not None and check_result in CACHEABLE_CHECK_RESULTS:
+        cache.put(expression, settings, alpha_id, is_data, check_result)
+
+
+def report_result(feedback, row_index, is_data, check_result):
+    """
+    把一个alpha的最终结果反馈给任务队列（如 BanditTaskQueue.record），未启用时什么也不做
+    
+    引擎对每个alpha恰好调用一次（包括缓存命中、仿真失败等没有走完整流程的alpha），
+    且在取下一个任务之前调用，排序型任务队列可以据此决定下一个任务。
+    """
+    if feedback is None:
+        return
+    try:
+        feedback(row_index, is_data, check_result)
+    except Exception as e:
+        print(f"结果反馈时发生错误: {e}")
+
+
+def journal_submitted(journal, row_indexes, progress_url):
+    """提交成功后立即记录进度URL和提交账号，中断后重新运行时继续轮询而不是重新提交（journal为None时不记录）"""
+    if journal is not None:
+        journal.record_submitted(row_indexes, progress_url, current_account())
+
+
+def journal_stage(journal, row_index, stage, alpha_id=None, check_result=None):
+    """记录一行进入的处理阶段（journal为None时不记录）"""
+    if journal is not None:
+        journal.record_stage(row_index, stage, alpha_id, check_result)
+
+
+def resume_simulation(sess, resume, thread_id):
+    """
+    继续等待上次已提交、还没有拿到Alpha ID的仿真
+
+    Args:
+        sess: 会话对象
+        resume: resume_point() 的结果
+        thread_id: 线程名，用于日志
+
+    Returns:
+        alpha_id: Alpha ID，仿真失败时为None
+        resubmit: 进度URL已失效（服务端不再认识）或无权访问，需要重新提交
+        sess: 会话对象
+    """
+    stage, progress_url, batch_index, alpha_id, _ = resume
+    if stage != STAGE_SUBMITTED:
+        return alpha_id, False, sess
+    print(f"[线程 {thread_id}] 继续等待上次提交的仿真: {progress_url}")
+    probe, sess = requests_wq(sess, 'get', progress_url, pass_statuses=UNRESUMABLE_STATUSES)
+    if probe.status_code in UNRESUMABLE_STATUSES:
+        print(f"[线程 {thread_id}] 进度URL无法继续轮询 (HTTP {probe.status_code})，重新提交: {progress_url}")
+        return None, True, sess
+    body, sess = wait_for_simulation(sess, progress_url, record_metrics=False)
+    if body is None:
+        return None, True, sess
+    if batch_index >= 0:
+        # multi-simulation的父仿真：按提交时的位置取对应的子仿真
+        children = body.get("children", [])
+        if batch_index >= len(children):
+            print(f"[线程 {thread_id}] 批量仿真返回的子仿真数量 {len(children)} 不足，无法找到第 {batch_index + 1} 个")
+            return None, False, sess
+        body, sess = wait_for_simulation(sess, child_progress_url(children[batch_index]), record_metrics=False)
+        if body is None:
+            return None, True, sess
+    return extract_alpha_id(body), False, sess
+
+
+def print_alpha_metrics(is_data, thread_id):
+    """打印Alpha的IS指标"""
+    print(f"[线程 {thread_id}] Sharpe: {is_data.get('sharpe', 'N/A')}")
+    print(f"[线程 {thread_id}] Fitness: {is_data.get('fitness', 'N/A')}")
+    print(f"[线程 {thread_id}] Turnover: {is_data.get('turnover', 'N/A')}")
+    print(f"[线程 {thread_id}] Margin: {is_data.get('margin', 'N/A')}")
+    print(f"[线程 {thread_id}] Long Count: {is_data.get('longCount', 'N/A')}")
+    print(f"[线程 {thread_id}] Short Count: {is_data.get('shortCount', 'N/A')}")
+
+
+def screen_self_correlation(selfcorr, alpha_id, series, thread_id):
+    """
+    用本地参考集对alpha的PnL做自相关预筛
+    
+    Args:
+        selfcorr: SelfCorrelationFilter
+        alpha_id: Alpha ID
+        series: get_pnl / parse_pnl_recordset 的结果 (dates, daily_pnl)，None表示没有拿到PnL
+        thread_id: 线程名，用于日志
+    
+    Returns:
+        bool: 最大相关系数是否超过阈值（没有PnL或无法计算时为False，照常检查）
+    """
+    if series is None:
+        print(f"[线程 {thread_id}] Alpha {alpha_id}: 无法获取PnL，跳过自相关预筛")
+        return False
+    max_corr, ref_id = selfcorr.screen(alpha_id, *series)
+    if selfcorr.is_high(max_corr):
+        print(f"[线程 {thread_id}] ✗ Alpha {alpha_id} 与 {ref_id} 的自相关 {max_corr:.3f} 超过 {selfcorr.threshold}")
+        return True
+    if max_corr is not None:
+        print(f"[线程 {thread_id}] 最大自相关: {max_corr:.3f} ({ref_id})")
+    return False
+
+
+def finish_self_correlation(selfcorr, alpha_id, check_result):
+    """检查通过的alpha加入自相关参考集，其余的丢弃暂存的PnL"""
+    if selfcorr is None:
+        return
+    if check_result == "SUCCESS":
+        selfcorr.promote(alpha_id)
+    else:
+        selfcorr.discard(alpha_id)
+
+
+def check_and_tag_alpha(sess, alpha_id, thread_id, tagger=None, selfcorr=None, journal=None, row_index=None,
+                        resume=None):
+    """
+    对已仿真完成的alpha执行：获取指标、（自相关预筛、）回测检查、按结果打标签
+    
+    Args:
+        sess: 会话对象
+        alpha_id: Alpha ID
+        thread_id: 线程名，用于日志
+        tagger: TagQueue打标签队列，None表示当场打标签
+        selfcorr: SelfCorrelationFilter，None表示不做自相关预筛；预筛未通过时不做 /check，
+                  检查结果记为 HIGH_SELF_CORR
+        journal: 记录处理阶段的状态存储，None表示不记录
+        row_index: 行号（记录处理阶段用）
+        resume: resume_point() 的结果；上次已检查完成时不再检查，已打标签时不再打标签
+    
+    Returns:
+        check_result: 检查结果
+        is_data: Alpha信息中的 "is" 指标字典
+        sess: 会话对象
+    """
+    # 步骤2: 获取Alpha信息并显示指标（轮询直到IS指标就绪，已就绪时立即返回）
+    print(f"[线程 {thread_id}] [步骤2] 获取Alpha信息...")
+    alpha_info, sess = wait_for_alpha_info(sess, alpha_id)
+    # IS指标一直没有就绪时 alpha_info 为None，按没有指标继续（decide_alpha_tag 不会打标签）
+    alpha_info = alpha_info or {}
+    is_data = alpha_info.get("is") or {}
+    if alpha_info:
+        print_alpha_metrics(is_data, thread_id)
+    
+    stage = resume[0] if resume else None
+    if stage in (STAGE_CHECKED, STAGE_TAGGED):
+        # 上次已经检查完成：直接使用记录的检查结果
+        check_result = resume[4]
+        print(f"[线程 {thread_id}] 使用上次记录的检查结果: {check_result}")
+        if stage == STAGE_CHECKED:
+            sess = tag_alpha(sess, alpha_id, check_result, is_data, alpha_info.get("tags", []), thread_id, tagger)
+            journal_stage(journal, row_index, STAGE_TAGGED)
+        return check_result, is_data, sess
+    
+    # 本地自相关预筛：与参考集高度相关的alpha在服务端检查也会失败，不再占用 /check
+    if selfcorr is not None:
+        series, sess = get_pnl(sess, alpha_id)
+        if screen_self_correlation(selfcorr, alpha_id, series, thread_id):
+            selfcorr.discard(alpha_id)
+            journal_stage(journal, row_index, STAGE_CHECKED, check_result="HIGH_SELF_CORR")
+            return "HIGH_SELF_CORR", is_data, sess
+    
+    # 步骤3: 进行回测检查
+    print(f"[线程 {thread_id}] [步骤3] 进行回测检查...")
+    
+    # 检查数据未准备好时按自适应间隔重试，直到就绪或达到停止条件
+    check_result, sess = wait_for_check(sess, alpha_id, is_data=is_data)
+    journal_stage(journal, row_index, STAGE_CHECKED, check_result=check_result)
+    
+    # 步骤4: 根据检查结果处理
+    print(f"[线程 {thread_id}] [步骤4] 处理检查结果...")
+    existing_tags = alpha_info.get("tags", []) # 获取现有标签防止重复
+    
+    if check_result == "SUCCESS":
+        print(f"[线程 {thread_id}] ✓ Alpha {alpha_id} 检查通过！")
+    else:
+        print(f"[线程 {thread_id}] ✗ Alpha {alpha_id} 检查未通过")
+        print(f"[线程 {thread_id}] 检查结果: {check_result}")
+    
+    finish_self_correlation(selfcorr, alpha_id, check_result)
+    sess = tag_alpha(sess, alpha_id, check_result, is_data, existing_tags, thread_id, tagger)
+    journal_stage(journal, row_index, STAGE_TAGGED)
+    return check_result, is_data, sess
+
+
+def tag_alpha(sess, alpha_id, check_result, is_data, existing_tags, thread_id, tagger=None):
+    """
+    按 decide_alpha_tag 的结果为alpha打标签
+    
+    指定tagger时只把写入加入后台打标签队列，不发请求（sess可以为None），仿真线程不等待打标签。
+    
+    Returns:
+        sess: 会话对象
+    """
+    tag_kwargs = decide_alpha_tag(check_result, is_data, existing_tags)
+    if tag_kwargs and tagger is not None:
+        tagger.enqueue(alpha_id, **tag_kwargs)
+        print(f"[线程 {thread_id}] ✨ {tag_kwargs['tags']} 标签已加入打标签队列")
+    elif tag_kwargs:
+        tag = tag_kwargs['tags']
+        print(f"[线程 {thread_id}] ✨ 正在打上 {tag} 标签...")
+        response, sess = set_alpha_properties(sess, alpha_id, **tag_kwargs)
+        if response and response.status_code in (200, 201):
+            print(f"[线程 {thread_id}] ✓ 成功为Alpha {alpha_id} 打上 {tag} 标签")
+        else:
+            print(f"[线程 {thread_id}] 警告: {tag} 标签打标失败，状态码: {response.status_code if response else 'None'}")
+    return sess
+
+
+def process_single_alpha(alpha_row, row_index, index, total, pool, cache=None, tagger=None, selfcorr=None,
+                         journal=None):
+    """
+    处理单个alpha：仿真、回测、标记（线程安全版本）
+    
+    Args:
+        alpha_row: 一行alpha信息，可按列名取 'regular'、'settings'
+        row_index: 原始行号
+        index: 当前alpha在处理队列中的索引（从0开始）
+        total: 总待处理alpha数量
+        pool: SessionPool会话池，复用已登录的会话
+        cache: ResultCache结果缓存，None表示不使用缓存
+        tagger: TagQueue打标签队列，None表示当场打标签
+        selfcorr: SelfCorrelationFilter，None表示不做自相关预筛
+        journal: 记录处理阶段的状态存储（AlphaStateStore 或 RemoteQueue），None表示不记录；
+                 指定时上次已提交的行从记录的阶段继续，不再重新提交
+    
+    Returns:
+        tuple: (success: bool, alpha_id: str, check_result: str, row_index: int, is_data: dict)
+               is_data 是Alpha信息中的 "is" 指标，没有走到获取指标这一步时为None
+    """
+    thread_id = threading.current_thread().name
+    print("\n" + "=" * 80)
+    print(f"[线程 {thread_id}] 处理Alpha [{index + 1}/{total}]")
+    print("=" * 80)
+    print(f"[线程 {thread_id}] Alpha表达式: {alpha_row['regular']}")
+    
+    # 解析settings
+    settings = parse_settings(alpha_row['settings'])
+    if settings is None:
+        print(f"[线程 {thread_id}] 跳过Alpha [{index + 1}]: settings解析失败")
+        return False, None, "SETTINGS_ERROR", row_index, None
+    
+    # 上次已经提交的行从记录的阶段继续
+    resume = resume_point(alpha_row) if journal is not None else None
+    if resume is None:
+        # 相同表达式和设置已经仿真过，直接复用结果
+        cached = lookup_cached_result(cache, alpha_row['regular'], settings, row_index)
+        if cached:
+            return cached
+        
+        # 本地校验不通过的表达式不提交，不占用仿真名额
+        if not check_expression(alpha_row['regular']):
+            return False, None, "INVALID_EXPRESSION", row_index, None
+    
+    # 从会话池借用已登录的会话（requests.Session不是线程安全的，同一时刻只借给一个线程）
+    try:
+        sess = pool.acquire()
+    except Exception as e:
+        print(f"[线程 {thread_id}] 登录失败: {e}")
+        return False, None, "LOGIN_FAILED", row_index, None
+    
+    try:
+        alpha_id = None
+        if resume is not None:
+            print(f"[线程 {thread_id}] [断点续跑] 从上次记录的阶段继续: {resume[0]}")
+            alpha_id, resubmit, sess = resume_simulation(sess, resume, thread_id)
+            if resubmit:
+                print(f"[线程 {thread_id}] 上次的进度URL已失效，重新提交")
+                resume = None
+        if resume is None:
+            # 步骤1: 仿真Alpha
+            print(f"[线程 {thread_id}] [步骤1] 开始仿真Alpha...")
+            alpha_id, sess = simulate_alpha(
+                sess, alpha_row['regular'], settings, validate=False,
+                on_submitted=lambda url, _: journal_submitted(journal, [row_index], url)
+            )
+        
+        if not alpha_id:
+            print(f"[线程 {thread_id}] Alpha [{index + 1}] 仿真失败")
+            return False, None, "SIMULATION_FAILED", row_index, None
+        if resume is None or resume[0] == STAGE_SUBMITTED:
+            journal_stage(journal, row_index, STAGE_COMPLETED, alpha_id=alpha_id)
+        
+        check_result, is_data, sess = check_and_tag_alpha(sess, alpha_id, thread_id, tagger, selfcorr,
+                                                          journal, row_index, resume)
+        save_result_to_cache(cache, alpha_row['regular'], settings, alpha_id, is_data, check_result)
+        return check_result == "SUCCESS", alpha_id, check_result, row_index, is_data
+            
+    except Exception as e:
+        print(f"[线程 {thread_id}] 处理Alpha时发生错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return False, None, f"Exception: {str(e)}", row_index, None
+    finally:
+        pool.release(sess)
+
+
+def process_alpha_batch(batch, pool, cache=None, tagger=None, selfcorr=None, journal=None):
+    """
+    批量处理多个alpha：用一个multi-simulation请求提交整批，再逐个回测、标记
+    
+    Args:
+        batch: [(alpha_row, row_index, index, total), ...]，数量不超过 MAX_BATCH_SIZE
+        pool: SessionPool会话池
+        cache: ResultCache结果缓存，None表示不使用缓存
+        tagger: TagQueue打标签队列，None表示当场打标签
+        selfcorr: SelfCorrelationFilter，None表示不做自相关预筛
+        journal: 记录处理阶段的状态存储，None表示不记录；上次已提交的行逐个从记录的阶段继续
+    
+    Returns:
+        list: 每个alpha的 (success: bool, alpha_id: str, check_result: str, row_index: int, is_data: dict)
+    """
+    thread_id = threading.current_thread().name
+    first_index, total = batch[0][2], batch[0][3]
+    print("\n" + "=" * 80)
+    print(f"[线程 {thread_id}] 批量处理Alpha [{first_index + 1}-{first_index + len(batch)}/{total}]")
+    print("=" * 80)
+    
+    results = []
+    items = []  # (row_index, expression, settings)
+    for alpha_row, row_index, index, total in batch:
+        if journal is not None and resume_point(alpha_row) is not None:
+            results.append(process_single_alpha(alpha_row, row_index, index, total, pool,
+                                                cache, tagger, selfcorr, journal))
+            continue
+        settings = parse_settings(alpha_row['settings'])
+        if settings is None:
+            print(f"[线程 {thread_id}] 跳过Alpha [{index + 1}]: settings解析失败")
+            results.append((False, None, "SETTINGS_ERROR", row_index, None))
+            continue
+        cached = lookup_cached_result(cache, alpha_row['regular'], settings, row_index)
+        if cached:
+            results.append(cached)
+            continue
+        if not check_expression(alpha_row['regular']):
+            results.append((False, None, "INVALID_EXPRESSION", row_index, None))
+            continue
+        items.append((row_index, alpha_row['regular'], settings))
+    if not items:
+        return results
+    
+    try:
+        sess = pool.acquire()
+    except Exception as e:
+        print(f"[线程 {thread_id}] 登录失败: {e}")
+        return results + [(False, None, "LOGIN_FAILED", row_index, None) for row_index, _, _ in items]
+    
+    try:
+        # 步骤1: 一次请求批量仿真，子仿真按提交顺序映射回CSV行
+        print(f"[线程 {thread_id}] [步骤1] 开始批量仿真 {len(items)} 个Alpha...")
+        alpha_ids, sess = simulate_alpha_batch(
+            sess, [(expression, settings) for _, expression, settings in items], validate=False,
+            on_submitted=lambda url, indexes: journal_submitted(journal, [items[i][0] for i in indexes], url)
+        )
+        for (row_index, expression, settings), alpha_id in zip(items, alpha_ids):
+            if not alpha_id:
+                print(f"[线程 {thread_id}] Alpha仿真失败: {expression}")
+                results.append((False, None, "SIMULATION_FAILED", row_index, None))
+                continue
+            journal_stage(journal, row_index, STAGE_COMPLETED, alpha_id=alpha_id)
+            try:
+                check_result, is_data, sess = check_and_tag_alpha(sess, alpha_id, thread_id, tagger, selfcorr,
+                                                                  journal, row_index)
+                save_result_to_cache(cache, expression, settings, alpha_id, is_data, check_result)
+                results.append((check_result == "SUCCESS", alpha_id, check_result, row_index, is_data))
+            except Exception as e:
+                print(f"[线程 {thread_id}] 处理Alpha {alpha_id} 时发生错误: {e}")
+                results.append((False, None, f"Exception: {str(e)}", row_index, None))
+    except Exception as e:
+        print(f"[线程 {thread_id}] 批量仿真时发生错误: {e}")
+        import traceback
+        traceback.print_exc()
+        done = {result[3] for result in results}
+        results += [(False, None, f"Exception: {str(e)}", row_index, None)
+                    for row_index, _, _ in items if row_index not in done]
+    finally:
+        pool.release(sess)
+    return results
+
+
+def task_puller(tasks):
+    """
+    把任务来源统一成 pull(block)：返回下一个任务，任务取完时返回None；
+    block=False 且暂时没有可放出的任务时返回 NOT_READY（只有 FamilyPruningQueue 会这样）
+    """
+    if isinstance(tasks, FamilyPruningQueue):
+        return tasks.next_task
+    it = iter(tasks)
+    return lambda block=True: next(it, None)
+
+
+def take_batch(pull, batch_size, block=True):
+    """
+    取至多batch_size个任务：第一个按block取，其余不等待，凑不满一批就先返回已取到的部分
+    （剪枝队列中还没放出的行要等这一批的代表出结果，等它们凑满一批会永远等下去）
+
+    Returns:
+        list: 一批任务；[] 表示暂时没有可放出的任务（只在 block=False 时），None 表示任务已取完
+    """
+    first = pull(block)
+    if first is None:
+        return None
+    if first is NOT_READY:
+        return []
+    batch = [first]
+    while len(batch) < batch_size:
+        task = pull(False)
+        if task is None or task is NOT_READY:
+            break
+        batch.append(task)
+    return batch
+
+
+def iter_batches(tasks, batch_size):
+    """按顺序把任务切成至多batch_size个一组（tasks可以是列表或 BanditTaskQueue 等按需排序的迭代器）"""
+    pull = task_puller(tasks)
+    while True:
+        batch = take_batch(pull, batch_size)
+        if batch is None:
+            return
+        yield batch
+
+
+def run_threaded(tasks, pool, max_workers, batch_size=1, cache=None, feedback=None, tagger=None,
+                 selfcorr=None, journal=None):
+    """
+    每个线程从提交到打标签完整处理一个alpha（或一个批次）
+    
+    任务按需取出，同一时刻只有max_workers个在执行，
+    所以tasks为 BanditTaskQueue 时后面的任务能用上前面的结果重新排序。
+    取任务和反馈结果都在调用者的线程里，所以有任务在执行时取任务不阻塞：
+    FamilyPruningQueue 暂时没有可放出的任务时先等执行中的任务完成，反馈结果后再取。
+    
+    Args:
+        tasks: [(alpha_row, row_index, index, total), ...]，或按需给出任务的可迭代对象
+        pool: SessionPool会话池
+        max_workers: 线程数
+        batch_size: 每个multi-simulation请求包含的alpha数量
+        cache: ResultCache结果缓存，None表示不使用缓存
+        feedback: 结果回调 feedback(row_index, is_data, check_result)，None表示不回调
+        tagger: TagQueue打标签队列，None表示由处理alpha的线程当场打标签
+        selfcorr: SelfCorrelationFilter，None表示不做自相关预筛；预筛未通过的alpha不做 /check
+        journal: 记录处理阶段的状态存储，None表示不记录；指定时上次已提交的行从记录的阶段继续
+    
+    Yields:
+        tuple: (success, alpha_id, check_result, row_index, is_data)，按完成顺序
+    """
+    pull = task_puller(tasks)
+    batches = {}  # future -> 这个future处理的任务
+    exhausted = [False]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit_next():
+            # 只有没有任务在执行时才阻塞等待（这时也不会再有结果送来，剪枝队列不会一直阻塞）
+            batch = take_batch(pull, batch_size, block=not batches)
+            if batch is None:
+                exhausted[0] = True
+            if not batch:
+                return None
+            if batch_size > 1:
+                # 批量模式：每batch_size个alpha打包成一个multi-simulation请求
+                future = executor.submit(process_alpha_batch, batch, pool, cache, tagger, selfcorr, journal)
+            else:
+                alpha_row, row_index, idx, total = batch[0]
+                future = executor.submit(process_single_alpha, alpha_row, row_index, idx, total,
+                                         pool, cache, tagger, selfcorr, journal)
+            batches[future] = batch
+            return future
+        
+        def fill():
+            while len(batches) < max_workers and not exhausted[0]:
+                if submit_next() is None:
+                    return
+        
+        fill()
+        # 处理完成的任务，每完成一个再取下一个
+        while batches:
+            done, _ = wait(list(batches), return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = batches.pop(future)
+                try:
+                    results = future.result() if batch_size > 1 else [future.result()]
+                except Exception as e:
+                    print(f"\n处理任务时发生错误: {e}")
+                    import traceback
+                    traceback.print_exc()
+                    # 这一批的每一行都记一个失败结果，否则剪枝队列一直等这些行的结果
+                    results = [(False, None, f"Exception: {str(e)}", row_index, None)
+                               for _, row_index, _, _ in batch]
+                # 先反馈结果再取下一个任务
+                for success, alpha_id, check_result, row_index, is_data in results:
+                    report_result(feedback, row_index, is_data, check_result)
+                fill()
+                yield from results
+
+
+def run_scheduled(tasks, pool, max_workers, batch_size=1, cache=None, feedback=None, tagger=None,
+                  stage_workers=None, queue_size=DEFAULT_STAGE_QUEUE_SIZE, report_interval=None,
+                  selfcorr=None, selfcorr_mode='skip', journal=None, tuner=None):
+    """
+    用分阶段流水线处理alpha：提交 → 轮询 → 获取指标 →（下载PnL做自相关预筛 →）检查 → 打标签
+    
+    - 提交：在途仿真数量受服务端仿真名额（max_workers）限制，提交线程只负责发出POST
+    - 轮询：仿真进度URL交给PollScheduler，按Retry-After截止时间统一轮询，不占用其他阶段的线程
+    - 获取指标 / 检查 / 打标签：各自有独立的线程数，请求都经过进程级限流器；
+      未就绪时由调度器按自适应间隔定时放回本阶段的队列，等待期间不占用线程
+    阶段之间是有界队列，下游处理不过来时上游阻塞，直到提交阶段不再占用新的仿真名额。
+    
+    Args:
+        tasks: [(alpha_row, row_index, index, total), ...]，或按需给出任务的可迭代对象
+        pool: SessionPool会话池（大小至少为 scheduled_pool_size(stage_workers) 的结果）
+        max_workers: 同时在途的仿真请求数量上限（一个批次算一个），即服务端仿真名额
+        batch_size: 每个multi-simulation请求包含的alpha数量
+        cache: ResultCache结果缓存，None表示不使用缓存
+        feedback: 结果回调 feedback(row_index, is_data, check_result)，None表示不回调
+        tagger: TagQueue打标签队列，None表示由打标签阶段的线程当场打标签
+        stage_workers: 各阶段线程数 {'submit', 'poll', 'fetch', 'pnl', 'check', 'tag'}，未指定的取 DEFAULT_STAGE_WORKERS
+        queue_size: 阶段之间队列的容量
+        report_interval: 每隔多少秒打印一次各阶段队列深度，None表示不打印
+        selfcorr: SelfCorrelationFilter，None表示不做自相关预筛
+        selfcorr_mode: 预筛未通过时的处理方式，'skip' 不做 /check 直接记为 HIGH_SELF_CORR，
+                       'deprioritize' 照常检查，但排在检查阶段队列中其他alpha之后
+        journal: 记录处理阶段的状态存储（AlphaStateStore 或 RemoteQueue），None表示不记录；
+                 指定时每一步（提交、仿真完成、检查完成、打标签）立即写入，
+                 上次已提交的行从记录的阶段继续：进度URL交给调度器继续轮询，已有Alpha ID的直接获取指标
+        tuner: ConcurrencyTuner，None表示在途上限固定为 max_workers；指定时由它决定在途上限，
+               提交因名额已满或限流被拒绝时保留名额，按Retry-After重新提交
+    
+    Yields:
+        tuple: (success, alpha_id, check_result, row_index, is_data)，按完成顺序
+    """
+    sizes = dict(DEFAULT_STAGE_WORKERS, **(stage_workers or {}))
+    results = queue.Queue()
+    in_flight = tuner if tuner is not None else threading.BoundedSemaphore(max_workers)
+    stopping = threading.Event()
+    # 调度器的回调只做登记和入队，少量线程即可
+    dispatcher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='dispatch')
+    scheduler = PollScheduler(pool, dispatcher, max_concurrent_polls=sizes['poll']).start()
+    
+    def finish(row_index, success, alpha_id, check_result, is_data=None):
+        report_result(feedback, row_index, is_data, check_result)
+        results.put((success, alpha_id, check_result, row_index, is_data))
+    
+    def fail(items, e):
+        for row_index, _, _ in items:
+            finish(row_index, False, None, f"Exception: {str(e)}")
+    
+    def guarded(items, fn, *args):
+        """调度器回调出错时把对应的alpha记为失败，保证每个alpha都有结果"""
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"处理Alpha时发生错误: {e}")
+            import traceback
+            traceback.print_exc()
+            fail(items, e)
+    
+    def put_later(stage, delay, job, admitted=None, priority=0):
+        """
+        delay秒后由调度器把job放入stage的队列，等待期间不占用线程；
+        队列满时阻塞的是调度器的回调线程，阶段线程自己永远不会因为放回本阶段而阻塞。
+        admitted: job进入队列后的回调（用于释放仿真名额）
+        priority: 在stage队列中的优先级，数值越小越先处理
+        """
+        def enqueue():
+            try:
+                stage.put(job, priority)
+            finally:
+                if admitted is not None:
+                    admitted()
+        scheduler.call_later(max(0.0, delay), lambda: guarded([job[0]], enqueue))
+    
+    # 提交阶段：batch -> POST /simulations，进度URL交给调度器
+    # 提交阶段的job为 (batch, items)：items为None时是新取出的任务，否则是被拒绝后重新提交的alpha
+    def handle_submit(job):
+        batch, items = job
+        if items is None:
+            items = prepare_submit(batch)
+            if not items:
+                in_flight.release()
+                return
+        
+        payload = [
+            {'type': 'REGULAR', 'settings': settings, 'regular': expression}
+            for _, expression, settings in items
+        ]
+        try:
+            with pool.session() as sess, METRICS.timer('submit_seconds'):
+                sim_resp, sess = requests_wq(
+                    sess, 'post', f"{API_BASE}/simulations",
+                    json_data=payload if len(payload) > 1 else payload[0],
+                    pass_statuses=(429,) if tuner is not None else ()
+                )
+            if sim_resp.status_code == 429:
+                # 名额已满或被限流：调节在途上限，保留名额，Retry-After之后重新提交
+                retry_after = parse_retry_after(sim_resp.headers) or 1.0
+                if simulation_limit_exceeded(sim_resp):
+                    tuner.on_limit_exceeded()
+                else:
+                    RATE_LIMITER.on_throttle(retry_after)
+                    tuner.on_throttled()
+                scheduler.call_later(retry_after, lambda: guarded(items, submit_stage.put, (batch, items)))
+                return
+            sim_progress_url = sim_resp.headers.get('Location')
+            METRICS.inc('simulations_submitted_total', len(items), batch=str(len(items) > 1).lower())
+        except Exception as e:
+            print(f"提交仿真时发生错误: {e}")
+            sim_progress_url = None
+        if not sim_progress_url:
+            print("无法获取仿真进度URL")
+            in_flight.release()
+            for row_index, _, _ in items:
+                finish(row_index, False, None, "SIMULATION_FAILED")
+            return
+        if tuner is not None:
+            tuner.on_accepted()
+        print(f"[提交] {len(items)} 个Alpha已提交，进度URL: {sim_progress_url}")
+        journal_submitted(journal, [row_index for row_index, _, _ in items], sim_progress_url)
+        submitted_at = time.monotonic()
+        scheduler.watch(sim_progress_url,
+                        lambda resp: guarded(items, on_simulated, items, resp, submitted_at))
+    
+    def prepare_submit(batch):
+        """解析设置、查缓存、本地校验、断点续跑，返回需要提交的 [(row_index, expression, settings), ...]"""
+        items = []  # (row_index, expression, settings)
+        for alpha_row, row_index, index, total in batch:
+            settings = parse_settings(alpha_row['settings'])
+            if settings is None:
+                print(f"跳过Alpha [{index + 1}/{total}]: settings解析失败")
+                finish(row_index, False, None, "SETTINGS_ERROR")
+                continue
+            resume = resume_point(alpha_row) if journal is not None else None
+            if resume is not None:
+                # 进度URL失效时才重新提交
+                if not resume_alpha((row_index, alpha_row['regular'], settings), resume):
+                    items.append((row_index, alpha_row['regular'], settings))
+                continue
+            cached = lookup_cached_result(cache, alpha_row['regular'], settings, row_index)
+            if cached:
+                finish(row_index, *cached[:3], cached[4])
+                continue
+            if not check_expression(alpha_row['regular']):
+                finish(row_index, False, None, "INVALID_EXPRESSION")
+                continue
+            items.append((row_index, alpha_row['regular'], settings))
+        return items
+    
+    def resume_alpha(item, resume):
+        """
+        上次已提交的alpha从记录的阶段继续
+
+        Returns:
+            bool: False表示进度URL已失效或无权访问，需要重新提交
+        """
+        stage, progress_url, batch_index, alpha_id, check_result = resume
+        print(f"[断点续跑] 行 {item[0]} 从上次记录的阶段继续: {stage}")
+        if stage == STAGE_SUBMITTED:
+            with pool.session() as sess:
+                resp, sess = requests_wq(sess, 'get', progress_url, pass_statuses=UNRESUMABLE_STATUSES)
+            if resp.status_code in UNRESUMABLE_STATUSES:
+                print(f"[断点续跑] 进度URL已失效或无权访问 (HTTP {resp.status_code})，重新提交: {progress_url}")
+                return False
+            if batch_index >= 0:
+                scheduler.watch(progress_url,
+                                lambda resp: guarded([item], on_resumed_batch, item, batch_index, resp))
+            else:
+                scheduler.watch(progress_url, lambda resp: guarded(
+                    [item], on_alpha, item, extract_alpha_id(resp.json()) if resp is not None else None
+                ))
+        elif stage == STAGE_COMPLETED:
+            on_alpha(item, alpha_id)
+        else:
+            # 已经检查完成：重新获取指标后直接进入打标签阶段（已打过标签的不再打）
+            fetch_stage.put((item, alpha_id, 1, time.monotonic(), (stage, check_result)))
+        return True
+    
+    def on_resumed_batch(item, batch_index, resp):
+        body = resp.json() if resp is not None else None
+        children = body.get("children", []) if body else []
+        if batch_index >= len(children):
+            print(f"批量仿真返回的子仿真数量 {len(children)} 不足，无法找到第 {batch_index + 1} 个")
+            finish(item[0], False, None, "SIMULATION_FAILED")
+            return
+        watch_child(item, child_progress_url(children[batch_index]))
+    
+    def watch_child(item, url):
+        journal_submitted(journal, [item[0]], url)
+        scheduler.watch(url, lambda resp: guarded(
+            [item], on_alpha, item, extract_alpha_id(resp.json()) if resp is not None else None
+        ))
+    
+    def on_submit_error(job, e):
+        batch, _ = job
+        in_flight.release()
+        fail([(row_index, None, None) for _, row_index, _, _ in batch], e)
+    
+    # 轮询阶段（调度器回调）：仿真结束后把alpha交给获取指标阶段
+    def on_simulated(items, resp, submitted_at):
+        METRICS.observe('simulation_seconds', time.monotonic() - submitted_at)
+        if tuner is not None:
+            tuner.on_finished()
+        try:
+            body = resp.json() if resp is not None else None
+            alpha_id = extract_alpha_id(body) if body and len(items) == 1 else None
+        except Exception:
+            in_flight.release()
+            raise
+        if len(items) == 1:
+            # 获取指标阶段接收之后才释放仿真名额：下游积压时不再提交新的仿真
+            on_alpha(items[0], alpha_id, in_flight.release)
+            return
+        # 批量仿真：子仿真按提交顺序映射回CSV行，父仿真结束即释放名额
+        in_flight.release()
+        children = body.get("children", []) if body else []
+        if len(children) != len(items):
+            print(f"批量仿真返回的子仿真数量 {len(children)} 与提交数量 {len(items)} 不一致")
+            for row_index, _, _ in items:
+                finish(row_index, False, None, "SIMULATION_FAILED")
+            return
+        for item, child in zip(items, children):
+            watch_child(item, child_progress_url(child))
+    
+    def on_alpha(item, alpha_id, admitted=None):
+        row_index, expression, _ = item
+        if not alpha_id:
+            print(f"Alpha仿真失败: {expression}")
+            finish(row_index, False, None, "SIMULATION_FAILED")
+            if admitted is not None:
+                admitted()
+            return
+        journal_stage(journal, row_index, STAGE_COMPLETED, alpha_id=alpha_id)
+        put_later(fetch_stage, ALPHA_READINESS.first_delay(),
+                  (item, alpha_id, 1, time.monotonic(), None), admitted)
+    
+    # 获取指标阶段：GET /alphas/{id} 直到IS指标就绪
+    # resume 为 (阶段, 检查结果) 时是上次已检查完成、断点续跑的alpha
+    def handle_fetch(job):
+        item, alpha_id, attempt, started, resume = job
+        thread_id = threading.current_thread().name
+        with pool.session() as sess:
+            alpha_info, sess = get_alpha_info(sess, alpha_id)
+        elapsed = time.monotonic() - started
+        if alpha_info_ready(alpha_info):
+            ALPHA_READINESS.record_ready(elapsed)
+            METRICS.observe('alpha_ready_seconds', elapsed)
+        else:
+            delay = ALPHA_READINESS.next_delay(attempt, elapsed)
+            if delay is not None:
+                put_later(fetch_stage, delay, (item, alpha_id, attempt + 1, started, resume))
+                return
+            print(f"Alpha {alpha_id}: 等待 {elapsed:.0f} 秒后IS指标仍未就绪，放弃等待")
+        if alpha_info:
+            print_alpha_metrics(alpha_info.get("is", {}), thread_id)
+        if resume is not None:
+            stage, check_result = resume
+            tag_stage.put((item, alpha_id, alpha_info, check_result, stage == STAGE_TAGGED))
+            return
+        if pnl_stage is not None:
+            pnl_stage.put((item, alpha_id, alpha_info, time.monotonic()))
+            return
+        put_later(check_stage, CHECK_READINESS.first_delay(),
+                  (item, alpha_id, alpha_info, 1, time.monotonic(), 0))
+    
+    # 下载PnL阶段（启用自相关预筛时）：GET PnL记录集，生成中时按Retry-After由调度器定时放回队列
+    def handle_pnl(job):
+        item, alpha_id, alpha_info, started = job
+        thread_id = threading.current_thread().name
+        with pool.session() as sess, METRICS.timer('pnl_fetch_seconds'):
+            resp, sess = requests_wq(sess, 'get', pnl_recordset_url(alpha_id))
+        retry_after = float(resp.headers.get("Retry-After", 0))
+        series = None
+        if retry_after > 0:
+            if time.monotonic() - started + retry_after <= PNL_MAX_WAIT:
+                put_later(pnl_stage, retry_after, job)
+                return
+            print(f"Alpha {alpha_id}: PnL记录集 {PNL_MAX_WAIT:.0f} 秒内未生成，放弃")
+        else:
+            series = parse_pnl_recordset(resp.json())
+        priority = 0
+        if screen_self_correlation(selfcorr, alpha_id, series, thread_id):
+            if selfcorr_mode == 'skip':
+                selfcorr.discard(alpha_id)
+                journal_stage(journal, item[0], STAGE_CHECKED, check_result="HIGH_SELF_CORR")
+                tag_stage.put((item, alpha_id, alpha_info, "HIGH_SELF_CORR", False))
+                return
+            priority = 1
+        put_later(check_stage, CHECK_READINESS.first_delay(),
+                  (item, alpha_id, alpha_info, 1, time.monotonic(), priority))
+    
+    # 检查阶段：GET /alphas/{id}/check，Retry-After和未就绪都由调度器定时放回队列
+    def handle_check(job):
+        item, alpha_id, alpha_info, attempt, started, priority = job
+        with pool.session() as sess:
+            resp, sess = requests_wq(sess, 'get', f"{API_BASE}/alphas/{alpha_id}/check")
+        METRICS.inc('check_polls_total')
+        retry_after = float(resp.headers.get("Retry-After", 0))
+        if retry_after > 0:
+            put_later(check_stage, retry_after, job, priority=priority)
+            return
+        check_body = resp.json()
+        check_result = parse_check_result(alpha_id, check_body)
+        if alpha_info:
+            merge_check_details(alpha_info.setdefault("is", {}), check_body)
+        elapsed = time.monotonic() - started
+        if check_result == "sleep":
+            delay = CHECK_READINESS.next_delay(attempt, elapsed)
+            if delay is not None:
+                put_later(check_stage, delay, (item, alpha_id, alpha_info, attempt + 1, started, priority),
+                          priority=priority)
+                return
+            print(f"Alpha {alpha_id}: 等待 {elapsed:.0f} 秒后检查数据仍未准备好，放弃等待")
+        else:
+            CHECK_READINESS.record_ready(elapsed)
+        METRICS.observe('check_wait_seconds', elapsed)
+        METRICS.inc('check_results_total', result=result_label(check_result))
+        finish_self_correlation(selfcorr, alpha_id, check_result)
+        journal_stage(journal, item[0], STAGE_CHECKED, check_result=check_result)
+        tag_stage.put((item, alpha_id, alpha_info, check_result, False))
+    
+    # 打标签阶段：打标签（或加入后台打标签队列）、写缓存、给出结果；tagged 为上次已打过标签
+    def handle_tag(job):
+        item, alpha_id, alpha_info, check_result, tagged = job
+        row_index, expression, settings = item
+        thread_id = threading.current_thread().name
+        is_data = alpha_info.get("is", {}) if alpha_info else {}
+        existing_tags = alpha_info.get("tags", []) if alpha_info else []
+        if not tagged:
+            if tagger is not None:
+                tag_alpha(None, alpha_id, check_result, is_data, existing_tags, thread_id, tagger)
+            else:
+                with pool.session() as sess:
+                    tag_alpha(sess, alpha_id, check_result, is_data, existing_tags, thread_id)
+            journal_stage(journal, row_index, STAGE_TAGGED)
+        save_result_to_cache(cache, expression, settings, alpha_id, is_data, check_result)
+        finish(row_index, check_result == "SUCCESS", alpha_id, check_result, is_data)
+    
+    def on_job_error(job, e):
+        fail([job[0]], e)
+    
+    submit_stage = Stage('submit', handle_submit, sizes['submit'], queue_size, on_submit_error)
+    fetch_stage = Stage('fetch', handle_fetch, sizes['fetch'], queue_size, on_job_error)
+    pnl_stage = None
+    if selfcorr is not None:
+        pnl_stage = Stage('pnl', handle_pnl, sizes['pnl'], queue_size, on_job_error)
+    check_stage = Stage('check', handle_check, sizes['check'], queue_size, on_job_error)
+    tag_stage = Stage('tag', handle_tag, sizes['tag'], queue_size, on_job_error)
+    stages = [submit_stage, fetch_stage, pnl_stage, check_stage, tag_stage]
+    pipeline = Pipeline([stage for stage in stages if stage is not None],
+                        probes={'poll': scheduler.pending_count}).start(report_interval)
+    
+    submitted = [0]  # 已取出的alpha数量
+    
+    def submit_all():
+        batches = iter_batches(tasks, batch_size)
+        while True:
+            # 先占在途名额再取任务：排序型任务队列取出时才决定下一个，越晚取越能用上最新结果
+            in_flight.acquire()
+            if stopping.is_set():
+                return
+            batch = next(batches, None)
+            if batch is None:
+                results.put(None)  # 所有任务都已取出
+                return
+            submitted[0] += len(batch)
+            submit_stage.put((batch, None))
+    
+    submitter = threading.Thread(target=submit_all, name='submitter', daemon=True)
+    submitter.start()
+    try:
+        # 任务数由任务队列决定（剪枝队列事先不知道会发出多少个），取完后再等齐已取出任务的结果
+        received = 0
+        all_submitted = False
+        while not all_submitted or received < submitted[0]:
+            result = results.get()
+            if result is None:
+                all_submitted = True
+                continue
+            received += 1
+            yield result
+    finally:
+        stopping.set()
+        scheduler.stop()
+        pipeline.stop()
+        dispatcher.shutdown(wait=False, cancel_futures=True)
+
+
+def scheduled_pool_size(stage_workers=None, inline_tags=True, selfcorr=False):
+    """
+    run_scheduled 需要的会话数量：提交、轮询、获取指标、检查各阶段的线程数之和，
+    当场打标签时再加上打标签阶段的线程数，启用自相关预筛时再加上下载PnL阶段的线程数
+    """
+    sizes = dict(DEFAULT_STAGE_WORKERS, **(stage_workers or {}))
+    return (sizes['submit'] + sizes['poll'] + sizes['fetch'] + sizes['check']
+            + (sizes['tag'] if inline_tags else 0) + (sizes['pnl'] if selfcorr else 0))
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="从CSV读取alpha列表并发批量仿真和回测")
+    parser.add_argument('max_workers', nargs='?', type=int, default=3,
+                        help='并发数（默认3）；调度器模式下为同时在途的仿真数量（服务端仿真名额）')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help=f'每个multi-simulation请求包含的alpha数量（1~{MAX_BATCH_SIZE}，默认1即不批量）')
+    parser.add_argument('--csv', default=DEFAULT_CSV_PATH,
+                        help='待仿真alpha列表CSV路径')
+    parser.add_argument('--state-db', default=None,
+                        help='状态数据库路径（默认为 CSV路径 + .state.db）')
+    parser.add_argument('--cache', default=None,
+                        help='结果缓存数据库路径（默认为CSV所在目录下的 alpha_result_cache.db）')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='不使用结果缓存，所有alpha都重新仿真')
+    parser.add_argument('--threaded', action='store_true',
+                        help='每个线程完整处理一个alpha（旧模式），默认使用集中式轮询调度器')
+    for stage, default in DEFAULT_STAGE_WORKERS.items():
+        parser.add_argument(f'--{stage}-workers', type=int, default=default,
+                            help=f'调度器模式下 {stage} 阶段的线程数（默认{default}）')
+    parser.add_argument('--stage-queue-size', type=int, default=DEFAULT_STAGE_QUEUE_SIZE,
+                        help=f'调度器模式下阶段之间队列的容量（默认{DEFAULT_STAGE_QUEUE_SIZE}）')
+    parser.add_argument('--stage-report-interval', type=float, default=30.0,
+                        help='调度器模式下每隔多少秒打印各阶段队列深度（默认30，0表示不打印）')
+    parser.add_argument('--max-simulations', type=int, default=None,
+                        help='本次最多处理的alpha数量（每日仿真配额），默认全部')
+    parser.add_argument('--bandit', action='store_true',
+                        help='按槽位取值的历史 Sharpe/Fitness 动态排序待处理行（需要枚举时写入的 bindings 列）')
+    parser.add_argument('--bandit-exploration', type=float, default=0.5,
+                        help='老虎机UCB探索系数（默认0.5），越大越倾向于尝试样本少的取值')
+    parser.add_argument('--prune', choices=PRUNE_MODES, default=None,
+                        help='按族逐轮剪枝：每族先仿真一个代表，不达标时取消(cancel)或推迟(deprioritize)该族其余的行')
+    parser.add_argument('--family-by', default='company_fundamentals',
+                        help='逗号分隔的槽位名，取值相同的行属于同一族（默认 company_fundamentals）')
+    parser.add_argument('--prune-min-sharpe', type=float, default=0.5,
+                        help='族继续仿真所需的最低Sharpe（默认0.5）')
+    parser.add_argument('--prune-min-fitness', type=float, default=0.2,
+                        help='族继续仿真所需的最低Fitness（默认0.2）')
+    parser.add_argument('--tag-db', default=None,
+                        help='打标签队列数据库路径（默认为 CSV路径 + .tags.db）')
+    parser.add_argument('--inline-tags', action='store_true',
+                        help='由处理alpha的线程当场打标签（旧模式），默认交给后台打标签队列')
+    parser.add_argument('--selfcorr', choices=SELFCORR_MODES, default=None,
+                        help='本地自相关预筛：与已提交/检查通过的alpha的PnL相关系数过高时跳过(skip)或推迟(deprioritize) /check；'
+                             '逐线程模式只支持skip')
+    parser.add_argument('--selfcorr-threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'自相关阈值（默认{DEFAULT_THRESHOLD}）')
+    parser.add_argument('--recordset-cache', default=None,
+                        help='日度序列（PnL等）缓存目录（默认为CSV所在目录下的 .recordset_cache）')
+    parser.add_argument('--warehouse', default=None,
+                        help='列式结果仓库目录（默认为CSV所在目录下的 results_warehouse）')
+    parser.add_argument('--no-warehouse', action='store_true',
+                        help='不把结果写入列式结果仓库')
+    parser.add_argument('--queue', default=None,
+                        help='从共享工作队列按租约领取alpha：协调进程地址（见 work_queue.py serve）或状态数据库路径；'
+                             '多个runner各用自己的账号（环境变量 WQ_CREDENTIALS）')
+    parser.add_argument('--queue-token', default=os.environ.get('WQ_QUEUE_TOKEN'),
+                        help='协调进程的访问令牌（默认取环境变量 WQ_QUEUE_TOKEN）')
+    parser.add_argument('--worker-id', default=None,
+                        help='本runner的租约持有者ID（默认 主机名-进程号）')
+    parser.add_argument('--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS,
+                        help=f'租约时长秒数（默认{DEFAULT_LEASE_SECONDS:.0f}），runner崩溃后其租约到期即被其他runner领取')
+    parser.add_argument('--max-rate', type=float, default=None,
+                        help='本进程的请求速率上限（请求/秒），多个runner共用一个账号时按账号额度分配')
+    parser.add_argument('--autotune', action='store_true',
+                        help='运行中自动调节在途仿真数量上限（max_workers作为初始值），'
+                             '提交成功时向上试探，名额已满或被限流时回退')
+    parser.add_argument('--autotune-max', type=int, default=DEFAULT_MAX_LIMIT,
+                        help=f'自动调节时在途上限的最大值（默认{DEFAULT_MAX_LIMIT}）')
+    parser.add_argument('--autotune-log', default=None,
+                        help='把每次调节（时间、原因、调整前后的上限）追加写入该JSON-lines文件')
+    parser.add_argument('--ready-max-wait', type=float, default=None,
+                        help='等待alpha信息/检查结果就绪的最长秒数，超过后放弃（默认分别为120/300）')
+    parser.add_argument('--ready-max-attempts', type=int, default=None,
+                        help='等待就绪时最多轮询的次数（默认不限）')
+    parser.add_argument('--ready-min-interval', type=float, default=None,
+                        help='未就绪时第一次重试的间隔秒数（默认分别为1/2）')
+    parser.add_argument('--metrics-jsonl', default=None,
+                        help='定期把指标快照追加写入该JSON-lines文件')
+    parser.add_argument('--metrics-interval', type=float, default=60.0,
+                        help='写入指标快照的间隔秒数（默认60）')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='在该端口提供Prometheus格式的 /metrics')
+    parser.add_argument('--metrics-host', default='127.0.0.1',
+                        help='Prometheus端点监听的地址（默认127.0.0.1，只允许本机访问；0.0.0.0 为所有网卡）')
+    return parser.parse_args()
+
+
+def main():
+    """主函数：从CSV读取alpha列表并并发批量处理"""
+    print("=" * 80)
+    print("Alpha批量仿真和回测脚本（从CSV读取）- 并发版本")
+    print(f"开始时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 80)
+    
+    args = parse_args()
+    # 并发数量（可以在命令行参数中指定，默认3）
+    max_workers = args.max_workers
+    batch_size = args.batch_size
+    if not 1 <= batch_size <= MAX_BATCH_SIZE:
+        print(f"错误: --batch-size 必须在 1~{MAX_BATCH_SIZE} 之间")
+        return
+    if args.autotune and args.threaded:
+        print("错误: --autotune 只支持分阶段调度（不能与 --threaded 同时使用）")
+        return
+    
+    print(f"并发数量: {max_workers}")
+    # 就绪轮询的停止条件和间隔（未指定的保持默认值）
+    ready_options = {key: value for key, value in (
+        ('max_wait', args.ready_max_wait),
+        ('max_attempts', args.ready_max_attempts),
+        ('min_interval', args.ready_min_interval),
+    ) if value is not None}
+    for policy in (ALPHA_READINESS, CHECK_READINESS):
+        policy.configure(**ready_options)
+    if batch_size > 1:
+        print(f"批量仿真: 每个请求 {batch_size} 个Alpha")
+    
+    if args.max_rate is not None:
+        RATE_LIMITER.max_rate = args.max_rate
+        RATE_LIMITER.rate = min(RATE_LIMITER.rate, args.max_rate)
+        print(f"请求速率上限: {args.max_rate} 请求/秒")
+    
+    # CSV文件路径（共享工作队列模式下只用来确定本地缓存、结果仓库等文件的位置）
+    csv_path = args.csv
+    
+    if args.queue:
+        if args.bandit or args.prune:
+            print("错误: --queue 不能与 --bandit、--prune 同时使用（它们需要在本地看到全部待处理行）")
+            return
+        # 共享工作队列：由协调进程或共用的状态数据库持有全部行，本runner按租约领取
+        store = open_queue(args.queue, token=args.queue_token)
+        print(f"\n共享工作队列: {store.db_path}")
+    else:
+        if not os.path.exists(csv_path):
+            print(f"错误: CSV文件不存在: {csv_path}")
+            return
+        
+        # 加载alpha列表：CSV中新增的行导入状态数据库，已有的行以数据库中的状态为准
+        store = AlphaStateStore(args.state_db or default_db_path(csv_path))
+        print(f"\n加载Alpha列表: {csv_path}")
+        try:
+            imported = store.import_csv(csv_path)
+        except ValueError as e:
+            print(f"错误: {e}")
+            store.close()
+            return
+        print(f"新导入 {imported} 个Alpha，状态数据库: {store.db_path}")
+    
+    # 统计状态
+    status_counts = store.status_counts()
+    print(f"总共 {sum(status_counts.values())} 个Alpha")
+    print("\n当前状态统计:")
+    for status, count in status_counts.items():
+        print(f"  {status}: {count}")
+    
+    # 待处理的alpha（状态为PENDING或空）只在这里计数，行在取出时才从状态数据库读出
+    pending_total = store.pending_count()
+    
+    if pending_total == 0:
+        print("\n没有待处理的Alpha，程序退出")
+        store.close()
+        return
+    
+    print(f"\n待处理的Alpha数量: {pending_total}")
+    in_flight_total = store.in_flight_count()
+    if in_flight_total:
+        print(f"其中 {in_flight_total} 个上次已提交，从记录的阶段继续（不重新提交仿真）")
+    if args.bandit and args.prune:
+        print("错误: --bandit 和 --prune 不能同时使用")
+        store.close()
+        return
+    
+    # 准备任务：按需取出行，结果写回后丢弃，内存只随在途的alpha数量增长，与待处理行数无关
+    # 调度顺序：默认按行号；--bandit 时按槽位取值的得分动态排序，只取配额内的行
+    bandit = None
+    feedback = None
+    pruning = None
+    leased = None
+    if args.queue:
+        # 有空闲名额时才领取下一行，领取到的行由后台线程续租
+        leased = LeasedTaskQueue(store, owner=args.worker_id or default_owner(),
+                                 lease_seconds=args.lease_seconds, prefetch=batch_size,
+                                 max_tasks=args.max_simulations, account=current_account())
+        task_queue = leased
+        print(f"租约领取: runner {leased.owner}，租约 {args.lease_seconds:.0f} 秒")
+    else:
+        # --bandit / --prune 要看到全部待处理行才能排序、分族，由它们限制处理数量
+        task_queue = PendingTaskQueue(store, max_tasks=None if args.bandit or args.prune else args.max_simulations)
+    tasks = task_queue
+    # 已取出、尚未写回结果的行，结果仓库按行号查原始行
+    rows_by_id = task_queue.rows
+    if args.prune:
+        pruning = FamilyPruningQueue(
+            list(task_queue), args.family_by.split(','), min_sharpe=args.prune_min_sharpe,
+            min_fitness=args.prune_min_fitness, mode=args.prune, max_tasks=args.max_simulations
+        )
+        tasks = pruning
+        feedback = pruning.record
+        print(f"族剪枝({args.prune}): {len(task_queue)} 个Alpha分为 {pruning.family_count} 个族")
+    elif args.bandit:
+        bandit = SlotBandit.load(default_bandit_path(csv_path), exploration=args.bandit_exploration)
+        tasks = BanditTaskQueue(list(task_queue), bandit, max_tasks=args.max_simulations)
+        feedback = tasks.record
+        print(f"老虎机调度: 已有 {bandit.total} 次观测，本次处理 {len(tasks)} 个Alpha")
+    elif args.max_simulations is not None:
+        print(f"本次处理前 {len(tasks)} 个Alpha")
+    
+    # 结果缓存：相同表达式和设置的alpha只仿真一次
+    cache = None if args.no_cache else ResultCache(args.cache or default_cache_path(csv_path))
+    
+    # 列式结果仓库：每个结果的IS指标、各项检查、槽位取值按类型保存，本次运行为一个分区
+    warehouse = None
+    if not args.no_warehouse:
+        # 多个runner共用一个仓库目录时按runner区分分区
+        run_id = None
+        if leased is not None:
+            run_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{leased.owner}"
+        warehouse = ResultsWarehouse(args.warehouse or default_warehouse_dir(csv_path), run_id=run_id)
+        print(f"结果仓库: {warehouse.run_dir}")
+    
+    success_count = 0
+    fail_count = 0
+    completed_count = 0
+    
+    # 指标导出：JSON-lines快照 和/或 Prometheus端点
+    exporter = None
+    if args.metrics_jsonl:
+        exporter = JsonLinesExporter(args.metrics_jsonl, args.metrics_interval).start()
+    metrics_server = start_prometheus_server(args.metrics_port, args.metrics_host) if args.metrics_port else None
+    
+    tuner = None
+    if args.autotune:
+        tuner = ConcurrencyTuner(initial=max_workers, max_limit=max(max_workers, args.autotune_max),
+                                 log_path=args.autotune_log)
+        print(f"\n开始并发处理（在途上限从{max_workers}开始自动调节，最多{tuner.max_limit}）...")
+    else:
+        print(f"\n开始并发处理（最多{max_workers}个并发）...")
+    
+    # 会话池：每个会话只登录一次，在任务之间复用（后台打标签线程额外占一个会话）
+    tag_sessions = 0 if args.inline_tags else 1
+    if args.threaded:
+        # 每个线程从头到尾处理一个alpha
+        pool = SessionPool(size=max_workers + tag_sessions)
+    else:
+        # 分阶段流水线：每个阶段按自己的瓶颈单独设置线程数
+        stage_workers = {stage: getattr(args, f'{stage}_workers') for stage in DEFAULT_STAGE_WORKERS}
+        print("各阶段线程数: " + ', '.join(f"{stage}={n}" for stage, n in stage_workers.items()))
+        pool = SessionPool(size=scheduled_pool_size(stage_workers, args.inline_tags, bool(args.selfcorr))
+                           + tag_sessions)
+    # 运算符目录：缓存过期时从 /operators 重新获取，提交前的本地校验以服务端的运算符为准
+    OperatorCatalog().get(pool)
+    # 打标签队列：标签写入持久化后由后台线程发送，上次未发送完的写入也会继续发送
+    tagger = None
+    if not args.inline_tags:
+        tagger = TagQueue(args.tag_db or default_tag_db_path(csv_path), pool).start()
+    # 自相关预筛：参考集为已提交的alpha和状态数据库中检查通过的alpha，PnL缓存在本地
+    selfcorr = None
+    recordsets = None
+    if args.selfcorr:
+        if args.threaded and args.selfcorr == 'deprioritize':
+            print("逐线程模式不支持推迟检查，自相关预筛按 skip 处理")
+        recordsets = RecordsetCache(args.recordset_cache or default_recordset_cache_dir(csv_path))
+        selfcorr = SelfCorrelationFilter(recordsets, threshold=args.selfcorr_threshold)
+        selfcorr.refresh(pool, extra_alpha_ids=store.alpha_ids('SUCCESS'))
+    # 内存：启动完成时和处理中的最高值，正常情况下只随在途alpha数量变化，与待处理行数无关
+    startup_rss = peak_rss = rss_bytes()
+    if startup_rss is not None:
+        METRICS.set_gauge('process_rss_bytes', startup_rss)
+        print(f"启动完成，进程内存 {startup_rss / 2**20:.1f} MB")
+    if args.threaded:
+        results = run_threaded(tasks, pool, max_workers, batch_size, cache, feedback, tagger, selfcorr, store)
+    else:
+        results = run_scheduled(tasks, pool, max_workers, batch_size, cache, feedback, tagger,
+                                stage_workers, args.stage_queue_size, args.stage_report_interval or None,
+                                selfcorr, args.selfcorr or 'skip', store, tuner)
+    
+    try:
+        for success, alpha_id, check_result, row_index, is_data in results:
+            # 每完成一个alpha只写一行（单行事务），不再重写整个CSV
+            store.record_result(row_index, success, alpha_id, check_result)
+            if warehouse is not None:
+                warehouse.record(rows_by_id[row_index], 'SUCCESS' if success else 'FAILED',
+                                 alpha_id, check_result, is_data)
+            task_queue.finish(row_index)
+            if startup_rss is not None:
+                rss = rss_bytes()
+                peak_rss = max(peak_rss, rss)
+                METRICS.set_gauge('process_rss_bytes', rss)
+            METRICS.inc('alphas_processed_total', result=result_label(check_result))
+            if pruning is not None:
+                for pruned_row, status, detail in pruning.drain_pruned():
+                    store.record_skipped(pruned_row, status, detail)
+                    if warehouse is not None:
+                        warehouse.record(rows_by_id[pruned_row], status, check_result=detail)
+                    task_queue.finish(pruned_row)
+            completed_count += 1
+            if success:
+                success_count += 1
+            else:
+                fail_count += 1
+            
+            print(f"\n[进度] 已完成 {completed_count}/{len(tasks)} 个Alpha (成功: {success_count}, 失败: {fail_count})")
+                    
+    except KeyboardInterrupt:
+        print("\n\n用户中断，进度已保存在状态数据库中（已提交的仿真下次从记录的阶段继续），程序退出")
+        return
+    finally:
+        results.close()
+        if leased is not None:
+            leased.close()
+            if leased.lost:
+                print(f"工作队列: {leased.lost} 个行的租约曾过期，可能已被其他runner重复处理")
+        if tagger is not None:
+            print("\n等待打标签队列发送剩余的写入...")
+            tagger.close()
+            print(f"打标签队列: 发送 {tagger.sent} 个，失败 {tagger.failed} 次")
+        pool.close()
+        if recordsets is not None:
+            recordsets.close()
+        # 导出回CSV，保持与旧格式兼容（共享工作队列由协调进程导出）
+        if leased is None:
+            with csv_lock:
+                store.export_csv(csv_path)
+        store.close()
+        if warehouse is not None:
+            warehouse.close()
+            print(f"结果仓库: 本次写入 {warehouse.written} 行，{warehouse.run_dir}")
+        if cache is not None:
+            stats = cache.stats()
+            print(f"结果缓存: 命中 {stats['hits']}，未命中 {stats['misses']}，共 {stats['entries']} 个条目")
+            cache.close()
+        if pruning is not None:
+            print(f"\n族剪枝: 共取消 {pruning.pruned_count} 个Alpha")
+        if bandit is not None:
+            bandit.save()
+            print("\n老虎机得分最高的槽位取值:")
+            for arm, count, mean in bandit.top_arms():
+                print(f"  {arm}: 平均奖励 {mean:.3f} ({count} 次)")
+        if tuner is not None:
+            print(f"\n并发调节: {tuner.summary()}")
+            tuner.close()
+        if exporter is not None:
+            exporter.stop()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if startup_rss is not None:
+            print(f"\n进程内存: 启动完成 {startup_rss / 2**20:.1f} MB，处理中最高 {peak_rss / 2**20:.1f} MB")
+        print("\n指标摘要:")
+        print(METRICS.summary())
+    
+    # 最终统计
+    print("\n" + "=" * 80)
+    print("处理完成！")
+    print("=" * 80)
+    print(f"成功: {success_count}")
+    print(f"失败: {fail_count}")
+    print(f"完成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    # 支持命令行参数指定并发数
+    # 用法: python alpha_batch_simulate_from_csv.py [并发数] [--batch-size N] [--csv PATH]
+    # 例如: python alpha_batch_simulate_from_csv.py 3 --batch-size 10
+    main()
@@ -0,0 +1,689 @@
+# Alpha状态存储（SQLite WAL）
+# 功能：每个alpha的状态变化作为单行事务写入SQLite，替代每完成一个alpha就重写整个CSV；
+#      断点续跑和状态统计走带索引的查询，不需要把整张表读进pandas。
+#      CSV仍然是导入/导出格式：启动时导入CSV中新增的行，结束或中断时导出回CSV。
+#      已导入的行按内容指纹与CSV核对，CSV被重新生成时拒绝导入；导出前CSV被改动过时先备份原文件。
+#      多个runner共享同一批待处理行时按租约领取（claim/heartbeat/release，见 work_queue.py），
+#      租约过期的行自动回到可领取状态。
+#      仿真中的alpha每到一步（提交、仿真完成、检查完成、打标签）立即记录进度URL和阶段，
+#      进程崩溃或中断后重新运行时从最后记录的一步继续（resume_point），不再重新提交仿真。
+#      待处理的行按行号分块读出（iter_pending / PendingTaskQueue），每行是紧凑的 TaskRecord，
+#      内存中只保留正在处理的行，与待处理行的总数无关。
+import csv
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+# CSV中由状态存储单独建列的字段，其余列原样保存在extra中
+CSV_COLUMNS = ['type', 'settings', 'regular', 'status', 'alpha_id', 'check_result', 'completed_time']
+
+# 视为待处理的状态
+PENDING_STATUSES = ('PENDING', '')
+
+# 处理中的alpha的阶段：已提交（记录进度URL）→ 仿真完成（记录Alpha ID）→ 检查完成（记录检查结果）→ 已打标签
+STAGE_SUBMITTED = 'submitted'
+STAGE_COMPLETED = 'completed'
+STAGE_CHECKED = 'checked'
+STAGE_TAGGED = 'tagged'
+
+# 租约、处理阶段和CSV核对相关的列（旧数据库打开时自动补上）
+# content_key: type/settings/regular 的内容指纹；csv_status: 上次导入/导出时CSV中的状态，NULL表示未知
+LEASE_COLUMNS = {
+    'lease_owner': "TEXT DEFAULT ''",
+    'lease_expires': 'REAL DEFAULT 0',
+    'attempts': 'INTEGER DEFAULT 0',
+    'stage': "TEXT DEFAULT ''",
+    'progress_url': "TEXT DEFAULT ''",
+    'batch_index': 'INTEGER DEFAULT -1',
+    'stage_time': "TEXT DEFAULT ''",
+    'submit_account': "TEXT DEFAULT ''",
+    'content_key': "TEXT DEFAULT ''",
+    'csv_status': 'TEXT DEFAULT NULL',
+}
+
+# pending() / claim() 返回的列：原始行和断点续跑所需的阶段信息
+TASK_FIELDS = ('row_id', 'type', 'settings', 'regular', 'extra',
+               'stage', 'progress_url', 'batch_index', 'alpha_id', 'check_result', 'submit_account')
+TASK_COLUMNS = ', '.join(TASK_FIELDS)
+
+# iter_pending() 每次从数据库读出的行数
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def content_key(type_, settings, regular):
+    """一行alpha的内容指纹，用于确认CSV中某个行号的行仍然是导入数据库时的那个alpha"""
+    payload = json.dumps([type_ or '', settings or '', regular or ''], ensure_ascii=False)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class TaskRecord:
+    """
+    待处理的一行（__slots__，不带 sqlite3.Row / dict 的额外开销）
+
+    与 sqlite3.Row 一样可以按列名取值（record['regular']）和调用 keys()，
+    所以处理函数、resume_point、结果仓库不区分行的来源。
+    """
+
+    __slots__ = TASK_FIELDS
+
+    def __init__(self, *values):
+        for name, value in zip(TASK_FIELDS, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        """sqlite3 的 row_factory：type/settings 在同一批模板展开的行之间大量重复，驻留为同一个字符串"""
+        row_id, type_, settings, *rest = row
+        return cls(row_id, sys.intern(type_ or ''), sys.intern(settings or ''), *rest)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def keys(self):
+        return TASK_FIELDS
+
+    def __repr__(self):
+        return f"TaskRecord(row_id={self.row_id}, regular={self.regular!r})"
+
+
+class AlphaStateStore:
+    """
+    基于SQLite的alpha状态存储（线程安全）
+
+    row_id 与CSV中的行号（从0开始，不含表头）一一对应。
+
+    用法:
+        store = AlphaStateStore(csv_path + '.state.db')
+        store.import_csv(csv_path)
+        for row in store.iter_pending():
+            ...
+            store.record_result(row['row_id'], success, alpha_id, check_result)
+        store.export_csv(csv_path)
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS alphas (
+                row_id INTEGER PRIMARY KEY,
+                type TEXT,
+                settings TEXT,
+                regular TEXT,
+                status TEXT DEFAULT 'PENDING',
+                alpha_id TEXT DEFAULT '',
+                check_result TEXT DEFAULT '',
+                completed_time TEXT DEFAULT '',
+                extra TEXT DEFAULT '{}'
+            );
+            CREATE INDEX IF NOT EXISTS idx_alphas_status ON alphas(status);
+        """)
+        existing = {row['name'] for row in self._conn.execute("PRAGMA table_info(alphas)")}
+        for column, definition in LEASE_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE alphas ADD COLUMN {column} {definition}")
+        if 'content_key' not in existing:
+            self._backfill_content_keys()
+
+    def _backfill_content_keys(self):
+        """旧数据库没有内容指纹：按已保存的 type/settings/regular 补上"""
+        self._conn.execute("BEGIN")
+        try:
+            last_row_id = -1
+            while True:
+                chunk = self._conn.execute(
+                    "SELECT row_id, type, settings, regular FROM alphas WHERE row_id > ? ORDER BY row_id LIMIT ?",
+                    (last_row_id, DEFAULT_CHUNK_SIZE)
+                ).fetchall()
+                if not chunk:
+                    break
+                self._conn.executemany(
+                    "UPDATE alphas SET content_key = ? WHERE row_id = ?",
+                    [(content_key(row['type'], row['settings'], row['regular']), row['row_id']) for row in chunk]
+                )
+                last_row_id = chunk[-1]['row_id']
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def import_csv(self, csv_path):
+        """
+        导入CSV中尚未进入数据库的行（按行号增量导入），并核对已经导入的行
+
+        枚举脚本以追加方式写CSV，所以行号不小于已导入行数的行就是新增的行。
+        已导入的行按内容指纹与数据库中同一行号的行核对：CSV被重新生成、改动了已有的行或比已导入的行少时
+        拒绝导入，否则数据库中的旧行会被当作CSV中的行继续处理，导出时覆盖掉CSV中新的行。
+        核对一致的行以数据库中的状态为准；状态列在CSV中被手动改过（与上次导入/导出时不同，
+        如改回PENDING重新仿真）的行以CSV为准。
+
+        Returns:
+            int: 新导入的行数
+
+        Raises:
+            ValueError: CSV缺少必要的列，或已导入的行与CSV不一致
+        """
+        imported = 0
+        batch = []
+        edits = []
+        unknown = []
+        stored = self._iter_csv_state()
+        with open(csv_path, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            for col in ('type', 'settings', 'regular'):
+                if col not in (reader.fieldnames or []):
+                    raise ValueError(f"CSV文件缺少必要的列: {col}")
+            for row_id, row in enumerate(reader):
+                key = content_key(row['type'], row['settings'], row['regular'])
+                status = row.get('status') or ''
+                record = next(stored, None)
+                if record is not None:
+                    if record['content_key'] != key:
+                        raise ValueError(
+                            f"CSV中行号 {row_id} 的alpha与状态数据库 {self.db_path} 中记录的不一致"
+                            f"（CSV被重新生成或改动了已导入的行）；请恢复原CSV，或用 --state-db 指定新的状态数据库"
+                        )
+                    if record['csv_status'] is None:
+                        unknown.append((status, row_id))
+                        if len(unknown) >= 10000:
+                            self._set_csv_status(unknown)
+                            unknown = []
+                    elif status != record['csv_status']:
+                        edits.append((status or 'PENDING', row.get('alpha_id') or '', row.get('check_result') or '',
+                                      row.get('completed_time') or '', status, row_id))
+                    continue
+                extra = {k: v for k, v in row.items() if k not in CSV_COLUMNS and k is not None}
+                batch.append((
+                    row_id, row['type'], row['settings'], row['regular'],
+                    status or 'PENDING', row.get('alpha_id') or '',
+                    row.get('check_result') or '', row.get('completed_time') or '',
+                    json.dumps(extra, ensure_ascii=False), key, status,
+                ))
+                if len(batch) >= 10000:
+                    imported += self._insert_rows(batch)
+                    batch = []
+        if next(stored, None) is not None:
+            raise ValueError(
+                f"CSV中的行比状态数据库 {self.db_path} 中已导入的少（CSV被截断或重新生成）；"
+                f"请恢复原CSV，或用 --state-db 指定新的状态数据库"
+            )
+        self._set_csv_status(unknown)
+        if edits:
+            self._apply_status_edits(edits)
+            print(f"CSV中 {len(edits)} 个已导入的行的状态被手动修改，以CSV为准")
+        imported += self._insert_rows(batch)
+        return imported
+
+    def _iter_csv_state(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """按行号顺序逐行给出 (row_id, content_key, csv_status)，每次从数据库读出chunk_size行"""
+        last_row_id = -1
+        while True:
+            with self._lock:
+                chunk = self._conn.execute(
+                    "SELECT row_id, content_key, csv_status FROM alphas WHERE row_id > ? ORDER BY row_id LIMIT ?",
+                    (last_row_id, chunk_size)
+                ).fetchall()
+            if not chunk:
+                return
+            yield from chunk
+            last_row_id = chunk[-1]['row_id']
+
+    def _set_csv_status(self, updates):
+        """记录CSV中各行当前的状态 [(csv_status, row_id)]"""
+        if not updates:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("UPDATE alphas SET csv_status = ? WHERE row_id = ?", updates)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _apply_status_edits(self, edits):
+        """
+        按CSV中手动修改的状态更新行，清除处理阶段（改回待处理的行从头重新提交）
+
+        Args:
+            edits: [(status, alpha_id, check_result, completed_time, csv_status, row_id)]
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "UPDATE alphas SET status = ?, alpha_id = ?, check_result = ?, completed_time = ?, "
+                    "csv_status = ?, stage = '', progress_url = '', batch_index = -1, submit_account = '' "
+                    "WHERE row_id = ?",
+                    edits
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _insert_rows(self, batch):
+        if not batch:
+            return 0
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT INTO alphas (row_id, type, settings, regular, status, alpha_id, "
+                    "check_result, completed_time, extra, content_key, csv_status) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    batch
+                )
+        return len(batch)
+
+    def csv_in_sync(self, csv_path):
+        """
+        CSV是否仍与上次导入/导出时一致：行数相同、每行内容指纹相同、状态列没有被修改
+
+        CSV在导入后被重新生成、追加了尚未导入的行或手动改了状态时返回False。
+        """
+        stored = self._iter_csv_state()
+        with open(csv_path, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            if not {'type', 'settings', 'regular'} <= set(reader.fieldnames or []):
+                return False
+            for row in reader:
+                record = next(stored, None)
+                if record is None or record['content_key'] != content_key(row['type'], row['settings'], row['regular']):
+                    return False
+                if record['csv_status'] is not None and (row.get('status') or '') != record['csv_status']:
+                    return False
+        return next(stored, None) is None
+
+    def export_csv(self, csv_path):
+        """
+        导出全部行到CSV（与 load_alpha_list_from_csv 读取的格式一致）
+
+        先写临时文件再替换，中途出错不会破坏原CSV。原CSV与上次导入/导出时不一致（见 csv_in_sync）时
+        先备份为 <CSV路径>.<时间>.bak 再替换，不覆盖掉没有导入过的内容。
+
+        Returns:
+            str | None: 备份文件路径，没有备份时为None
+        """
+        backup_path = None
+        if os.path.exists(csv_path) and not self.csv_in_sync(csv_path):
+            backup_path = f"{csv_path}.{datetime.now().strftime('%Y%m%d-%H%M%S')}.bak"
+            shutil.copy2(csv_path, backup_path)
+            print(f"警告: {csv_path} 在导入后被修改过，与状态数据库不一致，导出前已备份到 {backup_path}")
+        tmp_path = csv_path + '.tmp'
+        # 状态与上次导入/导出时不同的行，替换成功后记录CSV中的新状态
+        changed = []
+        with self._lock:
+            extra_columns = []
+            for (extra,) in self._conn.execute("SELECT DISTINCT extra FROM alphas"):
+                for key in json.loads(extra):
+                    if key not in extra_columns:
+                        extra_columns.append(key)
+            cursor = self._conn.execute(
+                "SELECT row_id, type, settings, regular, status, alpha_id, check_result, "
+                "completed_time, extra, csv_status FROM alphas ORDER BY row_id"
+            )
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(CSV_COLUMNS[:3] + extra_columns + CSV_COLUMNS[3:])
+                for row in cursor:
+                    extra = json.loads(row['extra'])
+                    writer.writerow(
+                        [row['type'], row['settings'], row['regular']]
+                        + [extra.get(col, '') for col in extra_columns]
+                        + [row['status'], row['alpha_id'], row['check_result'], row['completed_time']]
+                    )
+                    if row['status'] != row['csv_status']:
+                        changed.append((row['status'], row['row_id']))
+        os.replace(tmp_path, csv_path)
+        self._set_csv_status(changed)
+        return backup_path
+
+    def status_counts(self):
+        """各状态的数量 {status: count}"""
+        with self._lock:
+            return {
+                status: count for status, count in self._conn.execute(
+                    "SELECT status, COUNT(*) FROM alphas GROUP BY status"
+                )
+            }
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM alphas WHERE status IN (?, ?) OR status IS NULL",
+                PENDING_STATUSES
+            ).fetchone()[0]
+
+    def alpha_ids(self, status):
+        """某个状态下已有 Alpha ID 的行的 Alpha ID 列表（如本地记录的 SUCCESS alpha）"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT alpha_id FROM alphas WHERE status = ? AND alpha_id != '' ORDER BY row_id", (status,)
+            )]
+
+    def pending(self, limit=None):
+        """
+        待处理的alpha（按行号顺序），一次全部读出；行数很多时用 iter_pending()
+
+        Returns:
+            list[TaskRecord]: 每行可以按列名取值，如 row['regular']、row['settings']、row['row_id']
+        """
+        rows = self.iter_pending()
+        if limit is not None:
+            rows = (row for row, _ in zip(rows, range(limit)))
+        return list(rows)
+
+    def iter_pending(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        按行号顺序逐行给出待处理的alpha，每次从数据库读出chunk_size行
+
+        按行号分页（row_id > 上一块的最后一行），每块沿主键顺序扫描，不依赖OFFSET；
+        已经给出的行在迭代过程中被写回结果不影响后面的分页。
+
+        Yields:
+            TaskRecord
+        """
+        last_row_id = -1
+        while True:
+            with self._lock:
+                cursor = self._conn.cursor()
+                cursor.row_factory = TaskRecord.from_row
+                # +status：不走状态索引（两个状态分别扫描后还要排序），沿主键扫描到够一块为止
+                chunk = cursor.execute(
+                    f"SELECT {TASK_COLUMNS} FROM alphas "
+                    "WHERE row_id > ? AND (+status IN (?, ?) OR +status IS NULL) ORDER BY row_id LIMIT ?",
+                    (last_row_id,) + PENDING_STATUSES + (chunk_size,)
+                ).fetchall()
+            if not chunk:
+                return
+            yield from chunk
+            last_row_id = chunk[-1].row_id
+
+    def in_flight_count(self):
+        """已经提交、尚未得出最终结果的行数（重新运行时从记录的阶段继续）"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM alphas WHERE (status IN (?, ?) OR status IS NULL) AND stage != ''",
+                PENDING_STATUSES
+            ).fetchone()[0]
+
+    def record_submitted(self, row_ids, progress_url, account=''):
+        """
+        记录已提交的仿真及其进度URL（提交成功后立即调用）
+
+        Args:
+            row_ids: 同一个仿真请求中的行号，按提交顺序；多于一个时为multi-simulation，
+                     batch_index 记录每行在父仿真 children 中的位置
+            progress_url: 提交返回的Location
+            account: 提交仿真的账号；进度URL和Alpha ID只有这个账号能访问
+        """
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        batch = len(row_ids) > 1
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "UPDATE alphas SET stage = ?, progress_url = ?, batch_index = ?, stage_time = ?, "
+                    "submit_account = ? WHERE row_id = ?",
+                    [(STAGE_SUBMITTED, progress_url, i if batch else -1, now, account or '', row_id)
+                     for i, row_id in enumerate(row_ids)]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def record_stage(self, row_id, stage, alpha_id=None, check_result=None):
+        """
+        记录一行进入的阶段（单行事务）
+
+        Args:
+            row_id: 行号
+            stage: STAGE_COMPLETED / STAGE_CHECKED / STAGE_TAGGED
+            alpha_id: 仿真完成时的Alpha ID，None表示不修改
+            check_result: 检查完成时的检查结果，None表示不修改
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE alphas SET stage = ?, alpha_id = COALESCE(?, alpha_id), "
+                "check_result = COALESCE(?, check_result), stage_time = ? WHERE row_id = ?",
+                (stage, str(alpha_id) if alpha_id else None, check_result,
+                 datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row_id)
+            )
+
+    def record_result(self, row_id, success, alpha_id, check_result):
+        """
+        以单行事务记录一个alpha的处理结果
+
+        Args:
+            row_id: 行号
+            success: 是否检查通过
+            alpha_id: Alpha ID
+            check_result: 检查结果
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE alphas SET status = ?, alpha_id = ?, check_result = ?, completed_time = ?, "
+                "lease_owner = '', lease_expires = 0 WHERE row_id = ?",
+                (
+                    'SUCCESS' if success else 'FAILED',
+                    str(alpha_id) if alpha_id else '',
+                    check_result,
+                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    row_id,
+                )
+            )
+
+
+    def record_skipped(self, row_id, status, detail=''):
+        """
+        以单行事务记录一个未仿真就被跳过的alpha（如族剪枝）
+
+        Args:
+            row_id: 行号
+            status: 跳过原因，如 'PRUNED_LOW_SHARPE'，写入状态列
+            detail: 说明，写入 check_result 列
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE alphas SET status = ?, check_result = ?, completed_time = ?, "
+                "lease_owner = '', lease_expires = 0 WHERE row_id = ?",
+                (status, detail, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row_id)
+            )
+
+    def claim(self, owner, limit=1, lease_seconds=120.0, account=None):
+        """
+        领取至多limit个待处理且没有有效租约的行（按行号顺序），租约到期前其他runner领不到这些行
+
+        租约过期（runner崩溃或失联、没有续租）的行会被重新领取，attempts 记录被领取的次数。
+        重新领取的行如果由别的账号提交过，清除其处理阶段、进度URL和Alpha ID（新账号无权访问），
+        由新的领取者重新提交。
+
+        Args:
+            owner: 领取者ID，如 主机名-进程号
+            limit: 最多领取的行数
+            lease_seconds: 租约时长（秒），需在到期前调用 heartbeat 续租
+            account: 领取者使用的账号，None表示不检查提交账号
+
+        Returns:
+            list[dict]: 领取到的行，列与 pending() 相同
+        """
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE 先拿写锁，多个进程同时领取时不会领到同一行
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    f"SELECT {TASK_COLUMNS} FROM alphas "
+                    "WHERE (status IN (?, ?) OR status IS NULL) AND lease_expires < ? "
+                    "ORDER BY row_id LIMIT ?",
+                    PENDING_STATUSES + (now, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE alphas SET lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                    "WHERE row_id = ?",
+                    [(owner, now + lease_seconds, row['row_id']) for row in rows]
+                )
+                rows = [dict(row) for row in rows]
+                foreign = [row for row in rows
+                           if account is not None and row['stage'] and row['submit_account'] != account]
+                self._conn.executemany(
+                    "UPDATE alphas SET stage = '', progress_url = '', batch_index = -1, alpha_id = '', "
+                    "check_result = '', submit_account = '' WHERE row_id = ?",
+                    [(row['row_id'],) for row in foreign]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        for row in foreign:
+            row.update(stage='', progress_url='', batch_index=-1, alpha_id='', check_result='', submit_account='')
+        return rows
+
+    def heartbeat(self, owner, row_ids, lease_seconds=120.0):
+        """
+        为owner持有的行续租
+
+        Returns:
+            list[int]: 续租成功的行号；不在其中的行租约已过期并被其他runner领走，或已经有结果
+        """
+        if not row_ids:
+            return []
+        expires = time.time() + lease_seconds
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                renewed = []
+                for row_id in row_ids:
+                    cursor = self._conn.execute(
+                        "UPDATE alphas SET lease_expires = ? WHERE row_id = ? AND lease_owner = ? "
+                        "AND (status IN (?, ?) OR status IS NULL)",
+                        (expires, row_id, owner) + PENDING_STATUSES
+                    )
+                    if cursor.rowcount:
+                        renewed.append(row_id)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return renewed
+
+    def release(self, owner, row_ids):
+        """归还owner持有但未处理完的行，其他runner可以立即领取"""
+        if not row_ids:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "UPDATE alphas SET lease_owner = '', lease_expires = 0 WHERE row_id = ? AND lease_owner = ?",
+                    [(row_id, owner) for row_id in row_ids]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def lease_counts(self):
+        """各runner当前持有的有效租约数量 {owner: count}"""
+        with self._lock:
+            return {
+                owner: count for owner, count in self._conn.execute(
+                    "SELECT lease_owner, COUNT(*) FROM alphas WHERE lease_owner != '' AND lease_expires >= ? "
+                    "AND (status IN (?, ?) OR status IS NULL) GROUP BY lease_owner",
+                    (time.time(),) + PENDING_STATUSES
+                )
+            }
+
+
+class PendingTaskQueue:
+    """
+    按需从状态数据库读出待处理行的任务队列（线程安全）
+
+    可以直接替代 run_threaded / run_scheduled 的 tasks 列表，接口与 work_queue.LeasedTaskQueue 相同：
+    行在被取出时才从数据库分块读出，取出后记在 rows 中，结果写回后调用 finish() 丢弃，
+    所以内存中只有正在处理的行（加上一块预读），与待处理行的总数无关。
+    """
+
+    def __init__(self, store, max_tasks=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Args:
+            store: AlphaStateStore
+            max_tasks: 最多取出的任务数，None表示直到没有待处理的行
+            chunk_size: 每次从数据库读出的行数
+        """
+        self.max_tasks = max_tasks
+        # 已取出、尚未写回结果的行 {row_id: TaskRecord}，结果仓库按行号查原始行
+        self.rows = {}
+        total = store.pending_count()
+        self._total = total if max_tasks is None else min(max_tasks, total)
+        self._records = store.iter_pending(chunk_size)
+        self._issued = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """启动时待处理的行数（受 max_tasks 限制）"""
+        return self._total
+
+    def __iter__(self):
+        while True:
+            task = self.next_task()
+            if task is None:
+                return
+            yield task
+
+    def next_task(self):
+        """取出下一个任务 (alpha_row, row_index, index, total)，没有待处理的行或达到 max_tasks 时返回None"""
+        with self._lock:
+            if self.max_tasks is not None and self._issued >= self.max_tasks:
+                return None
+            row = next(self._records, None)
+            if row is None:
+                return None
+            self.rows[row.row_id] = row
+            index = self._issued
+            self._issued += 1
+        return row, row.row_id, index, self._total
+
+    def finish(self, row_id):
+        """行的结果已写回状态数据库，不再保留"""
+        with self._lock:
+            self.rows.pop(row_id, None)
+
+
+def resume_point(row):
+    """
+    行上次处理到的阶段（pending() / claim() 返回的行）
+
+    Returns:
+        tuple: (stage, progress_url, batch_index, alpha_id, check_result)，没有提交过的行返回None
+    """
+    stage = row['stage'] if 'stage' in row.keys() else ''
+    if not stage:
+        return None
+    batch_index = row['batch_index']
+    return (stage, row['progress_url'], -1 if batch_index is None else batch_index,
+            row['alpha_id'], row['check_result'])
+
+
+def default_db_path(csv_path):
+    """CSV对应的状态数据库路径"""
+    return csv_path + '.state.db'
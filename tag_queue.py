@@ -0,0 +1,250 @@
+# 后台打标签队列
+# 功能：PERFECT / SUCCESS / POTENTIAL 标签不再由仿真线程当场PATCH，而是写入持久化队列（SQLite WAL）立即返回；
+#      后台线程按批取出到期的写入，经 requests_wq（进程级限流器）逐个PATCH，失败的按指数退避单独重试；
+#      同一个alpha的多次写入合并成一次（标签取并集，其他属性以最后一次为准）；
+#      未完成的写入保存在数据库中，程序中断后下次启动（或 python tag_queue.py）会继续发送。
+#
+# 用法:
+#     tagger = TagQueue(default_tag_db_path(csv_path), pool).start()
+#     tagger.enqueue(alpha_id, tags="SUCCESS", regular_desc="...")   # 不发请求，立即返回
+#     tagger.close()                                                  # 发送剩余的写入后停止
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from simulate_and_check_for1 import set_alpha_properties
+from rate_limiter import backoff_delay
+from metrics import METRICS
+
+
+class TagQueue:
+    """
+    持久化的alpha属性写入队列（线程安全）
+
+    每个alpha只有一行：未发送时再次写入会合并到同一行，version 每次写入加1，
+    发送完成时只在 version 未变化时标记为 DONE，发送期间新合并进来的标签不会丢失。
+    """
+
+    def __init__(self, db_path, pool=None, batch_size=20, max_attempts=8, poll_interval=1.0):
+        """
+        Args:
+            db_path: 队列数据库路径
+            pool: SessionPool会话池，后台线程从中借用会话（只入队不发送时可以为None）
+            batch_size: 后台线程每次取出的写入数量
+            max_attempts: 单个写入最多尝试次数，超过后标记为 FAILED
+            poll_interval: 队列为空时检查新写入的最长间隔秒数
+        """
+        self.db_path = db_path
+        self.pool = pool
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closing = threading.Event()
+        self._thread = None
+        self.sent = 0
+        self.failed = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tag_writes (
+                alpha_id TEXT PRIMARY KEY,
+                tags TEXT NOT NULL,
+                properties TEXT NOT NULL,
+                status TEXT DEFAULT 'PENDING',
+                version INTEGER DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL DEFAULT 0,
+                last_error TEXT DEFAULT '',
+                updated_time TEXT DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS idx_tag_writes_due ON tag_writes(status, next_attempt_at);
+        """)
+
+    def start(self):
+        """启动后台发送线程（上次运行遗留的写入也会被发送）"""
+        if self.pool is None:
+            raise ValueError("启动后台发送线程需要会话池")
+        self._thread = threading.Thread(target=self._run, name='tagger', daemon=True)
+        self._thread.start()
+        pending = self.pending_count()
+        if pending:
+            print(f"[打标签队列] 有 {pending} 个待发送的写入")
+        return self
+
+    def close(self, timeout=120.0):
+        """
+        发送完已到期的写入后停止后台线程并关闭数据库
+
+        Args:
+            timeout: 最长等待秒数；超时或仍在退避中的写入留在数据库中，下次启动时继续发送
+        """
+        if self._thread is not None:
+            self._closing.set()
+            self._wakeup.set()
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                print(f"[打标签队列] {timeout:.0f} 秒内未发送完，剩余写入下次启动时继续")
+                return
+        with self._lock:
+            self._conn.close()
+
+    def enqueue(self, alpha_id, tags="SUCCESS", **properties):
+        """
+        加入一次属性写入（参数同 set_alpha_properties），立即返回
+
+        同一个alpha已有写入时合并：标签取并集，其他属性以本次为准；已发送过的alpha会再发送一次合并后的标签。
+        """
+        tags = [tags] if isinstance(tags, str) else list(tags)
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tags, properties FROM tag_writes WHERE alpha_id = ?", (str(alpha_id),)
+            ).fetchone()
+            if row is not None:
+                merged_tags = json.loads(row['tags'])
+                merged_tags += [tag for tag in tags if tag not in merged_tags]
+                merged_properties = json.loads(row['properties'])
+                merged_properties.update(properties)
+                tags, properties = merged_tags, merged_properties
+            self._conn.execute(
+                "INSERT INTO tag_writes (alpha_id, tags, properties, updated_time) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(alpha_id) DO UPDATE SET tags = excluded.tags, properties = excluded.properties, "
+                "status = 'PENDING', version = version + 1, attempts = 0, next_attempt_at = 0, "
+                "last_error = '', updated_time = excluded.updated_time",
+                (str(alpha_id), json.dumps(tags), json.dumps(properties, ensure_ascii=False), now)
+            )
+        METRICS.inc('tag_writes_enqueued_total')
+        self._wakeup.set()
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM tag_writes WHERE status = 'PENDING'"
+            ).fetchone()[0]
+
+    def status_counts(self):
+        """各状态的写入数量 {status: count}"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM tag_writes GROUP BY status"))
+
+    def retry_failed(self):
+        """把已放弃(FAILED)的写入重新加入队列，返回数量"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE tag_writes SET status = 'PENDING', attempts = 0, next_attempt_at = 0 WHERE status = 'FAILED'"
+            )
+        self._wakeup.set()
+        return cursor.rowcount
+
+    def _due(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT alpha_id, tags, properties, version, attempts FROM tag_writes "
+                "WHERE status = 'PENDING' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (time.time(), self.batch_size)
+            ).fetchall()
+
+    def _next_due_in(self):
+        """距离最早一个退避中的写入到期的秒数，没有待发送的写入时返回None"""
+        with self._lock:
+            next_at = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM tag_writes WHERE status = 'PENDING'"
+            ).fetchone()[0]
+        return None if next_at is None else max(0.0, next_at - time.time())
+
+    def _run(self):
+        while True:
+            batch = self._due()
+            if batch:
+                self._send_batch(batch)
+                continue
+            METRICS.set_gauge('tag_queue_pending', self.pending_count())
+            if self._closing.is_set():
+                return
+            next_due = self._next_due_in()
+            timeout = self.poll_interval if next_due is None else min(next_due, self.poll_interval)
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def _send_batch(self, batch):
+        """逐个发送一批写入，结果在一个事务中写回"""
+        updates = []
+        with self.pool.session() as sess:
+            for row in batch:
+                alpha_id = row['alpha_id']
+                tags = json.loads(row['tags'])
+                try:
+                    response, sess = set_alpha_properties(
+                        sess, alpha_id, tags=tags, **json.loads(row['properties'])
+                    )
+                    error = None if response is not None and response.status_code in (200, 201) else \
+                        f"状态码: {response.status_code if response is not None else 'None'}"
+                except Exception as e:
+                    error = str(e)
+                updates.append((row, tags, error))
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                for row, tags, error in updates:
+                    if error is None:
+                        self._conn.execute(
+                            "UPDATE tag_writes SET status = 'DONE', attempts = attempts + 1, last_error = '', "
+                            "updated_time = ? WHERE alpha_id = ? AND version = ?",
+                            (now, row['alpha_id'], row['version'])
+                        )
+                        continue
+                    attempts = row['attempts'] + 1
+                    status = 'FAILED' if attempts >= self.max_attempts else 'PENDING'
+                    self._conn.execute(
+                        "UPDATE tag_writes SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, "
+                        "updated_time = ? WHERE alpha_id = ? AND version = ?",
+                        (status, attempts, time.time() + backoff_delay(attempts, base=2.0, cap=300.0),
+                         error, now, row['alpha_id'], row['version'])
+                    )
+        for row, tags, error in updates:
+            if error is None:
+                self.sent += 1
+                METRICS.inc('tag_writes_total', result='ok')
+                print(f"[打标签队列] ✓ 成功为Alpha {row['alpha_id']} 打上 {','.join(tags)} 标签")
+            else:
+                self.failed += 1
+                METRICS.inc('tag_writes_total', result='error')
+                print(f"[打标签队列] 警告: Alpha {row['alpha_id']} 打标签失败（第{row['attempts'] + 1}次），{error}")
+
+
+def default_tag_db_path(csv_path):
+    """CSV对应的打标签队列数据库路径"""
+    return csv_path + '.tags.db'
+
+
+def main():
+    """发送打标签队列中遗留的写入（如上次运行中断时未发送完的）"""
+    from simulate_from_csv import DEFAULT_CSV_PATH
+    from session_pool import SessionPool
+    parser = argparse.ArgumentParser(description="发送打标签队列中未完成的写入")
+    parser.add_argument('--db', default=default_tag_db_path(DEFAULT_CSV_PATH), help='打标签队列数据库路径')
+    parser.add_argument('--retry-failed', action='store_true', help='把已放弃(FAILED)的写入重新加入队列')
+    args = parser.parse_args()
+
+    pool = SessionPool(size=1)
+    tagger = TagQueue(args.db, pool)
+    if args.retry_failed:
+        print(f"重新加入队列 {tagger.retry_failed()} 个写入")
+    print(f"队列状态: {tagger.status_counts()}")
+    tagger.start()
+    tagger.close(timeout=None)
+    print(f"已发送 {tagger.sent} 个，失败 {tagger.failed} 个")
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,467 @@
+# 基于租约的分布式工作队列
+# 功能：多台机器、多个账号共享同一批待仿真的alpha，不会重复仿真。
+#      待处理行保存在状态数据库（state_store.AlphaStateStore）中，runner按租约领取：
+#      claim 领取若干行并设置租约到期时间 → 处理期间后台线程定期 heartbeat 续租 → 写回结果时租约清除；
+#      runner崩溃或失联后不再续租，租约到期的行自动回到可领取状态，由其他runner重新领取。
+#      同一台机器上的多个runner可以直接共用一个状态数据库文件（SQLite WAL）；
+#      跨机器时由一个协调进程（本脚本 serve）持有数据库，通过HTTP提供同样的操作。
+#      每个runner是独立进程：各用自己的账号（WQ_CREDENTIALS 指定凭证文件）和自己的限流器额度，
+#      吞吐量随runner数量线性增加，直到协调进程成为瓶颈（每个alpha只有几次很小的数据库事务）。
+#
+# 用法:
+#     python work_queue.py serve --csv alphas.csv --host 0.0.0.0 --port 8790   # 协调进程
+#     WQ_CREDENTIALS=~/account_a.json python simulate_from_csv.py 5 --queue http://coordinator:8790
+#     WQ_CREDENTIALS=~/account_b.json python simulate_from_csv.py 5 --queue http://coordinator:8790
+#     python simulate_from_csv.py 5 --queue alphas.csv.state.db               # 同一台机器直接共用数据库
+#     python work_queue.py status --queue http://coordinator:8790
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from rate_limiter import backoff_delay
+from state_store import AlphaStateStore, default_db_path
+
+# 默认租约时长（秒）；runner每隔租约的1/3续租一次，连续错过约3次续租后租约过期
+DEFAULT_LEASE_SECONDS = 120.0
+
+# 协调进程默认每隔多少秒把状态导出回CSV
+DEFAULT_EXPORT_INTERVAL = 60.0
+
+# 访问协调进程的请求失败时的重试次数（协调进程重启期间结果不会丢失）
+REMOTE_RETRIES = 6
+
+
+def default_owner():
+    """本runner的租约持有者ID：主机名-进程号"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def open_queue(spec, token=None):
+    """
+    打开工作队列
+
+    Args:
+        spec: 协调进程地址（http:// 或 https:// 开头）或状态数据库文件路径
+        token: 协调进程的访问令牌
+
+    Returns:
+        RemoteQueue 或 AlphaStateStore，两者提供相同的 claim/heartbeat/release/record_* 方法
+    """
+    if spec.startswith(('http://', 'https://')):
+        return RemoteQueue(spec, token=token)
+    if not os.path.exists(spec):
+        raise FileNotFoundError(f"状态数据库不存在: {spec}")
+    return AlphaStateStore(spec)
+
+
+class RemoteQueue:
+    """
+    协调进程的HTTP客户端，方法与 AlphaStateStore 的租约和记录方法一致
+
+    请求失败时按指数退避重试，协调进程短暂重启不会让runner丢掉结果。
+    """
+
+    def __init__(self, url, token=None, timeout=30):
+        """
+        Args:
+            url: 协调进程地址，如 http://coordinator:8790
+            token: 访问令牌，与协调进程的 --token 一致
+            timeout: 单个请求的超时秒数
+        """
+        self.url = url.rstrip('/')
+        self.db_path = self.url
+        self.timeout = timeout
+        self._sess = requests.Session()
+        if token:
+            self._sess.headers['X-Queue-Token'] = token
+
+    def _request(self, method, path, body=None):
+        for attempt in range(REMOTE_RETRIES):
+            try:
+                resp = self._sess.request(method, self.url + path, json=body, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                if attempt == REMOTE_RETRIES - 1:
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"[工作队列] 访问协调进程失败: {e}，{delay:.1f} 秒后重试")
+                time.sleep(delay)
+                continue
+            if resp.status_code >= 500 and attempt < REMOTE_RETRIES - 1:
+                time.sleep(backoff_delay(attempt))
+                continue
+            if resp.status_code != 200:
+                raise RuntimeError(f"协调进程返回 {resp.status_code}: {resp.text[:200]}")
+            return resp.json()
+
+    def claim(self, owner, limit=1, lease_seconds=DEFAULT_LEASE_SECONDS, account=None):
+        return self._request('POST', '/claim', {
+            'owner': owner, 'limit': limit, 'lease_seconds': lease_seconds, 'account': account,
+        })['rows']
+
+    def heartbeat(self, owner, row_ids, lease_seconds=DEFAULT_LEASE_SECONDS):
+        return self._request('POST', '/heartbeat', {
+            'owner': owner, 'row_ids': list(row_ids), 'lease_seconds': lease_seconds,
+        })['renewed']
+
+    def release(self, owner, row_ids):
+        self._request('POST', '/release', {'owner': owner, 'row_ids': list(row_ids)})
+
+    def record_submitted(self, row_ids, progress_url, account=''):
+        self._request('POST', '/submitted', {
+            'row_ids': list(row_ids), 'progress_url': progress_url, 'account': account,
+        })
+
+    def record_stage(self, row_id, stage, alpha_id=None, check_result=None):
+        self._request('POST', '/stage', {
+            'row_id': row_id, 'stage': stage,
+            'alpha_id': str(alpha_id) if alpha_id else None, 'check_result': check_result,
+        })
+
+    def record_result(self, row_id, success, alpha_id, check_result):
+        self._request('POST', '/result', {
+            'row_id': row_id, 'success': bool(success),
+            'alpha_id': str(alpha_id) if alpha_id else '', 'check_result': check_result,
+        })
+
+    def record_skipped(self, row_id, status, detail=''):
+        self._request('POST', '/skip', {'row_id': row_id, 'status': status, 'detail': detail})
+
+    def status_counts(self):
+        return self._request('GET', '/status')['counts']
+
+    def pending_count(self):
+        return self._request('GET', '/status')['pending']
+
+    def in_flight_count(self):
+        return self._request('GET', '/status')['in_flight']
+
+    def lease_counts(self):
+        return self._request('GET', '/status')['leases']
+
+    def alpha_ids(self, status):
+        return self._request('GET', f'/alpha-ids?status={status}')['alpha_ids']
+
+    def close(self):
+        self._sess.close()
+
+
+class LeasedTaskQueue:
+    """
+    从工作队列按租约领取任务的任务队列（线程安全）
+
+    可以直接替代 run_threaded / run_scheduled 的 tasks 列表：两种模式都在有空闲名额时才取下一个任务，
+    所以每个runner只领取自己马上要处理的行，其余行留给其他runner。
+    领取到的行由后台线程定期续租；结果写回后调用 finish()，关闭时归还尚未处理完的行。
+    """
+
+    def __init__(self, backend, owner=None, lease_seconds=DEFAULT_LEASE_SECONDS, prefetch=1, max_tasks=None,
+                 account=None):
+        """
+        Args:
+            backend: open_queue() 返回的工作队列
+            owner: 租约持有者ID，默认 主机名-进程号
+            account: 本runner使用的账号；领取到别的账号提交过的行时从头重新提交，None表示不检查
+            lease_seconds: 租约时长（秒）
+            prefetch: 每次领取的行数
+            max_tasks: 本runner最多领取的任务数，None表示直到队列取空
+        """
+        self.backend = backend
+        self.owner = owner or default_owner()
+        self.lease_seconds = lease_seconds
+        self.prefetch = max(1, prefetch)
+        self.max_tasks = max_tasks
+        self.account = account
+        # 领取到、尚未写回结果的行 {row_id: 行}，结果仓库按行号查原始行
+        self.rows = {}
+        self.lost = 0
+        self._buffer = []
+        self._issued = 0
+        self._exhausted = False
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        total = backend.pending_count()
+        self._total = total if max_tasks is None else min(max_tasks, total)
+        self._heartbeat = threading.Thread(target=self._renew, name='lease-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def __len__(self):
+        """启动时共享队列中待处理的行数（受 max_tasks 限制），只用于显示进度"""
+        return self._total
+
+    def __iter__(self):
+        while True:
+            task = self.next_task()
+            if task is None:
+                return
+            yield task
+
+    def next_task(self):
+        """领取下一个任务 (alpha_row, row_index, index, total)，队列取空或达到 max_tasks 时返回None"""
+        with self._lock:
+            if self._exhausted or (self.max_tasks is not None and self._issued >= self.max_tasks):
+                return None
+            if not self._buffer:
+                limit = self.prefetch
+                if self.max_tasks is not None:
+                    limit = min(limit, self.max_tasks - self._issued)
+                claimed = self.backend.claim(self.owner, limit, self.lease_seconds, self.account)
+                if not claimed:
+                    self._exhausted = True
+                    return None
+                for row in claimed:
+                    self.rows[row['row_id']] = row
+                self._buffer.extend(claimed)
+            row = self._buffer.pop(0)
+            index = self._issued
+            self._issued += 1
+        return row, row['row_id'], index, self._total
+
+    def finish(self, row_id):
+        """行的结果已写回工作队列（租约随之清除），不再续租"""
+        with self._lock:
+            self.rows.pop(row_id, None)
+
+    def held(self):
+        """当前持有租约的行号"""
+        with self._lock:
+            return list(self.rows)
+
+    def _renew(self):
+        interval = self.lease_seconds / 3
+        while not self._stopped.wait(interval):
+            row_ids = self.held()
+            if not row_ids:
+                continue
+            try:
+                renewed = set(self.backend.heartbeat(self.owner, row_ids, self.lease_seconds))
+            except Exception as e:
+                print(f"[工作队列] 续租失败: {e}")
+                continue
+            # 刚写回结果的行也不在续租成功之列，只有仍在处理中的行算作租约丢失
+            lost = [row_id for row_id in row_ids if row_id not in renewed and row_id in self.rows]
+            if lost:
+                self.lost += len(lost)
+                print(f"[工作队列] {len(lost)} 个行的租约已过期并可能被其他runner领取: {lost[:10]}")
+
+    def close(self):
+        """停止续租，归还已领取但未处理完的行"""
+        self._stopped.set()
+        row_ids = self.held()
+        if row_ids:
+            try:
+                self.backend.release(self.owner, row_ids)
+                print(f"[工作队列] 归还 {len(row_ids)} 个未处理完的行")
+            except Exception as e:
+                print(f"[工作队列] 归还租约失败，{self.lease_seconds:.0f} 秒后租约自动过期: {e}")
+
+
+class CoordinatorServer(ThreadingHTTPServer):
+    """
+    协调进程：持有状态数据库，通过HTTP JSON接口提供领取、续租、归还、写回结果
+
+    接口:
+        POST /claim      {owner, limit, lease_seconds, account} -> {rows}
+        POST /heartbeat  {owner, row_ids, lease_seconds} -> {renewed}
+        POST /release    {owner, row_ids}
+        POST /submitted  {row_ids, progress_url, account}
+        POST /stage      {row_id, stage, alpha_id, check_result}
+        POST /result     {row_id, success, alpha_id, check_result}
+        POST /skip       {row_id, status, detail}
+        GET  /status     -> {counts, pending, in_flight, leases}
+        GET  /alpha-ids?status=SUCCESS -> {alpha_ids}
+    """
+
+    daemon_threads = True
+
+    def __init__(self, store, host='127.0.0.1', port=8790, token=None):
+        """
+        Args:
+            store: AlphaStateStore
+            host: 监听地址，其他机器访问时用 0.0.0.0
+            port: 端口
+            token: 访问令牌，设置后请求头 X-Queue-Token 不一致的请求返回401
+        """
+        self.store = store
+        self.token = token
+        super().__init__((host, port), _CoordinatorHandler)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def dispatch(self, method, path, query, body):
+        """处理一个请求，返回 (状态码, 响应体)"""
+        store = self.store
+        if method == 'GET' and path == '/status':
+            return 200, {'counts': store.status_counts(), 'pending': store.pending_count(),
+                         'in_flight': store.in_flight_count(), 'leases': store.lease_counts()}
+        if method == 'GET' and path == '/alpha-ids':
+            status = query.get('status', ['SUCCESS'])[0]
+            return 200, {'alpha_ids': store.alpha_ids(status)}
+        if method != 'POST' or body is None:
+            return 404, {'error': f'未知接口 {method} {path}'}
+        if path == '/claim':
+            rows = store.claim(body['owner'], int(body.get('limit', 1)),
+                               float(body.get('lease_seconds', DEFAULT_LEASE_SECONDS)), body.get('account'))
+            return 200, {'rows': rows}
+        if path == '/heartbeat':
+            renewed = store.heartbeat(body['owner'], body['row_ids'],
+                                      float(body.get('lease_seconds', DEFAULT_LEASE_SECONDS)))
+            return 200, {'renewed': renewed}
+        if path == '/release':
+            store.release(body['owner'], body['row_ids'])
+            return 200, {}
+        if path == '/submitted':
+            store.record_submitted(body['row_ids'], body['progress_url'], body.get('account', ''))
+            return 200, {}
+        if path == '/stage':
+            store.record_stage(body['row_id'], body['stage'], body.get('alpha_id'), body.get('check_result'))
+            return 200, {}
+        if path == '/result':
+            store.record_result(body['row_id'], body['success'], body.get('alpha_id'), body.get('check_result'))
+            return 200, {}
+        if path == '/skip':
+            store.record_skipped(body['row_id'], body['status'], body.get('detail', ''))
+            return 200, {}
+        return 404, {'error': f'未知接口 {method} {path}'}
+
+
+class _CoordinatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # 不打印每个请求
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if self.server.token and self.headers.get('X-Queue-Token') != self.server.token:
+            self.send_json(401, {'error': '访问令牌不正确'})
+            return
+        url = urlsplit(self.path)
+        try:
+            body = json.loads(raw) if raw else None
+            status, response = self.server.dispatch(method, url.path, parse_qs(url.query), body)
+        except (ValueError, KeyError, TypeError) as e:
+            status, response = 400, {'error': f'请求格式错误: {e}'}
+        except Exception as e:
+            print(f"[协调进程] 处理 {method} {url.path} 时发生错误: {e}")
+            status, response = 500, {'error': str(e)}
+        self.send_json(status, response)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+def print_status(backend):
+    """打印各状态数量和各runner持有的租约数量"""
+    print("当前状态统计:")
+    for status, count in backend.status_counts().items():
+        print(f"  {status}: {count}")
+    print(f"待处理: {backend.pending_count()}")
+    print(f"其中已提交、可断点续跑: {backend.in_flight_count()}")
+    leases = backend.lease_counts()
+    print(f"持有租约的runner: {len(leases)}")
+    for owner, count in sorted(leases.items()):
+        print(f"  {owner}: {count}")
+
+
+def main():
+    """命令行入口：serve 启动协调进程，import 导入CSV到状态数据库，status 查看队列状态"""
+    # 延迟导入，避免与 simulate_from_csv 循环导入
+    from simulate_from_csv import DEFAULT_CSV_PATH
+
+    parser = argparse.ArgumentParser(description="基于租约的分布式工作队列")
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='启动协调进程')
+    serve.add_argument('--csv', default=DEFAULT_CSV_PATH, help='待仿真alpha列表CSV路径')
+    serve.add_argument('--state-db', default=None, help='状态数据库路径（默认为 <CSV路径>.state.db）')
+    serve.add_argument('--host', default='127.0.0.1', help='监听地址，其他机器访问时用 0.0.0.0')
+    serve.add_argument('--port', type=int, default=8790)
+    serve.add_argument('--token', default=os.environ.get('WQ_QUEUE_TOKEN'),
+                       help='访问令牌（默认取环境变量 WQ_QUEUE_TOKEN）')
+    serve.add_argument('--export-interval', type=float, default=DEFAULT_EXPORT_INTERVAL,
+                       help='每隔多少秒把状态导出回CSV，0表示只在退出时导出')
+    imp = sub.add_parser('import', help='把CSV中新增的行导入状态数据库（同机多runner直接共用数据库时使用）')
+    imp.add_argument('--csv', default=DEFAULT_CSV_PATH, help='待仿真alpha列表CSV路径')
+    imp.add_argument('--state-db', default=None, help='状态数据库路径（默认为 <CSV路径>.state.db）')
+    status = sub.add_parser('status', help='查看队列状态和各runner持有的租约')
+    status.add_argument('--queue', required=True, help='协调进程地址或状态数据库路径')
+    status.add_argument('--token', default=os.environ.get('WQ_QUEUE_TOKEN'), help='访问令牌')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        backend = open_queue(args.queue, token=args.token)
+        try:
+            print_status(backend)
+        finally:
+            backend.close()
+        return
+
+    if not os.path.exists(args.csv):
+        print(f"错误: CSV文件不存在: {args.csv}")
+        return
+    store = AlphaStateStore(args.state_db or default_db_path(args.csv))
+    try:
+        imported = store.import_csv(args.csv)
+    except ValueError as e:
+        print(f"错误: {e}")
+        store.close()
+        return
+    print(f"新导入 {imported} 个Alpha，状态数据库: {store.db_path}")
+    if args.command == 'import':
+        print_status(store)
+        store.close()
+        return
+
+    server = CoordinatorServer(store, args.host, args.port, token=args.token)
+    print(f"协调进程已启动: {server.base_url}")
+    print(f"runner使用方法: python simulate_from_csv.py 5 --queue {server.base_url}")
+    print_status(store)
+    thread = threading.Thread(target=server.serve_forever, name='coordinator', daemon=True)
+    thread.start()
+    try:
+        while True:
+            time.sleep(args.export_interval or 3600)
+            if args.export_interval:
+                # 先导入运行期间追加到CSV的行和手动修改的状态，导出时不会把它们覆盖掉
+                try:
+                    imported = store.import_csv(args.csv)
+                except ValueError as e:
+                    print(f"[协调进程] {e}，本次不导出")
+                    continue
+                if imported:
+                    print(f"[协调进程] 新导入 {imported} 个Alpha")
+                store.export_csv(args.csv)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        store.export_csv(args.csv)
+        print(f"状态已导出到 {args.csv}")
+        print_status(store)
+        store.close()
+
+
+if __name__ == "__main__":
+    main()